@@ -0,0 +1,212 @@
+"""
+Avatars image adressés par contenu
+
+Un avatar importé (profile.js, data URL) n'est plus recopié dans chaque
+trame et chaque événement : il est stocké une fois sous
+`<racine>/<sha256>.<ext>` et désigné partout par une référence
+`avatar:<sha256>`.
+
+- Trames CLIENT_AVATAR / SERVER_AVATAR : la référence. Le pair qui ne
+  connaît pas ce hash répond AVATAR_WANT et reçoit une seule trame AVATAR
+  (type MIME + octets), qu'il range dans son propre store. Un pair v1 (ou
+  antérieur) reçoit la data URL, comme avant. Une seule demande reste en
+  attente par connexion : la dernière annonce du pair remplace la
+  précédente, et la demande est oubliée à la déconnexion.
+- Événements Socket.IO : l'URL `/avatars/<sha256>`, cachable un an.
+- Les avatars emoji ou http(s) restent inchangés.
+"""
+
+import base64
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+import protocol
+
+REF_PREFIX = 'avatar:'
+URL_PREFIX = '/avatars/'
+
+# Images acceptées (pas de SVG : le script embarqué serait servi tel quel)
+EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif', 'image/webp': '.webp'}
+MIMETYPES = {extension: mimetype for mimetype, extension in EXTENSIONS.items()}
+
+AVATAR_MAX_SIZE = 1024 * 1024
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+_DATA_URL_RE = re.compile(r'^data:(image/[a-z.+-]+);base64,(.*)$', re.S)
+
+
+def parse_ref(avatar):
+    """Hash d'une référence `avatar:<sha256>` ou d'une URL `/avatars/<sha256>`, sinon None"""
+    if not avatar:
+        return None
+    for prefix in (REF_PREFIX, URL_PREFIX):
+        if avatar.startswith(prefix):
+            sha256 = avatar[len(prefix):]
+            return sha256 if _SHA256_RE.match(sha256) else None
+    return None
+
+
+def avatar_url(avatar):
+    """Forme d'un avatar pour l'UI web : URL `/avatars/<sha256>` pour une référence"""
+    sha256 = parse_ref(avatar)
+    return URL_PREFIX + sha256 if sha256 else avatar
+
+
+class AvatarStore:
+    """Dossier d'avatars nommés par leur SHA-256, et avatars demandés aux pairs"""
+
+    def __init__(self, root):
+        """
+        Args:
+            root: dossier des avatars
+        """
+        self.root = Path(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        # connexion -> (sha256, fonction à appeler) de l'avatar demandé (AVATAR_WANT)
+        self._wanted = {}
+
+    def path(self, sha256):
+        """
+        Fichier et type MIME d'un avatar stocké
+
+        Returns:
+            Tuple (chemin, mimetype), ou None si le hash est inconnu
+        """
+        if not _SHA256_RE.match(sha256 or ''):
+            return None
+        for extension, mimetype in MIMETYPES.items():
+            path = self.root / f"{sha256}{extension}"
+            if path.is_file():
+                return path, mimetype
+        return None
+
+    def has(self, sha256):
+        return self.path(sha256) is not None
+
+    def add(self, mimetype, data):
+        """
+        Stocke une image (sans effet si elle est déjà connue)
+
+        Returns:
+            SHA-256 du contenu
+
+        Raises:
+            ValueError: type non accepté ou image trop grande
+        """
+        if mimetype not in EXTENSIONS:
+            raise ValueError(f"Type d'avatar non accepté: {mimetype}")
+        if len(data) > AVATAR_MAX_SIZE:
+            raise ValueError(f"Avatar trop volumineux (max {AVATAR_MAX_SIZE // 1024} Ko)")
+        sha256 = hashlib.sha256(data).hexdigest()
+        if not self.has(sha256):
+            path = self.root / f"{sha256}{EXTENSIONS[mimetype]}"
+            tmp_path = path.with_suffix('.part')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return sha256
+
+    def read(self, sha256):
+        """Tuple (mimetype, octets) d'un avatar stocké, ou None"""
+        found = self.path(sha256)
+        if found is None:
+            return None
+        path, mimetype = found
+        with open(path, 'rb') as f:
+            return mimetype, f.read()
+
+    def to_ref(self, avatar):
+        """
+        Forme d'un avatar pour les trames et l'état en mémoire
+
+        Une data URL est stockée et remplacée par `avatar:<sha256>` ; une URL
+        `/avatars/<sha256>` (renvoyée par l'UI) redevient une référence ;
+        emoji et URL http(s) sont gardés tels quels.
+
+        Raises:
+            ValueError: data URL invalide, type non accepté ou image trop grande
+        """
+        match = _DATA_URL_RE.match(avatar or '')
+        if match:
+            try:
+                data = base64.b64decode(match.group(2), validate=True)
+            except ValueError:
+                raise ValueError("Data URL d'avatar invalide")
+            return REF_PREFIX + self.add(match.group(1), data)
+        sha256 = parse_ref(avatar)
+        if sha256:
+            return REF_PREFIX + sha256
+        return avatar
+
+    def to_legacy(self, avatar):
+        """
+        Forme d'un avatar pour un pair v1 (ou antérieur), qui ne sait pas
+        demander une image par AVATAR_WANT : data URL pour une référence
+
+        Returns:
+            Data URL de l'image stockée, ou `avatar` inchangé
+        """
+        sha256 = parse_ref(avatar)
+        found = self.read(sha256) if sha256 else None
+        if found is None:
+            return avatar
+        mimetype, data = found
+        return f"data:{mimetype};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def send(self, conn, ftype, avatar):
+        """Envoie une trame CLIENT_AVATAR / SERVER_AVATAR sous la forme que le pair comprend"""
+        conn.send_frame(ftype, avatar if conn.version >= 2 else self.to_legacy(avatar))
+
+    def resolve(self, avatar, conn, apply):
+        """
+        Applique un avatar reçu d'un pair, après l'avoir demandé s'il manque
+
+        Args:
+            avatar: valeur d'une trame CLIENT_AVATAR / SERVER_AVATAR
+            conn: connexion du pair (envoi de AVATAR_WANT)
+            apply: fonction appelée avec la forme référence de l'avatar, tout
+                de suite ou à l'arrivée de la trame AVATAR
+
+        Returns:
+            True si l'avatar a été appliqué tout de suite
+        """
+        avatar = self.to_ref(avatar)
+        sha256 = parse_ref(avatar)
+        if sha256 is None or self.has(sha256):
+            # Une demande encore en attente appliquerait ensuite un avatar périmé
+            self.forget(conn)
+            apply(avatar)
+            return True
+        with self.lock:
+            previous = self._wanted.get(conn)
+            self._wanted[conn] = (sha256, lambda: apply(avatar))
+        if previous is None or previous[0] != sha256:
+            conn.send_frame(protocol.AVATAR_WANT, sha256)
+        return False
+
+    def receive(self, value, conn):
+        """
+        Range l'avatar d'une trame AVATAR s'il a été demandé à ce pair, puis l'applique
+
+        Returns:
+            SHA-256 de l'avatar, ou None s'il n'était pas attendu
+        """
+        mimetype, data = protocol.decode_avatar(value)
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            waiting = self._wanted.get(conn)
+            if waiting is None or waiting[0] != sha256:
+                return None
+            del self._wanted[conn]
+        self.add(mimetype, data)
+        waiting[1]()
+        return sha256
+
+    def forget(self, conn):
+        """Oublie l'avatar demandé à un pair (déconnexion, avatar remplacé)"""
+        with self.lock:
+            self._wanted.pop(conn, None)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compression des trames v2 : octets sur le fil et CPU par trame
+
+Pour chaque charge typique (message court, texte long, journal collé,
+messages similaires répétés), N trames TEXT passent par un FrameCompressor
+puis un FrameDecoder, comme entre client_web et le serveur. Comparaison :
+sans compression, zlib avec un contexte neuf par trame, zlib et zstd
+(paquet `zstandard`, optionnel) avec le contexte de connexion.
+
+Usage:
+    python bench/bench_compression.py [nombre de trames]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+
+
+def payloads(count):
+    """Charges typiques : nom -> liste de `count` messages"""
+    rng = random.Random(5)
+    words = ("commande client livraison stock caisse ticket remise facture "
+             "fournisseur rayon inventaire retour paiement carte magasin").split()
+    levels = ('INFO', 'INFO', 'INFO', 'WARN', 'ERROR')
+
+    def sentence(n):
+        return ' '.join(rng.choice(words) for _ in range(n)).capitalize() + '.'
+
+    def log_line(i):
+        return (f"2026-10-18 09:{i // 60 % 60:02d}:{i % 60:02d}.{rng.randint(0, 999):03d} "
+                f"{rng.choice(levels):5} [caisse-{rng.randint(1, 6)}] ticket={rng.randint(10000, 99999)} "
+                f"montant={rng.randint(1, 50000) / 100:.2f} durée={rng.randint(2, 900)}ms")
+
+    return {
+        'message court (~60 o)': [sentence(8) for _ in range(count)],
+        'texte long (~3 Ko)': [' '.join(sentence(12) for _ in range(30)) for _ in range(count)],
+        'journal collé (~4 Ko)': ['\n'.join(log_line(i * 50 + j) for j in range(50)) for i in range(count)],
+        'rafale similaire (~400 o)': [f"Alerte stock rayon {i % 12} : {sentence(40)} (ref {10000 + i})"
+                                      for i in range(count)],
+    }
+
+
+def run(messages, codec, per_frame=False):
+    """
+    Returns:
+        Tuple (octets sur le fil, µs CPU par trame : compression + décompression)
+    """
+    frames = [protocol.encode(protocol.TEXT, message, 2) for message in messages]
+    wire = []
+    start = time.process_time()
+    compressor = protocol.FrameCompressor(codec) if codec else None
+    for frame in frames:
+        if per_frame:
+            compressor = protocol.FrameCompressor(codec)
+        wire.append(compressor.wrap(protocol.TEXT, frame) if compressor else frame)
+    decoder = None
+    for data in wire:
+        if per_frame or decoder is None:
+            decoder = protocol.FrameDecoder()
+        decoder.feed(data)
+    elapsed = time.process_time() - start
+    return sum(len(data) for data in wire), elapsed / len(frames) * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    variants = [('aucune', None, False), ('zlib (trame seule)', 'zlib', True), ('zlib (connexion)', 'zlib', False)]
+    if 'zstd' in protocol.available_codecs():
+        variants += [('zstd (trame seule)', 'zstd', True), ('zstd (connexion)', 'zstd', False)]
+    else:
+        print("zstd indisponible (pip install zstandard) : zlib seulement")
+    print(f"{count} trames TEXT par charge, seuil de compression {protocol.COMPRESS_MIN_SIZE} octets\n")
+    for name, messages in payloads(count).items():
+        print(name)
+        raw = None
+        for label, codec, per_frame in variants:
+            wire, cpu = run(messages, codec, per_frame)
+            raw = raw or wire
+            print(f"  {label:20} {wire / count:9.0f} o/trame  {wire / raw:6.1%}  {cpu:7.1f} µs/trame")
+        print()
+
+
+if __name__ == '__main__':
+    main()
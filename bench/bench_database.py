@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Débit de database.Database sur le chemin d'une ligne de chat
+
+- Écriture : save_message + increment_message_count, comme à chaque message
+  reçu par server_web
+- Lecture : get_messages d'une conversation de N messages, en entier puis
+  par page de 50 (la plus récente et la plus ancienne, via before_id)
+- Mixte : plusieurs lecteurs pendant qu'un thread écrit
+- Write-behind : coût de la ligne de chat pour l'appelant (mise en file),
+  puis attente de la validation sur disque (flush)
+
+Usage:
+    python bench/bench_database.py [nombre de messages] [nombre de lecteurs]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+
+
+def write_messages(db, client_id, count):
+    timestamp = datetime.now().isoformat()
+    for i in range(count):
+        db.save_message(client_id, 'received', 'bench', f'message {i}', timestamp)
+        db.increment_message_count(client_id)
+
+
+def read_messages(db, client_id, count):
+    for _ in range(count):
+        db.get_messages(client_id, limit=None)
+
+
+def read_pages(db, client_id, count, before_id=None):
+    for _ in range(count):
+        db.get_messages(client_id, before_id=before_id, limit=50)
+
+
+def rate(count, elapsed):
+    return f"{count / elapsed:10.0f} /s"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    reads = max(count // 20, 10)
+    tmp = tempfile.mkdtemp(prefix='lnm-db-')
+    db = Database(os.path.join(tmp, 'bench.db'))
+    db.update_client_history(1, 'bench', '127.0.0.1:0')
+    db.update_client_history(2, 'bench2', '127.0.0.1:0')
+
+    start = time.perf_counter()
+    write_messages(db, 1, count)
+    elapsed = time.perf_counter() - start
+    print(f"Écriture (save_message + increment_message_count) : {rate(count, elapsed)} lignes de chat")
+
+    start = time.perf_counter()
+    read_messages(db, 1, reads)
+    elapsed = time.perf_counter() - start
+    print(f"Lecture (get_messages, {count} messages)          : {rate(reads, elapsed)} conversations")
+
+    oldest = db.get_messages(1, limit=None)[50]['id']
+    for label, before_id in (("dernière page", None), ("page la plus ancienne", oldest)):
+        start = time.perf_counter()
+        read_pages(db, 1, reads * 20, before_id)
+        elapsed = time.perf_counter() - start
+        print(f"Lecture paginée ({label}, 50 messages) : {rate(reads * 20, elapsed)} pages")
+
+    # Lecteurs concurrents pendant qu'un autre client écrit
+    writer = threading.Thread(target=write_messages, args=(db, 2, count))
+    threads = [threading.Thread(target=read_messages, args=(db, 1, reads)) for _ in range(readers)]
+    start = time.perf_counter()
+    writer.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    read_elapsed = time.perf_counter() - start
+    writer.join()
+    write_elapsed = time.perf_counter() - start
+    print(f"Mixte, {readers} lecteurs + 1 écrivain : lecture {rate(readers * reads, read_elapsed)} conversations, "
+          f"écriture {rate(count, write_elapsed)} lignes de chat")
+    db.close()
+
+    # Écritures différées : l'appelant ne fait que mettre en file
+    db = Database(os.path.join(tmp, 'bench-wb.db'), write_behind=True)
+    db.update_client_history(1, 'bench', '127.0.0.1:0')
+    latencies = []
+    timestamp = datetime.now().isoformat()
+    start = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        db.save_message(1, 'received', 'bench', f'message {i}', timestamp)
+        db.increment_message_count(1)
+        latencies.append(time.perf_counter() - t0)
+    enqueued = time.perf_counter() - start
+    db.flush()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"Write-behind : {rate(count, elapsed)} lignes de chat validées ; côté appelant "
+          f"{enqueued / count * 1e6:.1f} µs/ligne (p99 {latencies[int(count * 0.99)] * 1e6:.1f} µs)")
+    stored = db.get_client_history(1)['message_count']
+    print(f"Write-behind : {stored}/{count} messages comptés après flush")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
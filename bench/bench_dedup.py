@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Même pièce jointe envoyée plusieurs fois : stockage et transfert dédupliqués
+
+1. N uploads du même fichier dans le BlobStore : un seul blob sur disque,
+   référencé N fois dans la table `files`.
+2. N envois v2 du même fichier à un récepteur : seul le premier transfère
+   des morceaux, les suivants s'arrêtent au FILE_HAVE complet.
+3. Suppression des N lignes : le blob disparaît avec la dernière.
+
+Le script échoue (code 1) si l'une de ces propriétés n'est pas vérifiée.
+
+Usage:
+    python bench/bench_dedup.py [taille en Mio] [nombre d'envois]
+"""
+
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+from blobstore import BlobStore
+from connection import SocketConnection
+from database import Database
+from transfer import IncomingTransfers, OutgoingTransfers
+
+
+class CountingConnection(SocketConnection):
+    """Compte les octets de contenu envoyés dans les trames FILE_CHUNK"""
+
+    sent = 0
+
+    def send_file_chunk(self, header, fileobj, offset, count):
+        super().send_file_chunk(header, fileobj, offset, count)
+        CountingConnection.sent += count
+
+
+def disk_usage(root):
+    total = 0
+    for dirpath, _dirs, files in os.walk(root):
+        for name in files:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def receiver(sock, store, db):
+    """Récepteur v2 minimal : enregistre chaque fichier reçu ou déjà présent"""
+    conn = SocketConnection(sock)
+    transfers = IncomingTransfers(store, db, peer='bench')
+    decoder = protocol.FrameDecoder()
+    try:
+        while True:
+            chunk = sock.recv(256 * 1024)
+            if not chunk:
+                break
+            for ftype, value in decoder.feed(chunk):
+                item = None
+                if ftype == protocol.FILE_BEGIN:
+                    _transfer, have = transfers.begin(value)
+                    conn.send(have)
+                elif ftype == protocol.FILE_CHUNK:
+                    transfers.chunk(value)
+                elif ftype == protocol.FILE_END:
+                    item, valid, ack = transfers.end(value)
+                    if ack is not None:
+                        conn.send(ack)
+                    if not valid:
+                        item = None
+                if item is not None:
+                    db.save_file(1, item.filename, item.mimetype, item.size, 'received', 'bench',
+                                 str(item.path), '', item.sha256, blob=item.sha256)
+    except OSError:
+        pass
+
+
+def sender_loop(sock, outgoing):
+    decoder = protocol.FrameDecoder()
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            for ftype, value in decoder.feed(chunk):
+                if ftype == protocol.FILE_HAVE:
+                    outgoing.on_have(value)
+    except OSError:
+        pass
+
+
+def main():
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 16) * 1024 * 1024
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    tmp = tempfile.mkdtemp(prefix='lnm-dedup-')
+    data = os.urandom(size)
+    ok = True
+
+    # 1. Uploads répétés côté émetteur
+    send_db = Database(os.path.join(tmp, 'send.db'))
+    send_store = BlobStore(os.path.join(tmp, 'send-blobs'), send_db)
+    start = time.perf_counter()
+    for i in range(count):
+        sha256, _size, path = send_store.add_stream(io.BytesIO(data).read)
+        send_db.save_file(1, f'copie{i}.bin', 'application/octet-stream', size, 'sent', 'bench',
+                          str(path), '', sha256, blob=sha256)
+    elapsed = time.perf_counter() - start
+    stored = disk_usage(send_store.root)
+    print(f"{count} uploads de {size / 1048576:.0f} Mio : {stored / 1048576:.1f} Mio sur disque "
+          f"(sans déduplication : {count * size / 1048576:.1f} Mio), {elapsed / count * 1000:.0f} ms/upload")
+    ok = ok and stored == size
+
+    # 2. Envois répétés vers un récepteur
+    recv_db = Database(os.path.join(tmp, 'recv.db'))
+    recv_store = BlobStore(os.path.join(tmp, 'recv-blobs'), recv_db)
+    a, b = socket.socketpair()
+    threading.Thread(target=receiver, args=(b, recv_store, recv_db), daemon=True).start()
+    conn = CountingConnection(a)
+    conn.version = 2
+    outgoing = OutgoingTransfers(send_db)
+    threading.Thread(target=sender_loop, args=(a, outgoing), daemon=True).start()
+
+    timings = []
+    for i in range(count):
+        before = CountingConnection.sent
+        start = time.perf_counter()
+        outgoing.send(conn, path, f'copie{i}.bin', 'application/octet-stream', peer='bench', sha256=sha256)
+        timings.append((time.perf_counter() - start, CountingConnection.sent - before))
+    deadline = time.monotonic() + 10
+    while len(recv_db.get_files(1)) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    print(f"Premier envoi      : {timings[0][1] / 1048576:.1f} Mio de morceaux, {timings[0][0] * 1000:.0f} ms")
+    repeat_bytes = sum(sent for _elapsed, sent in timings[1:])
+    repeat_time = sum(elapsed for elapsed, _sent in timings[1:]) / max(count - 1, 1)
+    print(f"Envois suivants    : {repeat_bytes} octets de morceaux, {repeat_time * 1000:.1f} ms/envoi")
+    received = disk_usage(recv_store.root)
+    print(f"Récepteur          : {received / 1048576:.1f} Mio sur disque, "
+          f"{len(recv_db.get_files(1))} fichiers enregistrés")
+    ok = ok and timings[0][1] == size and repeat_bytes == 0 and received == size
+    a.close()
+
+    # 3. Suppression : le blob part avec la dernière référence
+    rows = send_db.get_files(1)
+    for row in rows[:-1]:
+        send_store.delete_file(row['id'])
+    kept = send_store.has(sha256)
+    send_store.delete_file(rows[-1]['id'])
+    removed = not send_store.has(sha256)
+    print(f"Suppression        : blob conservé tant qu'il est référencé : {'OK' if kept else 'NON'}, "
+          f"supprimé avec la dernière ligne : {'OK' if removed else 'NON'}")
+    ok = ok and kept and removed
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
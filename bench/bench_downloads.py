@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Téléchargements répétés d'une même pièce jointe : ancien service
+(send_from_directory) vs file_serving (ETag SHA-256, 304, Range)
+
+Un serveur HTTP local (Werkzeug, comme socketio.run) sert le même fichier
+par les deux routes ; chaque scénario réouvre la pièce jointe N fois.
+
+Usage:
+    python bench/bench_downloads.py [taille en Mio] [nombre d'ouvertures]
+"""
+
+import http.client
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, send_from_directory
+from werkzeug.serving import make_server
+
+from database import Database
+from file_serving import SendfileMiddleware, send_stored_file
+
+
+def build_app(root, db, sendfile):
+    app = Flask(__name__)
+    if sendfile:
+        app.wsgi_app = SendfileMiddleware(app.wsgi_app)
+
+    @app.route('/legacy/<path:subpath>')
+    def legacy(subpath):
+        return send_from_directory(root, subpath, as_attachment=True)
+
+    @app.route('/files/<path:subpath>')
+    def files(subpath):
+        return send_stored_file(db, root, subpath)
+
+    return app
+
+
+def fetch(port, url, headers=None):
+    """Requête GET ; retourne (statut, octets de corps reçus, en-têtes)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', url, headers=headers or {})
+    response = conn.getresponse()
+    received = 0
+    while True:
+        block = response.read(1024 * 1024)
+        if not block:
+            break
+        received += len(block)
+    conn.close()
+    return response.status, received, response
+
+
+def scenario(name, port, count, url, headers=None):
+    start = time.perf_counter()
+    total = 0
+    for _ in range(count):
+        status, received, _response = fetch(port, url, headers)
+        total += received
+    elapsed = time.perf_counter() - start
+    print(f"{name:<38} statut {status}  {elapsed / count * 1000:8.2f} ms/ouverture  "
+          f"{total / count / 1048576:7.2f} Mio/ouverture")
+
+
+def main():
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    root = tempfile.mkdtemp(prefix='lnm-downloads-')
+    path = os.path.join(root, 'video.mp4')
+    with open(path, 'wb') as f:
+        for _ in range(size_mib):
+            f.write(os.urandom(1024 * 1024))
+    db = Database(os.path.join(root, 'bench.db'))
+    db.save_file(1, 'video.mp4', 'video/mp4', os.path.getsize(path), 'received', 'bench', path, '')
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, build_app(root, db, sendfile=False), threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sendfile_server = make_server('127.0.0.1', 0, build_app(root, db, sendfile=True), threaded=True)
+    threading.Thread(target=sendfile_server.serve_forever, daemon=True).start()
+
+    # Premier accès : calcule et mémorise le SHA-256 (ETag)
+    start = time.perf_counter()
+    _status, _received, response = fetch(port, '/files/video.mp4')
+    etag = response.getheader('ETag')
+    print(f"Fichier de {size_mib} Mio, {count} ouvertures ; premier accès (hash) : "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+    scenario("ancien : GET complet", port, count, '/legacy/video.mp4')
+    port = sendfile_server.server_port
+    scenario("nouveau : GET complet (sendfile)", port, count, '/files/video.mp4')
+    scenario("nouveau : revalidation If-None-Match", port, count, '/files/video.mp4',
+             {'If-None-Match': etag})
+    scenario("nouveau : Range 1 Mio (déplacement)", port, count, '/files/video.mp4',
+             {'Range': f'bytes={size_mib // 2 * 1048576}-{size_mib // 2 * 1048576 + 1048575}'})
+    print("nouveau : URL versionnée (?v=)          0 requête (cache navigateur immuable)")
+    server.shutdown()
+    sendfile_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark du découpage en lignes : ancien tampon str + split vs LineFramer
+
+Usage:
+    python bench/bench_framer.py
+"""
+
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from framer import LineFramer
+
+
+def legacy_split(chunks):
+    """Reproduit l'ancienne boucle : decode par chunk, str qui grossit, split"""
+    buffer = ""
+    lines = 0
+    dropped = 0
+    for chunk in chunks:
+        try:
+            text = chunk.decode('utf-8')
+        except UnicodeDecodeError:
+            dropped += 1
+            continue
+        buffer += text
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            lines += 1
+    return lines, dropped
+
+
+def framer_split(chunks):
+    framer = LineFramer()
+    lines = 0
+    for chunk in chunks:
+        lines += len(framer.feed(chunk))
+    return lines, 0
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def adaptive_chunks(data):
+    """Découpe le flux avec la taille de recv adaptative du framer"""
+    framer = LineFramer()
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        chunk = data[pos:pos + framer.recv_size]
+        framer.feed(chunk)
+        chunks.append(chunk)
+        pos += len(chunk)
+    return chunks
+
+
+def run(name, func, chunks, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    lines, dropped = result
+    print(f"  {name:<28} {best * 1000:9.2f} ms  lignes={lines} chunks_perdus={dropped}")
+
+
+def main():
+    payload = base64.b64encode(os.urandom(2 * 1024 * 1024))
+    big_line = b"__FILE__|photo.jpg|image/jpeg|2097152|" + payload + b"\n"
+    chat = ("Bonjour, ceci est un message de test éàü 🙂\n" * 20000).encode('utf-8')
+
+    scenarios = [
+        ("Ligne __FILE__ de 2 Mo (recv 1024)", big_line, lambda d: chunked(d, 1024)),
+        ("Ligne __FILE__ de 2 Mo (recv adaptatif)", big_line, adaptive_chunks),
+        ("20 000 messages courts UTF-8 (recv 1024)", chat, lambda d: chunked(d, 1024)),
+    ]
+    for title, data, splitter in scenarios:
+        chunks = splitter(data)
+        print(f"{title} — {len(data)} octets, {len(chunks)} chunks")
+        run("ancien (str + split)", legacy_split, chunks)
+        run("LineFramer (bytearray)", framer_split, chunks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Import en masse : Database.bulk_import face à save_message ligne par ligne
+
+Un export NDJSON synthétique (N messages, 50 clients) est écrit puis chargé
+dans une base vide avec importer.import_ndjson (index et triggers recréés,
+index plein texte reconstruit, compteurs recalculés : tout est compté). Le
+chemin ligne par ligne est mesuré sur un échantillon.
+
+Objectif : au moins 100 000 lignes/s.
+
+Usage:
+    python bench/bench_import.py [nombre de messages]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+import importer
+
+CLIENTS = 50
+SAMPLE = 5000
+TARGET = 100000
+
+
+def write_export(path, count):
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'kind': 'export', 'version': 1}) + '\n')
+        for client_id in range(1, CLIENTS + 1):
+            f.write(json.dumps({'kind': 'client', 'client_id': client_id, 'username': f'client{client_id}',
+                                'address': f'192.168.1.{client_id}'}) + '\n')
+        for i in range(1, count + 1):
+            f.write(json.dumps({
+                'kind': 'message', 'id': i, 'client_id': rng.randint(1, CLIENTS),
+                'type': rng.choice(('received', 'sent')), 'sender': 'bench',
+                'message': f'message {i} ' + 'x' * rng.randint(10, 120),
+                'timestamp': (start + timedelta(seconds=i)).isoformat(), 'read': rng.randint(0, 1),
+            }, ensure_ascii=False) + '\n')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tmp = tempfile.mkdtemp(prefix='lnm-import-')
+    source = os.path.join(tmp, 'export.ndjson')
+    write_export(source, count)
+    print(f"Export synthétique : {count} messages, {os.path.getsize(source) / 1048576:.0f} Mio")
+
+    db = Database(os.path.join(tmp, 'slow.db'))
+    timestamp = datetime.now().isoformat()
+    start = time.perf_counter()
+    for i in range(SAMPLE):
+        db.save_message(i % CLIENTS + 1, 'received', 'bench', f'message {i}', timestamp)
+    elapsed = time.perf_counter() - start
+    print(f"save_message (×{SAMPLE})     {SAMPLE / elapsed:9.0f} lignes/s")
+    db.close()
+
+    db = Database(os.path.join(tmp, 'bulk.db'))
+    start = time.perf_counter()
+    counts = importer.import_ndjson(db, source)
+    elapsed = time.perf_counter() - start
+    rows = sum(counts.values())
+    print(f"bulk_import (NDJSON)      {rows / elapsed:9.0f} lignes/s   ({rows} lignes en {elapsed:.1f} s)")
+    print(f"Objectif {TARGET} lignes/s : {'OK' if rows / elapsed >= TARGET else 'NON'}")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Reprise d'un transfert de fichier coupé en plein milieu
+
+Un récepteur local coupe la connexion après avoir reçu la moitié du fichier ;
+l'émetteur se reconnecte et reprend le transfert avec le même identifiant.
+Le script échoue (code 1) si le fichier final est corrompu ou si la reprise
+envoie plus de 10 % d'octets en trop par rapport à ce qui manquait au
+récepteur. Les octets perdus dans les tampons TCP au moment de la coupure
+sont affichés à part : ils dépendent du réseau, pas de la reprise.
+tests/test_transfer.py fait la même vérification en mémoire, sur un petit
+fichier, dans la suite de tests.
+
+Usage:
+    python bench/bench_resume.py [taille en Mio]
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+import transfer
+from connection import SocketConnection
+from blobstore import BlobStore
+from database import Database
+from transfer import IncomingTransfers, OutgoingTransfers
+
+MAX_OVERHEAD = 0.10
+
+
+class CountingConnection(SocketConnection):
+    """Compte les octets de contenu envoyés dans les trames FILE_CHUNK"""
+
+    sent = 0
+
+    def send_file_chunk(self, header, fileobj, offset, count):
+        super().send_file_chunk(header, fileobj, offset, count)
+        CountingConnection.sent += count
+
+
+def receiver(server, store, db, cut_after, done, counts):
+    """Accepte deux connexions ; coupe la première après `cut_after` octets reçus"""
+    for attempt in range(2):
+        sock, _ = server.accept()
+        conn = SocketConnection(sock)
+        transfers = IncomingTransfers(store, db, peer='bench')
+        decoder = protocol.FrameDecoder()
+        received = 0
+        try:
+            while True:
+                chunk = sock.recv(256 * 1024)
+                if not chunk:
+                    break
+                for ftype, value in decoder.feed(chunk):
+                    if ftype == protocol.FILE_BEGIN:
+                        _item, have = transfers.begin(value)
+                        conn.send(have)
+                    elif ftype == protocol.FILE_CHUNK:
+                        transfers.chunk(value)
+                        received += len(value) - transfer.CHUNK_HEADER.size
+                    elif ftype == protocol.FILE_END:
+                        item, valid, ack = transfers.end(value)
+                        if item is not None:
+                            done.append(valid)
+                        if ack is not None:
+                            conn.send(ack)
+                if attempt == 0 and received >= cut_after:
+                    break
+        except OSError:
+            pass
+        finally:
+            transfers.suspend_all()
+            conn.close()
+            counts.append(received)
+
+
+def sender_loop(conn, outgoing):
+    """Lit les trames du récepteur (FILE_HAVE) jusqu'à la fermeture"""
+    decoder = protocol.FrameDecoder()
+    try:
+        while True:
+            chunk = conn.sock.recv(65536)
+            if not chunk:
+                break
+            for ftype, value in decoder.feed(chunk):
+                if ftype == protocol.FILE_HAVE:
+                    outgoing.on_have(value)
+    except OSError:
+        pass
+    outgoing.cancel_all()
+
+
+def connect(port, outgoing):
+    sock = socket.create_connection(('127.0.0.1', port))
+    conn = CountingConnection(sock)
+    conn.version = 2
+    threading.Thread(target=sender_loop, args=(conn, outgoing), daemon=True).start()
+    return conn
+
+
+def main():
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 64) * 1024 * 1024
+    tmp = tempfile.mkdtemp(prefix='lnm-resume-')
+    source = os.path.join(tmp, 'source.bin')
+    with open(source, 'wb') as f:
+        for _ in range(size // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+
+    recv_db = Database(os.path.join(tmp, 'recv.db'))
+    send_db = Database(os.path.join(tmp, 'send.db'))
+    store = BlobStore(os.path.join(tmp, 'blobs'), recv_db)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    port = server.getsockname()[1]
+    done = []
+    counts = []
+    thread = threading.Thread(target=receiver, args=(server, store, recv_db, size // 2, done, counts),
+                              daemon=True)
+    thread.start()
+
+    # Premier essai : le récepteur coupe à mi-parcours
+    outgoing = OutgoingTransfers(send_db)
+    conn = connect(port, outgoing)
+    start = time.perf_counter()
+    try:
+        outgoing.send(conn, source, 'source.bin', 'application/octet-stream', peer='bench')
+        print("Transfert non interrompu : augmentez la taille du fichier")
+        return 1
+    except OSError:
+        pass
+    conn.close()
+    first = CountingConnection.sent
+    while not counts:
+        time.sleep(0.01)
+    received_first = counts[0]
+
+    # Reprise sur une nouvelle connexion
+    pending = send_db.get_pending_transfers('sent', peer='bench')
+    outgoing = OutgoingTransfers(send_db)
+    conn = connect(port, outgoing)
+    outgoing.send(conn, source, 'source.bin', 'application/octet-stream',
+                  peer='bench', transfer_id=pending[0]['transfer_id'])
+    tid = pending[0]['transfer_id']
+    deadline = time.monotonic() + 30
+    while send_db.get_transfer(tid)['status'] != 'complete' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    thread.join(timeout=5)
+
+    total = CountingConnection.sent
+    resent = total - first
+    overhead = (resent - (size - received_first)) / size
+    sha256 = transfer.file_sha256(source)
+    valid = done == [True] and store.has(sha256) and transfer.file_sha256(store.path(sha256)) == sha256
+    print(f"Fichier            : {size / 1048576:.0f} Mio")
+    print(f"Envoyé avant coupure : {first / 1048576:.1f} Mio (reçu : {received_first / 1048576:.1f} Mio)")
+    print(f"Perdu dans les tampons TCP : {(first - received_first) / 1048576:.1f} Mio")
+    print(f"Envoyé à la reprise  : {resent / 1048576:.1f} Mio")
+    print(f"Octets en trop à la reprise : {overhead:.1%} (max {MAX_OVERHEAD:.0%})")
+    print(f"Durée                : {elapsed:.2f} s")
+    print(f"SHA-256 final        : {'OK' if valid else 'INVALIDE'}")
+    complete = send_db.get_transfer(tid)['status'] == 'complete'
+    print(f"Acquittement         : {'OK' if complete else 'absent'}")
+    return 0 if valid and complete and overhead < MAX_OVERHEAD else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
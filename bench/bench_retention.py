@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Rétention : attente de l'écrivain du chat pendant le nettoyage de l'historique
+
+Une base reçoit N messages étalés sur un an, puis un thread écrit des lignes
+de chat pendant qu'on retire tout ce qui a plus de 90 jours :
+- en une transaction (Database.delete_old_messages)
+- par lots vers les archives mensuelles (RetentionService.run_once)
+On compare la pire attente de l'écrivain et la taille du fichier après coup.
+Une base créée sans auto_vacuum (avant la rétention) est mesurée aussi : le
+service l'archive sans la convertir ; la conversion (VACUUM complet) est
+chronométrée à part, hors service.
+
+Usage:
+    python bench/bench_retention.py [nombre de messages]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+from retention import RetentionService
+
+MAX_AGE_DAYS = 90
+
+
+def legacy(path):
+    """Base au format d'avant la rétention (auto_vacuum=NONE)"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA auto_vacuum=NONE')
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def seed(path, count):
+    now = datetime.now()
+    rng = random.Random(7)
+    rows = []
+    for i in range(count):
+        when = now - timedelta(days=365 * (count - i) / count)
+        rows.append((rng.randint(1, 20), 'received', 'bench', f'message {i} ' + 'x' * rng.randint(20, 200),
+                     when.isoformat(), when.strftime('%Y-%m-%d %H:%M:%S')))
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+        INSERT INTO messages (client_id, type, sender, message, timestamp, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def chat_writer(db, stop, latencies):
+    timestamp = datetime.now().isoformat()
+    while not stop.is_set():
+        start = time.perf_counter()
+        db.save_message(1, 'received', 'bench', 'ligne de chat', timestamp)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.002)
+
+
+def measure(label, db, cleanup):
+    stop = threading.Event()
+    latencies = []
+    writer = threading.Thread(target=chat_writer, args=(db, stop, latencies))
+    writer.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    cleanup()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.2)
+    stop.set()
+    writer.join()
+    latencies.sort()
+    size = os.path.getsize(db.db_path) / 1048576
+    print(f"{label:28s} {elapsed:6.2f} s   écrivain : p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms, "
+          f"max {latencies[-1] * 1000:7.1f} ms   fichier {size:6.1f} Mio")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    tmp = tempfile.mkdtemp(prefix='lnm-retention-')
+
+    path = os.path.join(tmp, 'delete.db')
+    Database(path).close()
+    seed(path, count)
+    db = Database(path)
+    print(f"{count} messages sur un an, {os.path.getsize(path) / 1048576:.1f} Mio ; "
+          f"suppression de ce qui a plus de {MAX_AGE_DAYS} jours")
+    measure("delete_old_messages", db, lambda: db.delete_old_messages(MAX_AGE_DAYS))
+    db.close()
+
+    path = os.path.join(tmp, 'archive.db')
+    Database(path).close()
+    seed(path, count)
+    db = Database(path, archive_dir=os.path.join(tmp, 'archives'))
+    measure("RetentionService.run_once", db, lambda: RetentionService(db, MAX_AGE_DAYS).run_once())
+    archives = db.archives()
+    archived = sum(len(archive.get_messages(client_id, limit=None))
+                   for archive in archives for client_id in range(1, 21))
+    print(f"Archives : {len(archives)} fichiers mensuels, {archived} messages consultables")
+    db.close()
+
+    path = os.path.join(tmp, 'legacy.db')
+    Database(path).close()
+    legacy(path)
+    seed(path, count)
+    db = Database(path, archive_dir=os.path.join(tmp, 'legacy-archives'))
+    measure("run_once (base ancienne)", db, lambda: RetentionService(db, MAX_AGE_DAYS).run_once())
+    start = time.perf_counter()
+    db.enable_incremental_vacuum()
+    print(f"Conversion hors service (--convert) : {time.perf_counter() - start:.2f} s, "
+          f"fichier {os.path.getsize(path) / 1048576:.1f} Mio")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Latence de Database.search sur un historique volumineux
+
+La base est remplie d'un million de messages (par défaut) tirés d'un
+vocabulaire à distribution de Zipf : quelques mots très fréquents, une longue
+traîne de mots rares. L'insertion passe par la table `messages`, donc par les
+triggers qui tiennent l'index FTS5 à jour.
+
+Mesures (20 résultats, p50 / p99) : mot rare, mot courant, deux mots, début de
+mot, filtre sur un client, mot présent dans un message sur deux, page suivante.
+
+Usage:
+    python bench/bench_search.py [nombre de messages] [nombre de clients]
+"""
+
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database import Database
+
+COMMON = ('le la les de des un une et est pas que pour dans sur avec ce il elle on nous vous '
+          'bonjour merci salut oui non demain soir réunion café projet fichier envoyé réseau '
+          'serveur client message rapport équipe problème réglé').split()
+SYLLABLES = ('ba be bi bo bu ca ce ci co da de di do fa fe fi fo ga go la le li lo ma me mi mo '
+             'na ne ni no pa pe pi po ra re ri ro sa se si so ta te ti to va ve vi vo').split()
+TARGET_MS = 10
+RUNS = 50
+
+
+def vocabulary(size, rng):
+    words = list(COMMON)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def seed(path, count, clients, rng):
+    words = vocabulary(20000, rng)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    timestamp = datetime.now().isoformat()
+    conn = sqlite3.connect(path)
+    batch = 50000
+    for start in range(0, count, batch):
+        rows = []
+        for _ in range(min(batch, count - start)):
+            text = ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 16)))
+            rows.append((rng.randint(1, clients), 'received', 'bench', text, timestamp))
+        conn.executemany('''
+            INSERT INTO messages (client_id, type, sender, message, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    conn.close()
+    return words
+
+
+def measure(db, query, client_id=None, cursor=None):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        page = db.search(query, client_id=client_id, cursor=cursor)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)], page
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(42)
+    tmp = tempfile.mkdtemp(prefix='lnm-search-')
+    path = os.path.join(tmp, 'bench.db')
+    Database(path).close()
+
+    start = time.perf_counter()
+    words = seed(path, count, clients, rng)
+    elapsed = time.perf_counter() - start
+    print(f"Remplissage : {count} messages (index FTS5 compris) en {elapsed:.1f} s "
+          f"({count / elapsed:.0f} messages/s), {os.path.getsize(path) / 1048576:.0f} Mio")
+
+    db = Database(path)
+    cases = (
+        ("mot rare", words[5000], None, None),
+        ("mot courant", 'bonjour', None, None),
+        ("deux mots", 'réunion demain', None, None),
+        ("début de mot", words[800][:3], None, None),
+        ("mot courant, un client", 'projet', 7, None),
+        ("mot très courant", 'le', None, None),
+        ("mot courant, page 5", 'fichier', None, '0:80'),
+    )
+    worst = 0.0
+    for label, query, client_id, cursor in cases:
+        p50, p99, page = measure(db, query, client_id, cursor)
+        worst = max(worst, p50)
+        print(f"{label:24s} {query!r:18s} p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   "
+              f"({len(page['results'])} résultats, classement {page['ranking']})")
+    print(f"Objectif p50 < {TARGET_MS} ms : {'OK' if worst < TARGET_MS else 'NON'} (pire p50 {worst:.2f} ms)")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Générateur de charge TCP de bout en bout pour server_web
+
+N clients simulés (une seule boucle asyncio) se connectent au serveur TCP,
+font le vrai handshake (nom d'utilisateur, négociation v2 avec --proto 2) et
+envoient, au débit visé, un mélange de lignes de chat, de changements de
+statut et d'avatar et de fichiers (`__FILE__|...` en v1, trame FILE en v2).
+Chaque opération est suivie d'un PING : le PONG revient une fois le serveur
+passé sur l'opération (SQLite, tampon, emit), ce qui donne la latence
+aller-retour.
+
+Par défaut le serveur est lancé pour la mesure (start_tcp_server ou
+start_tcp_server_async selon --engine) dans un sous-processus, sur
+127.0.0.1, avec sa base et ses fichiers dans un dossier temporaire
+(LNM_DATA_DIR) ; son RSS et son nombre de threads sont relevés dans /proc.
+--port vise un serveur déjà lancé (--pid pour en relever la mémoire).
+
+Le résultat est un objet JSON par moteur sur la sortie standard (résumé
+lisible sur la sortie d'erreur) ; --compare signale une régression par
+rapport à un résultat précédent (code de sortie 1).
+
+Usage:
+    python bench/loadgen.py [--engine thread,asyncio] [--clients 50] [--rate 2000]
+                            [--duration 10] [--mix chat=90,status=4,avatar=4,file=2]
+                            [--file-size 65536] [--proto 1|2] [--output résultat.json]
+                            [--compare référence.json] [--tolerance 0.2]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import protocol
+
+DEFAULT_MIX = 'chat=90,status=4,avatar=4,file=2'
+STATUSES = ('Disponible', 'Occupé', 'En réunion', 'Absent')
+AVATARS = ('🙂', '😀', '🚀', '🐱', '🎧')
+WORDS = "commande client livraison stock caisse ticket remise facture rayon inventaire".split()
+
+# Lancement du serveur à mesurer (sous-processus) : seul le serveur TCP tourne
+SERVER_CODE = """
+import sys
+import server_web
+server_web.HOST = '127.0.0.1'
+server_web.PORT = int(sys.argv[1])
+(server_web.start_tcp_server_async if server_web.TCP_ENGINE == 'asyncio' else server_web.start_tcp_server)()
+"""
+SERVER_READY = '[DÉMARRAGE]'
+SERVER_START_TIMEOUT = 30
+
+# Délai d'attente des derniers PONG après la fin de l'envoi (secondes)
+DRAIN_TIMEOUT = 10
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def parse_mix(text):
+    """`chat=90,file=2` -> [('chat', 90.0), ('file', 2.0)]"""
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('chat', 'status', 'avatar', 'file'):
+            raise ValueError(f"Opération inconnue: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def latency_summary(values):
+    """Percentiles d'une liste de latences (secondes) en millisecondes"""
+    values = sorted(values)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'count': len(values),
+        'p50': ms(percentile(values, 0.50)),
+        'p99': ms(percentile(values, 0.99)),
+        'p999': ms(percentile(values, 0.999)),
+        'max': ms(values[-1] if values else None),
+    }
+
+
+def process_stats(pid):
+    """RSS (octets) et nombre de threads d'un processus, lus dans /proc (Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['Threads'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class ServerProcess:
+    """server_web lancé dans un sous-processus, base et fichiers dans un dossier temporaire"""
+
+    def __init__(self, engine, port):
+        self.data_dir = tempfile.TemporaryDirectory(prefix='lnm-loadgen-')
+        env = dict(os.environ, LNM_TCP_ENGINE=engine, LNM_DATA_DIR=self.data_dir.name, PYTHONUNBUFFERED='1')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', SERVER_CODE, str(port)], cwd=ROOT, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace'
+        )
+        self.pid = self.process.pid
+        self.ready = threading.Event()
+        self.tail = []
+        # Sortie lue en continu : un tube plein bloquerait les print du serveur
+        threading.Thread(target=self._read_output, daemon=True).start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self.tail = (self.tail + [line.rstrip()])[-20:]
+            if line.startswith(SERVER_READY):
+                self.ready.set()
+        self.ready.set()
+
+    def wait_ready(self):
+        self.ready.wait(SERVER_START_TIMEOUT)
+        if self.process.poll() is not None or not self.ready.is_set():
+            raise RuntimeError("Le serveur n'a pas démarré:\n" + '\n'.join(self.tail))
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.data_dir.cleanup()
+
+
+class SimulatedClient:
+    """Un client TCP : handshake, opérations au débit visé, PONG -> latences"""
+
+    def __init__(self, index, args, results):
+        self.index = index
+        self.args = args
+        self.results = results
+        self.rng = random.Random(index)
+        self.version = 1
+        self.pending = {}
+        self.sequence = 0
+        self.reader = None
+        self.writer = None
+        self.frames = None
+        self.receiver = None
+        self.upgraded = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.args.port)
+        self.frames = protocol.FrameReader(protocol.PROTO_ACK_LINE if self.args.proto == 2 else None)
+        self.upgraded = asyncio.Event()
+        handshake = f"bench-{self.index}\n"
+        if self.args.proto == 2:
+            handshake += protocol.PROTO_HELLO_LINE + "\n"
+        self.writer.write(handshake.encode('utf-8'))
+        await self.writer.drain()
+        self.receiver = asyncio.create_task(self._receive())
+        if self.args.proto == 2:
+            await asyncio.wait_for(self.upgraded.wait(), 5)
+            self.version = 2
+
+    async def _receive(self):
+        try:
+            while True:
+                chunk = await self.reader.read(256 * 1024)
+                if not chunk:
+                    break
+                now = time.perf_counter()
+                for ftype, value in self.frames.feed(chunk):
+                    if ftype == protocol.PONG:
+                        sent = self.pending.pop(value, None)
+                        if sent is not None:
+                            self.results.record(sent[0], now - sent[1])
+                if self.frames.version == 2:
+                    self.upgraded.set()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if self.pending:
+                self.results.errors += len(self.pending)
+                self.pending.clear()
+
+    def _operation(self, op):
+        """Octets d'une opération, au format de la version négociée"""
+        if op == 'chat':
+            text = ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(4, 30)))
+            return protocol.encode(protocol.TEXT, f"{text} #{self.sequence}", self.version)
+        if op == 'status':
+            return protocol.encode(protocol.CLIENT_STATUS, self.rng.choice(STATUSES), self.version)
+        if op == 'avatar':
+            return protocol.encode(protocol.CLIENT_AVATAR, self.rng.choice(AVATARS), self.version)
+        # Contenu aléatoire : pas de déduplication côté serveur
+        data = self.rng.randbytes(self.args.file_size)
+        return protocol.encode(protocol.FILE, (f"bench-{self.sequence}.bin", 'application/octet-stream', data),
+                               self.version)
+
+    async def run(self, ops, interval, deadline):
+        """Envoie ses opérations toutes les `interval` secondes jusqu'à `deadline`"""
+        next_at = time.perf_counter() + self.rng.random() * interval
+        names, weights = zip(*ops)
+        while True:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                self.results.late += 1
+            if time.perf_counter() >= deadline:
+                break
+            next_at += interval
+            self.sequence += 1
+            op = self.rng.choices(names, weights)[0]
+            token = f"{self.index}-{self.sequence}"
+            data = self._operation(op) + protocol.encode(protocol.PING, token, self.version)
+            self.pending[token] = (op, time.perf_counter())
+            self.writer.write(data)
+            self.results.sent(op, len(data))
+            await self.writer.drain()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.ops = {}
+        self.bytes_sent = 0
+        self.errors = 0
+        self.late = 0
+
+    def sent(self, op, size):
+        self.ops[op] = self.ops.get(op, 0) + 1
+        self.bytes_sent += size
+
+    def record(self, op, latency):
+        self.latencies.setdefault(op, []).append(latency)
+
+
+async def run_load(args, server_pid):
+    results = Results()
+    clients = [SimulatedClient(index, args, results) for index in range(args.clients)]
+    for client in clients:
+        await client.connect()
+    log(f"  {args.clients} clients connectés (protocole v{args.proto})")
+
+    samples = []
+
+    async def sample_server():
+        while True:
+            stats = process_stats(server_pid) if server_pid else None
+            if stats:
+                samples.append(stats)
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_server())
+    ops = parse_mix(args.mix)
+    interval = args.clients / args.rate
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(client.run(ops, interval, deadline) for client in clients))
+    sending = time.perf_counter() - start
+
+    # Derniers PONG
+    drain_deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while any(client.pending for client in clients) and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    for client in clients:
+        results.errors += len(client.pending)
+        client.pending.clear()
+        await client.close()
+
+    all_latencies = [value for values in results.latencies.values() for value in values]
+    completed = len(all_latencies)
+    report = {
+        'engine': args.engine,
+        'proto': args.proto,
+        'clients': args.clients,
+        'target_rate': args.rate,
+        'duration_s': round(sending, 3),
+        'mix': args.mix,
+        'file_size': args.file_size,
+        'ops_sent': results.ops,
+        'ops_completed': completed,
+        'errors': results.errors,
+        'late': results.late,
+        'throughput_ops_s': round(completed / elapsed, 1),
+        'throughput_mib_s': round(results.bytes_sent / elapsed / 1048576, 3),
+        'latency_ms': latency_summary(all_latencies),
+        'latency_ms_by_op': {op: latency_summary(values) for op, values in sorted(results.latencies.items())},
+        'server': None,
+    }
+    if samples:
+        report['server'] = {
+            'rss_max_mib': round(max(rss for rss, _threads in samples) / 1048576, 1),
+            'rss_end_mib': round(samples[-1][0] / 1048576, 1),
+            'threads_max': max(threads for _rss, threads in samples),
+            'threads_end': samples[-1][1],
+        }
+    return report
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_engine(args, engine):
+    args.engine = engine
+    server = None
+    server_pid = args.pid
+    if args.port_given is None:
+        args.port = free_port()
+        server = ServerProcess(engine, args.port)
+        server.wait_ready()
+        server_pid = server.pid
+    else:
+        args.port = args.port_given
+    try:
+        log(f"Moteur {engine} : {args.rate} op/s visées pendant {args.duration} s")
+        return asyncio.run(run_load(args, server_pid))
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def print_summary(report):
+    latency = report['latency_ms']
+    log(f"  {report['throughput_ops_s']} op/s ({report['throughput_mib_s']} Mio/s), "
+        f"latence p50 {latency['p50']} ms, p99 {latency['p99']} ms, p999 {latency['p999']} ms, "
+        f"erreurs {report['errors']}, en retard {report['late']}")
+    if report['server']:
+        server = report['server']
+        log(f"  serveur : RSS max {server['rss_max_mib']} Mio, {server['threads_max']} threads max")
+
+
+def compare(reports, baseline_path, tolerance):
+    """
+    Compare aux résultats de référence (même moteur et même protocole)
+
+    Returns:
+        Liste des régressions (texte)
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    baseline = {(report['engine'], report['proto']): report for report in baseline.get('results', [])}
+    regressions = []
+    for report in reports:
+        reference = baseline.get((report['engine'], report['proto']))
+        if reference is None:
+            continue
+        if report['throughput_ops_s'] < reference['throughput_ops_s'] * (1 - tolerance):
+            regressions.append(f"{report['engine']}: débit {report['throughput_ops_s']} op/s "
+                               f"(référence {reference['throughput_ops_s']})")
+        for key in ('p50', 'p99'):
+            now, before = report['latency_ms'][key], reference['latency_ms'][key]
+            if now is not None and before and now > before * (1 + tolerance):
+                regressions.append(f"{report['engine']}: latence {key} {now} ms (référence {before} ms)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Charge TCP de bout en bout sur server_web (localhost)")
+    parser.add_argument('--engine', default='thread', help="moteur(s) TCP, séparés par des virgules")
+    parser.add_argument('--clients', type=int, default=50, help="clients simulés")
+    parser.add_argument('--rate', type=float, default=2000, help="opérations par seconde, tous clients")
+    parser.add_argument('--duration', type=float, default=10, help="durée d'envoi en secondes")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="poids des opérations (chat, status, avatar, file)")
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help="taille des fichiers envoyés (octets)")
+    parser.add_argument('--proto', type=int, choices=(1, 2), default=1, help="version du protocole")
+    parser.add_argument('--port', type=int, dest='port_given',
+                        help="serveur déjà lancé sur 127.0.0.1:PORT (sinon un serveur est lancé par moteur)")
+    parser.add_argument('--pid', type=int, help="PID du serveur déjà lancé (RSS et threads)")
+    parser.add_argument('--output', help="fichier JSON de résultats (en plus de la sortie standard)")
+    parser.add_argument('--compare', help="résultats de référence (JSON produit par --output)")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="écart toléré avant de signaler une régression (0.2 = 20 %%)")
+    args = parser.parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    reports = []
+    for engine in args.engine.split(','):
+        report = run_engine(args, engine.strip())
+        print_summary(report)
+        reports.append(report)
+
+    output = {
+        'benchmark': 'loadgen',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': reports,
+    }
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        regressions = compare(reports, args.compare, args.tolerance)
+        for regression in regressions:
+            log(f"RÉGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
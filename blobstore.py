@@ -0,0 +1,140 @@
+"""
+Stockage des pièces jointes adressé par contenu
+
+Chaque fichier est stocké une seule fois sous `<racine>/<sha[:2]>/<sha256>`,
+quel que soit le nombre de clients qui l'envoient ou le reçoivent. La table
+`blobs` compte les lignes de `files` qui pointent vers chaque blob ; un blob
+qui n'est plus référencé est supprimé du disque.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+
+BLOCK_SIZE = 256 * 1024
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """Dossier de blobs nommés par leur SHA-256, avec compteur de références en base"""
+
+    def __init__(self, root, db):
+        """
+        Args:
+            root: dossier racine des blobs
+            db: Database (tables `blobs` et `files`)
+        """
+        self.root = Path(root)
+        self.tmp_dir = self.root / 'tmp'
+        self.db = db
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, sha256):
+        """Chemin du blob ; ValueError si le hash n'est pas un SHA-256 hexadécimal"""
+        if not _SHA256_RE.match(sha256 or ''):
+            raise ValueError(f"Hash de blob invalide: {sha256!r}")
+        return self.root / sha256[:2] / sha256
+
+    def has(self, sha256):
+        """True si le contenu est déjà stocké"""
+        try:
+            return self.path(sha256).is_file()
+        except ValueError:
+            return False
+
+    def part_path(self, name):
+        """Fichier temporaire d'une écriture en cours (transfert, upload) ; ValueError hors de `tmp/`"""
+        path = self.tmp_dir / f"{name}.part"
+        if path.resolve().parent != self.tmp_dir.resolve():
+            raise ValueError(f"Nom de fichier temporaire invalide: {name!r}")
+        return path
+
+    def commit(self, tmp_path, sha256):
+        """
+        Range un fichier temporaire complet dans le store
+
+        Si le contenu existe déjà, le fichier temporaire est simplement supprimé.
+
+        Returns:
+            Chemin du blob
+        """
+        path = self.path(sha256)
+        if path.is_file():
+            os.remove(tmp_path)
+        else:
+            os.makedirs(path.parent, exist_ok=True)
+            os.replace(tmp_path, path)
+        self.db.add_blob(sha256, path.stat().st_size)
+        return path
+
+    def add_stream(self, read):
+        """
+        Stocke un flux en calculant son hash au fil de l'écriture
+
+        Args:
+            read: fonction read(taille) du flux source (ex: request.stream.read)
+
+        Returns:
+            Tuple (sha256, taille, chemin du blob)
+        """
+        tmp_path = self.part_path(uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for block in iter(lambda: read(BLOCK_SIZE), b''):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        sha256 = digest.hexdigest()
+        return sha256, size, self.commit(tmp_path, sha256)
+
+    def add_bytes(self, data):
+        """Stocke un contenu déjà en mémoire ; retourne (sha256, taille, chemin)"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        if not path.is_file():
+            tmp_path = self.part_path(uuid.uuid4().hex)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            return sha256, len(data), self.commit(tmp_path, sha256)
+        self.db.add_blob(sha256, len(data))
+        return sha256, len(data), path
+
+    def delete_file(self, file_id):
+        """Supprime une ligne de `files` et son blob s'il n'est plus référencé"""
+        orphan = self.db.delete_file(file_id)
+        if orphan:
+            self._remove(orphan)
+
+    def collect_garbage(self):
+        """
+        Supprime les blobs sans référence (upload jamais livré) et les
+        fichiers temporaires abandonnés, hors transferts en cours de reprise
+
+        Returns:
+            Nombre de fichiers supprimés
+        """
+        removed = 0
+        for sha256 in self.db.get_unreferenced_blobs():
+            self._remove(sha256)
+            removed += 1
+        resumable = {f"{row['transfer_id']}.part" for row in self.db.get_pending_transfers('received')}
+        for entry in os.scandir(self.tmp_dir):
+            if entry.name not in resumable:
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    def _remove(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except OSError:
+            pass
+        self.db.delete_blob(sha256)
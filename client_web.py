@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 from flask_socketio import SocketIO, emit
 import socket
 import threading
@@ -6,23 +6,49 @@ import time
 import os
 import base64
 from pathlib import Path
+from urllib.parse import unquote
 from database import Database
+from connection import SocketConnection
+import protocol
+from file_serving import SendfileMiddleware, blob_url, send_avatar, send_blob, send_stored_file
+from blobstore import BlobStore
+from avatars import AvatarStore, avatar_url
+from retention import RetentionService
+from transfer import IncomingTransfers, OutgoingTransfers
+from emitter import EmitCoalescer
+import tracing
 from datetime import datetime
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'localnetmessage-client-secret-key-2025'
+# Derrière un proxy qui gère X-Sendfile (nginx, Apache), lui déléguer l'envoi des fichiers
+app.config['USE_X_SENDFILE'] = os.environ.get('LNM_X_SENDFILE') == '1'
+app.wsgi_app = SendfileMiddleware(app.wsgi_app)
 socketio = SocketIO(app, cors_allowed_origins="*")
+# Événements issus du trafic TCP, regroupés en `messages_batch` pendant les rafales
+ui = EmitCoalescer(socketio)
 
 BASE_DIR = Path(__file__).resolve().parent
 CLIENT_FILES_DIR = BASE_DIR / 'uploads' / 'client'
 CLIENT_RECEIVED_DIR = CLIENT_FILES_DIR / 'received'
 CLIENT_SENT_DIR = CLIENT_FILES_DIR / 'sent'
+CLIENT_BLOBS_DIR = CLIENT_FILES_DIR / 'blobs'
+CLIENT_AVATARS_DIR = CLIENT_FILES_DIR / 'avatars'
 for d in [CLIENT_RECEIVED_DIR, CLIENT_SENT_DIR]:
     os.makedirs(d, exist_ok=True)
 
 # Initialiser la base de données SQLite (client)
 # Utilise un fichier DB séparé pour le client
-db = Database(str(BASE_DIR / 'client_messages.db'))
+# LNM_DB_WRITE_BEHIND=1 : messages et compteurs validés par lots dans un thread dédié
+# Historique ancien déplacé dans des archives mensuelles (retention.py), toujours consultables
+db = Database(str(BASE_DIR / 'client_messages.db'), write_behind=os.environ.get('LNM_DB_WRITE_BEHIND') == '1',
+              archive_dir=BASE_DIR / 'archives')
+
+# Pièces jointes envoyées et reçues, stockées une seule fois par contenu
+blob_store = BlobStore(CLIENT_BLOBS_DIR, db)
+
+# Avatars image, désignés par hash dans les trames et les événements
+avatar_store = AvatarStore(CLIENT_AVATARS_DIR)
 
 EXIT_KEYWORDS = [
     'quit', 'exit', 'au revoir', 'aurevoir', 'à plus', 'a plus',
@@ -30,7 +56,15 @@ EXIT_KEYWORDS = [
     'à bientôt', 'a bientot', 'adieu', 'fin'
 ]
 
+# Délai d'attente de l'acquittement du protocole v2 (secondes)
+NEGOTIATION_TIMEOUT = 1.0
+
+# Compression des trames v2 proposée au serveur (LNM_COMPRESSION=0 : jamais)
+COMPRESSION = os.environ.get('LNM_COMPRESSION', '1') != '0'
+
 client_socket = None
+client_conn = None
+frame_reader = None
 connected = False
 receive_thread = None
 username = None
@@ -40,110 +74,283 @@ server_avatar = '🙂'
 client_status = 'Disponible'
 client_avatar = '🙂'
 message_counter = 0
+server_peer = None
+incoming_transfers = IncomingTransfers(blob_store, db)
+outgoing_transfers = OutgoingTransfers(db)
+
+# Les serveurs v1 reçoivent les fichiers en une ligne base64 : taille limitée
+LEGACY_FILE_LIMIT = 2 * 1024 * 1024
+
+def _on_server_name(value):
+    global server_display_name
+    server_display_name = value or 'Serveur'
+    print(f"[INFO] Nom du serveur défini: {server_display_name}")
+    ui.emit('server_username_updated', {'username': server_display_name}, key='server_username_updated')
+    return True
+
+def _on_server_status(value):
+    global server_status
+    server_status = value or 'Disponible'
+    print(f"[INFO] Statut du serveur défini: {server_status}")
+    ui.emit('server_status_updated', {'status': server_status}, key='server_status_updated')
+    return True
+
+def _on_server_avatar(value):
+    def apply(avatar):
+        global server_avatar
+        server_avatar = avatar
+        print(f"[INFO] Avatar du serveur défini")
+        ui.emit('server_avatar_updated', {'avatar': avatar_url(avatar)}, key='server_avatar_updated')
+
+    # Image inconnue : demandée au serveur (AVATAR_WANT), appliquée à son arrivée
+    try:
+        avatar_store.resolve(value or '🙂', client_conn, apply)
+    except (ValueError, ConnectionError) as e:
+        print(f"[AVERTISSEMENT] Avatar du serveur ignoré: {e}")
+    return True
+
+def _on_codecs(codec):
+    """Codec retenu par le serveur : nos trames suivantes sont compressées"""
+    if codec in protocol.available_codecs() and client_conn:
+        client_conn.enable_compression(codec)
+        print(f"[INFO] Trames compressées ({codec})")
+    return True
+
+def _on_avatar_want(sha256):
+    """Le serveur n'a pas notre avatar : envoi de l'image, une fois"""
+    found = avatar_store.read(sha256)
+    if found is not None and client_conn:
+        client_conn.send_frame(protocol.AVATAR, found)
+    return True
+
+def _on_avatar(value):
+    try:
+        avatar_store.receive(value, client_conn)
+    except ValueError as e:
+        print(f"[AVERTISSEMENT] Avatar du serveur refusé: {e}")
+    return True
+
+def _record_received_file(filename, mimetype, size, save_path, sha256):
+    """SQLite et notification UI d'un fichier reçu du serveur"""
+    timestamp = datetime.now().isoformat()
+    
+    # Sauvegarder dans SQLite
+    db.save_file(
+        1,  # Client ID (constant: 1 pour le client local)
+        filename,
+        mimetype,
+        size,
+        'received',
+        server_display_name,
+        str(save_path),
+        timestamp,
+        sha256,
+        blob=sha256
+    )
+    tracing.mark('db')
+    
+    ui.emit('file_received', {
+        'filename': filename,
+        'mimetype': mimetype,
+        'size': size,
+        'url': blob_url(sha256, filename),
+        'server_username': server_display_name
+    })
+    tracing.mark('emit')
+
+def _on_file(payload):
+    try:
+        filename, mimetype, data = protocol.decode_file(payload)
+        filename = os.path.basename(filename)
+        tracing.mark('file_decode')
+        sha256, size, save_path = blob_store.add_bytes(data)
+        tracing.mark('write')
+        _record_received_file(filename, mimetype, size, save_path, sha256)
+    except Exception as e:
+        print(f"[ERREUR] Réception de fichier: {e}")
+    return True
+
+def _on_file_begin(payload):
+    item, have = incoming_transfers.begin(payload)
+    client_conn.send(have)
+    if item is not None and item.received:
+        print(f"[INFO] Reprise de {item.filename} ({item.received}/{item.size} o)")
+    elif item is not None:
+        print(f"[INFO] Réception de {item.filename} ({item.size} o)")
+    return True
+
+def _on_file_chunk(payload):
+    incoming_transfers.chunk(payload)
+    tracing.mark('write')
+    return True
+
+def _on_file_end(payload):
+    item, valid, ack = incoming_transfers.end(payload)
+    if item is None:
+        if ack is not None:
+            # Preuve de possession refusée : le serveur envoie le fichier
+            client_conn.send(ack)
+        return True
+    if not valid:
+        print(f"[ERREUR] Réception de fichier: somme de contrôle invalide pour {item.filename}")
+        return True
+    client_conn.send(ack)
+    _record_received_file(item.filename, item.mimetype, item.size, item.path, item.sha256)
+    return True
+
+def _on_file_have(payload):
+    outgoing_transfers.on_have(payload)
+    return True
 
-def receive_messages():
+def _on_text(line):
+    ui.emit('message_received', {
+        'message': line,
+        'server_username': server_display_name
+    })
+    tracing.mark('emit')
+    
+    # Sauvegarder dans SQLite
+    timestamp = datetime.now().isoformat()
+    db.save_message(1, 'received', server_display_name, line, timestamp)
+    tracing.mark('db')
+    
+    if line.lower() in EXIT_KEYWORDS:
+        print("[DÉCONNEXION] Le serveur a terminé la conversation.")
+        ui.emit('disconnected', {'reason': 'Serveur a terminé la conversation'})
+        return False
+    return True
+
+# Table de dispatch des trames reçues du serveur : type -> gestionnaire
+FRAME_HANDLERS = {
+    protocol.SERVER_NAME: _on_server_name,
+    protocol.SERVER_STATUS: _on_server_status,
+    protocol.SERVER_AVATAR: _on_server_avatar,
+    protocol.CODECS: _on_codecs,
+    protocol.AVATAR_WANT: _on_avatar_want,
+    protocol.AVATAR: _on_avatar,
+    protocol.FILE: _on_file,
+    protocol.FILE_BEGIN: _on_file_begin,
+    protocol.FILE_CHUNK: _on_file_chunk,
+    protocol.FILE_END: _on_file_end,
+    protocol.FILE_HAVE: _on_file_have,
+    protocol.TEXT: _on_text,
+}
+
+def _handle_frame(ftype, value, trace=None):
+    """Traite une trame du serveur ; retourne False si la conversation est terminée"""
+    handler = FRAME_HANDLERS.get(ftype)
+    if handler is None:
+        return True
+    if trace is None:
+        return handler(value)
+    with tracing.TRACER.active(trace):
+        return handler(value)
+
+def _negotiate_protocol():
+    """
+    Négocie le protocole v2 si le serveur le propose
+
+    Un serveur v2 commence par PROTO_OFFER_LINE : le client répond
+    PROTO_HELLO_LINE et attend PROTO_ACK_LINE. Un ancien serveur commence par
+    ses informations (SERVER_NAME) : la connexion reste en v1 tout de suite,
+    sans ligne inconnue envoyée. NEGOTIATION_TIMEOUT borne l'attente d'un
+    serveur qui ne répond pas.
+
+    Returns:
+        Trames reçues pendant la négociation (à traiter par le thread de réception)
+    """
+    frames = []
+    deadline = time.monotonic() + NEGOTIATION_TIMEOUT
+    first = b''
+    offered = False
+    try:
+        # Première ligne du serveur, lue telle quelle (l'offre ne survit pas à strip())
+        while b'\n' not in first:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            client_socket.settimeout(remaining)
+            chunk = client_socket.recv(1024)
+            if not chunk:
+                break
+            first += chunk
+        line, newline, rest = first.partition(b'\n')
+        offered = bool(newline) and line.rstrip(b'\r') == protocol.PROTO_OFFER_LINE.encode('ascii')
+        if offered:
+            client_conn.send((protocol.PROTO_HELLO_LINE + "\n").encode('utf-8'))
+            frames.extend(frame_reader.feed(rest))
+            while frame_reader.version == 1:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                client_socket.settimeout(remaining)
+                chunk = client_socket.recv(frame_reader.recv_size)
+                if not chunk:
+                    break
+                frames.extend(frame_reader.feed(chunk))
+    except socket.timeout:
+        pass
+    finally:
+        client_socket.settimeout(None)
+    
+    if frame_reader.version == 2:
+        client_conn.upgrade()
+        print("[INFO] Protocole v2 négocié avec le serveur")
+        if COMPRESSION:
+            # Un serveur qui ignore CODECS ne répond pas : les trames restent non compressées
+            client_conn.send_frame(protocol.CODECS, ','.join(protocol.available_codecs()))
+    elif offered:
+        frames.extend(frame_reader.stop_negotiation())
+    else:
+        # Ancien serveur : ce qui a été lu est du v1 ordinaire
+        frame_reader.stop_negotiation()
+        frames.extend(frame_reader.feed(first))
+    return frames
+
+def receive_messages(initial_frames=()):
     """Thread pour recevoir les messages du serveur"""
-    global client_socket, connected, server_display_name, server_status, server_avatar
-    buffer = ""
+    global client_socket, connected
+    # Connexion de ce thread : après une reconnexion, client_conn est une autre connexion
+    conn = client_conn
     try:
         with app.app_context():
+            for ftype, value in initial_frames:
+                if not _handle_frame(ftype, value):
+                    connected = False
+                    break
             while connected:
                 if client_socket:
                     try:
-                        chunk = client_socket.recv(1024)
+                        chunk = client_socket.recv(frame_reader.recv_size)
                         if not chunk:
-                            print("[DÉCONNEXION] Le serveur a fermé la connexion.")
-                            socketio.emit('disconnected', {'reason': 'Serveur déconnecté'})
+                            # Sans `connected` : fermeture demandée de ce côté (disconnect_from_server)
+                            if connected:
+                                print("[DÉCONNEXION] Le serveur a fermé la connexion.")
+                                ui.emit('disconnected', {'reason': 'Serveur déconnecté'})
                             connected = False
                             break
-                        try:
-                            text = chunk.decode('utf-8')
-                        except UnicodeDecodeError:
-                            continue
-                        buffer += text
-                        while '\n' in buffer:
-                            line, buffer = buffer.split('\n', 1)
-                            line = line.strip()
-                            if not line:
-                                continue
-                            if line.startswith("__SERVER_NAME__:"):
-                                server_display_name = line.split(":", 1)[1].strip() or 'Serveur'
-                                print(f"[INFO] Nom du serveur défini: {server_display_name}")
-                                socketio.emit('server_username_updated', {'username': server_display_name})
-                                continue
-                            if line.startswith("__SERVER_STATUS__:"):
-                                server_status = line.split(":", 1)[1].strip() or 'Disponible'
-                                print(f"[INFO] Statut du serveur défini: {server_status}")
-                                socketio.emit('server_status_updated', {'status': server_status})
-                                continue
-                            if line.startswith("__SERVER_AVATAR__:"):
-                                server_avatar = line.split(":", 1)[1].strip() or '🙂'
-                                print(f"[INFO] Avatar du serveur défini")
-                                socketio.emit('server_avatar_updated', {'avatar': server_avatar})
-                                continue
-                            if line.startswith("__FILE__|"):
-                                try:
-                                    _, filename, mimetype, size_str, b64 = line.split('|', 4)
-                                    data = base64.b64decode(b64.encode('utf-8'))
-                                    filename = os.path.basename(filename)
-                                    save_path = CLIENT_RECEIVED_DIR / filename
-                                    with open(save_path, 'wb') as f:
-                                        f.write(data)
-                                    
-                                    timestamp = datetime.now().isoformat()
-                                    
-                                    # Sauvegarder dans SQLite
-                                    db.save_file(
-                                        1,  # Client ID (constant: 1 pour le client local)
-                                        filename,
-                                        mimetype,
-                                        len(data),
-                                        'received',
-                                        server_display_name,
-                                        str(save_path),
-                                        timestamp
-                                    )
-                                    
-                                    socketio.emit('file_received', {
-                                        'filename': filename,
-                                        'mimetype': mimetype,
-                                        'size': len(data),
-                                        'url': f"/files/client/received/{filename}",
-                                        'server_username': server_display_name
-                                    })
-                                except Exception as e:
-                                    print(f"[ERREUR] Réception de fichier: {e}")
-                                continue
-                            socketio.emit('message_received', {
-                                'message': line,
-                                'server_username': server_display_name
-                            })
-                            
-                            # Sauvegarder dans SQLite
-                            timestamp = datetime.now().isoformat()
-                            db.save_message(1, 'received', server_display_name, line, timestamp)
-                            
-                            if line.lower() in EXIT_KEYWORDS:
-                                print("[DÉCONNEXION] Le serveur a terminé la conversation.")
-                                socketio.emit('disconnected', {'reason': 'Serveur a terminé la conversation'})
+                        received_at = time.monotonic()
+                        frames = frame_reader.feed(chunk)
+                        decoded_at = time.monotonic()
+                        for ftype, value in frames:
+                            trace = tracing.TRACER.begin('receive_messages', received_at, decoded_at, frame=ftype)
+                            if not _handle_frame(ftype, value, trace):
                                 connected = False
                                 break
                     
                     except Exception as e:
                         if connected:
                             print(f"[ERREUR] Erreur de réception: {e}")
-                            socketio.emit('error', {'message': f'Erreur de réception: {str(e)}'})
+                            ui.emit('error', {'message': f'Erreur de réception: {str(e)}'})
                         break
     
     except Exception as e:
         print(f"[ERREUR] Thread de réception: {e}")
     
     finally:
-        if client_socket:
-            try:
-                client_socket.close()
-            except:
-                pass
+        if conn:
+            conn.close()
+            avatar_store.forget(conn)
 
 @app.route('/')
 def index():
@@ -169,7 +376,7 @@ def handle_disconnect():
 @socketio.on('connect_to_server')
 def handle_connect_to_server(data):
     """Connexion au serveur TCP"""
-    global client_socket, connected, receive_thread, username
+    global client_socket, client_conn, frame_reader, connected, receive_thread, username, server_peer
     
     username = data.get('username', 'Anonyme')
     server_ip = data.get('server_ip', '127.0.0.1')
@@ -179,17 +386,27 @@ def handle_connect_to_server(data):
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.connect((server_ip, server_port))
         client_socket.send((username + "\n").encode('utf-8'))
+        client_conn = SocketConnection(client_socket)
+        frame_reader = protocol.FrameReader(protocol.PROTO_ACK_LINE)
+        server_peer = f"{server_ip}:{server_port}"
+        incoming_transfers.peer = server_peer
         
         connected = True
         print(f"[CONNECTÉ] {username} connecté au serveur {server_ip}:{server_port}")
         
         global server_display_name
         server_display_name = 'Serveur'
+        initial_frames = _negotiate_protocol()
 
-        receive_thread = threading.Thread(target=receive_messages)
+        receive_thread = threading.Thread(target=receive_messages, args=(initial_frames,))
         receive_thread.daemon = True
         receive_thread.start()
         
+        if client_conn.version >= 2:
+            resume_thread = threading.Thread(target=_resume_transfers)
+            resume_thread.daemon = True
+            resume_thread.start()
+        
         emit('connected', {
             'server_ip': server_ip,
             'server_port': server_port,
@@ -211,15 +428,15 @@ def handle_connect_to_server(data):
 @socketio.on('rename_user')
 def handle_rename_user(data):
     """Changer le nom d'utilisateur côté client et notifier le serveur TCP"""
-    global client_socket, connected, username
+    global client_conn, connected, username
     new_name = data.get('username', '').strip()
     if not new_name:
         emit('error', {'message': 'Nom utilisateur vide.'})
         return
     username = new_name
-    if connected and client_socket:
+    if connected and client_conn:
         try:
-            client_socket.send(f"__CLIENT_NAME__:{new_name}\n".encode('utf-8'))
+            client_conn.send_frame(protocol.CLIENT_NAME, new_name)
         except Exception as e:
             emit('error', {'message': f'Impossible de changer le nom: {e}'})
     emit('user_renamed', {'username': new_name})
@@ -227,18 +444,17 @@ def handle_rename_user(data):
 @socketio.on('change_status')
 def handle_change_status(data):
     """Changer le statut côté client et notifier le serveur TCP"""
-    global client_socket, connected, client_status
+    global client_conn, connected, client_status
     new_status = data.get('status', '').strip()
     print(f"[DEBUG] change_status reçu: {new_status}, connected: {connected}")
     if not new_status:
         emit('error', {'message': 'Statut vide.'})
         return
     client_status = new_status
-    if connected and client_socket:
+    if connected and client_conn:
         try:
-            message = f"__CLIENT_STATUS__:{new_status}\n"
-            print(f"[DEBUG] Envoi au serveur TCP: {message.strip()}")
-            client_socket.send(message.encode('utf-8'))
+            print(f"[DEBUG] Envoi au serveur TCP: __CLIENT_STATUS__:{new_status}")
+            client_conn.send_frame(protocol.CLIENT_STATUS, new_status)
             print(f"[INFO] Statut client changé et envoyé au serveur: {new_status}")
         except Exception as e:
             print(f"[ERREUR] Impossible de changer le statut: {e}")
@@ -250,30 +466,35 @@ def handle_change_status(data):
 @socketio.on('change_avatar')
 def handle_change_avatar(data):
     """Changer l'avatar côté client et notifier le serveur TCP"""
-    global client_socket, connected, client_avatar
+    global client_conn, connected, client_avatar
     new_avatar = data.get('avatar', '').strip()
     print(f"[DEBUG] change_avatar reçu, connected: {connected}")
     if not new_avatar:
         emit('error', {'message': 'Avatar vide.'})
         return
+    # Image (data URL) : stockée une fois, un serveur v2 ne reçoit que son hash
+    try:
+        new_avatar = avatar_store.to_ref(new_avatar)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
     client_avatar = new_avatar
-    if connected and client_socket:
+    if connected and client_conn:
         try:
-            message = f"__CLIENT_AVATAR__:{new_avatar}\n"
             print(f"[DEBUG] Envoi avatar au serveur TCP")
-            client_socket.send(message.encode('utf-8'))
+            avatar_store.send(client_conn, protocol.CLIENT_AVATAR, new_avatar)
             print(f"[INFO] Avatar client changé et envoyé au serveur")
         except Exception as e:
             print(f"[ERREUR] Impossible de changer l'avatar: {e}")
             emit('error', {'message': f'Impossible de changer l\'avatar: {e}'})
     else:
         print(f"[AVERTISSEMENT] Non connecté, impossible d'envoyer l'avatar")
-    emit('avatar_changed', {'avatar': new_avatar})
+    emit('avatar_changed', {'avatar': avatar_url(new_avatar)})
 
 @socketio.on('send_message')
 def handle_send_message(data):
     """Envoyer un message au serveur"""
-    global client_socket, connected, message_counter
+    global client_conn, connected, message_counter
     
     message = data.get('message', '').strip()
     
@@ -285,7 +506,7 @@ def handle_send_message(data):
         emit('error', {'message': 'Le message ne peut pas dépasser 5000 caractères.'})
         return
     
-    if not connected or not client_socket:
+    if not connected or not client_conn:
         emit('error', {'message': 'Non connecté au serveur.'})
         return
     
@@ -293,7 +514,7 @@ def handle_send_message(data):
         message_counter += 1
         message_id = f"client_{message_counter}_{int(time.time() * 1000)}"
         
-        client_socket.send((message + "\n").encode('utf-8'))
+        client_conn.send_frame(protocol.TEXT, message)
         
         emit('message_sent', {
             'message': message,
@@ -321,31 +542,159 @@ def handle_disconnect_request():
 
 def disconnect_from_server():
     """Fermer la connexion au serveur"""
-    global client_socket, connected
+    global client_socket, client_conn, connected
     
     connected = False
     
-    if client_socket:
-        try:
-            client_socket.close()
-        except:
-            pass
-        client_socket = None
+    # La file sortante part d'abord (message de sortie), puis le socket est fermé
+    if client_conn:
+        client_conn.close()
+        avatar_store.forget(client_conn)
+    client_socket = None
+    client_conn = None
+    incoming_transfers.suspend_all()
+    outgoing_transfers.cancel_all()
     
     print("[FERMETURE] Connexion fermée.")
 
 
 @app.route('/files/client/<path:subpath>')
 def serve_client_files(subpath):
-    root = str(CLIENT_FILES_DIR)
-    return send_from_directory(root, subpath, as_attachment=True)
+    """Fichiers stockés avant le BlobStore (uploads/client/received|sent)"""
+    return send_stored_file(db, str(CLIENT_FILES_DIR), subpath)
+
+
+@app.route('/blobs/<sha256>/<path:filename>')
+def serve_blob(sha256, filename):
+    return send_blob(blob_store, sha256, filename)
+
+
+@app.route('/avatars/<sha256>')
+def serve_avatar(sha256):
+    return send_avatar(avatar_store, sha256)
+
+
+@app.route('/debug/trace', methods=['GET', 'POST'])
+def debug_trace():
+    """
+    Traces des trames les plus lentes (GET) ; POST {"enabled": true|false}
+    active ou coupe le traçage sans redémarrer (voir tracing.py)
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        tracing.TRACER.set_enabled(bool(data.get('enabled')))
+        print(f"[INFO] Traçage {'activé' if tracing.TRACER.enabled else 'désactivé'}")
+    return jsonify({'success': True, 'enabled': tracing.TRACER.enabled, 'traces': tracing.TRACER.slowest()})
+
+
+@app.route('/debug/profile')
+def debug_profile():
+    """
+    Profil par échantillonnage de tous les threads, en piles repliées (flamegraph)
+
+    Paramètres: `seconds` (durée, défaut 10), `interval` (ms entre deux échantillons, défaut 5)
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', tracing.PROFILE_INTERVAL * 1000)) / 1000
+        if seconds <= 0 or interval <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètres de profil invalides'}), 400
+    try:
+        stacks = tracing.profile(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return Response(stacks, mimetype='text/plain')
+
+
+def _deliver_file(save_path, filename, mimetype, sha256, sid=None, transfer_id=None):
+    """
+    Transmet au serveur TCP un blob du store (thread d'arrière-plan)
+
+    Serveur v2 : transfert en flux (FILE_BEGIN/CHUNK/END), sauf s'il a déjà
+    ce contenu ; serveur v1 : une ligne base64 limitée à LEGACY_FILE_LIMIT.
+    transfer_id désigne un transfert interrompu à reprendre.
+    """
+    conn = client_conn
+    try:
+        if conn is None:
+            socketio.emit('error', {'message': 'Non connecté au serveur.'}, to=sid)
+            return
+        if conn.version >= 2:
+            size, sha256 = outgoing_transfers.send(
+                conn, save_path, filename, mimetype, peer=server_peer, transfer_id=transfer_id,
+                sha256=sha256
+            )
+        else:
+            size = os.path.getsize(save_path)
+            if size > LEGACY_FILE_LIMIT:
+                socketio.emit('error', {'message': 'Fichier trop volumineux pour ce serveur (max 2 Mo).'}, to=sid)
+                return
+            with open(save_path, 'rb') as f:
+                conn.send_frame(protocol.FILE, (filename, mimetype, f.read()))
+        
+        # Sauvegarder dans SQLite
+        timestamp = datetime.now().isoformat()
+        db.save_file(
+            1,  # Client ID (constant: 1)
+            filename,
+            mimetype,
+            size,
+            'sent',
+            username,
+            str(save_path),
+            timestamp,
+            sha256,
+            blob=sha256
+        )
+        
+        url = blob_url(sha256, filename)
+        socketio.emit('file_sent', {'filename': filename, 'mimetype': mimetype, 'size': size, 'url': url}, to=sid)
+    except Exception as e:
+        print(f"[ERREUR] Envoi fichier: {e}")
+        socketio.emit('error', {'message': f"Erreur envoi fichier: {str(e)}"}, to=sid)
+
+
+def _resume_transfers():
+    """Reprend les envois de fichiers interrompus vers ce serveur"""
+    for row in db.get_pending_transfers('sent', peer=server_peer):
+        if not connected:
+            return
+        if not os.path.exists(row['file_path']):
+            db.finish_transfer(row['transfer_id'], 'failed')
+            continue
+        print(f"[INFO] Reprise de l'envoi de {row['filename']}")
+        _deliver_file(row['file_path'], row['filename'], row['mimetype'], row['sha256'],
+                      transfer_id=row['transfer_id'])
+
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Reçoit un fichier de l'UI client en flux (corps brut) et le transmet au serveur"""
+    if not connected or not client_conn:
+        return jsonify({'success': False, 'error': 'Non connecté au serveur.'}), 409
+
+    filename = os.path.basename(unquote(request.headers.get('X-Filename', '')))
+    mimetype = request.mimetype or 'application/octet-stream'
+    sid = request.args.get('sid')
+    if not filename:
+        return jsonify({'success': False, 'error': 'Fichier invalide.'}), 400
+
+    print(f"[CLIENT] Envoi de fichier demandé: {filename} ({mimetype})")
+    sha256, size, save_path = blob_store.add_stream(request.stream.read)
+
+    thread = threading.Thread(target=_deliver_file, args=(save_path, filename, mimetype, sha256, sid))
+    thread.daemon = True
+    thread.start()
+    return jsonify({'success': True, 'size': size})
 
 
 @socketio.on('send_file')
 def handle_send_file(data):
-    """Réception d'un fichier depuis l'UI client et envoi au serveur TCP."""
-    global client_socket, connected
-    if not connected or not client_socket:
+    """Réception d'un fichier encodé en base64 depuis l'UI client et envoi au serveur TCP."""
+    global client_conn, connected
+    if not connected or not client_conn:
         emit('error', {'message': 'Non connecté au serveur.'})
         return
 
@@ -363,32 +712,19 @@ def handle_send_file(data):
         if len(raw) > 2 * 1024 * 1024:
             emit('error', {'message': 'Fichier trop volumineux (max 2 Mo).'})
             return
-        save_path = CLIENT_SENT_DIR / filename
-        with open(save_path, 'wb') as f:
-            f.write(raw)
-        
-        line = f"__FILE__|{filename}|{mimetype}|{len(raw)}|{b64}\n"
-        client_socket.send(line.encode('utf-8'))
-        
-        # Sauvegarder dans SQLite
-        timestamp = datetime.now().isoformat()
-        db.save_file(
-            1,  # Client ID (constant: 1)
-            filename,
-            mimetype,
-            len(raw),
-            'sent',
-            username,
-            str(save_path),
-            timestamp
-        )
-        
-        emit('file_sent', {'filename': filename, 'mimetype': mimetype, 'size': len(raw)})
+        sha256, _size, save_path = blob_store.add_bytes(raw)
+        _deliver_file(save_path, filename, mimetype, sha256, request.sid)
     except Exception as e:
         print(f"[ERREUR] Envoi fichier: {e}")
         emit('error', {'message': f"Erreur envoi fichier: {str(e)}"})
 
 if __name__ == '__main__':
+    removed = blob_store.collect_garbage()
+    if removed:
+        print(f"[INFO] {removed} pièce(s) jointe(s) orpheline(s) supprimée(s)")
+    # LNM_RETENTION_DAYS=N : archive toutes les heures l'historique de plus de N jours
+    if os.environ.get('LNM_RETENTION_DAYS'):
+        RetentionService(db, int(os.environ['LNM_RETENTION_DAYS'])).start()
     print('[WEB] Serveur client web démarré sur http://localhost:5001')
     print('[INFO] Ouvrez http://localhost:5001 dans votre navigateur pour utiliser le client')
     socketio.run(app, host='127.0.0.1', port=5001, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
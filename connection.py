@@ -0,0 +1,371 @@
+"""
+Connexions TCP pour LocalNetMessage
+Abstraction d'envoi commune au moteur threadé et au moteur asyncio
+
+Les envois ne bloquent pas l'appelant (requête Flask, handler Socket.IO) :
+chaque connexion a sa file sortante, vidée par un thread écrivain dédié
+(SocketConnection) ou par la boucle d'événements (StreamConnection). Un pair
+qui ne lit plus laisse grossir sa file ; au-delà de OUTBOUND_BUDGET octets en
+attente, il est déconnecté (SlowConsumerError) au lieu de retenir les autres.
+"""
+
+import asyncio
+import socket
+import threading
+from collections import deque
+
+import metrics
+import protocol
+
+# Octets en attente d'envoi au-delà desquels le pair est jugé trop lent
+# (plusieurs trames FILE v1 de 2 Mo doivent pouvoir attendre)
+OUTBOUND_BUDGET = 16 * 1024 * 1024
+
+# À la fermeture, délai laissé à la file pour se vider (secondes)
+CLOSE_TIMEOUT = 5
+
+# Octets regroupés en un seul sendall par le thread écrivain
+WRITE_COALESCE = 64 * 1024
+
+
+class SlowConsumerError(ConnectionError):
+    """Le pair ne lit pas assez vite : file sortante au-delà du budget, connexion fermée"""
+
+
+def _compression_stats(compressor):
+    """Codec négocié et octets des trames compressées, avant et après (supervision)"""
+    if compressor is None:
+        return {'compression': None}
+    return {
+        'compression': compressor.codec,
+        'compression_raw_bytes': compressor.raw_bytes,
+        'compression_bytes': compressor.compressed_bytes
+    }
+
+
+class SocketConnection:
+    """Connexion sur un socket bloquant (moteur threadé, client_web)"""
+
+    def __init__(self, sock, budget=OUTBOUND_BUDGET):
+        """
+        Args:
+            sock: socket TCP connecté
+            budget: octets en attente tolérés avant de déconnecter le pair
+        """
+        self.sock = sock
+        self.budget = budget
+        # Protège la file, la version et les compteurs ; jamais tenu pendant un envoi
+        self.lock = threading.Condition()
+        self.closed = False
+        self.version = 1
+        self.compressor = None
+        self.slow = False
+        # Éléments (taille, octets) ou (taille, (en-tête, fichier, offset, longueur, état))
+        self._queue = deque()
+        self.queued_bytes = 0
+        self.sent_bytes = 0
+        self._writer = threading.Thread(target=self._write_loop, name='tcp-writer', daemon=True)
+        self._writer.start()
+
+    def _enqueue(self, size, item):
+        """Ajoute un élément à la file (self.lock tenu par l'appelant)"""
+        if self.closed:
+            raise ConnectionError("Connexion fermée")
+        if self._queue and self.queued_bytes + size > self.budget:
+            self._abort()
+            raise SlowConsumerError(f"Pair trop lent ({self.queued_bytes} octets en attente)")
+        self._queue.append((size, item))
+        self.queued_bytes += size
+        metrics.FRAMES_SENT.inc()
+        self.lock.notify()
+
+    def send(self, data):
+        """Met des octets en file (thread-safe, les trames ne s'entrelacent pas)"""
+        with self.lock:
+            self._enqueue(len(data), data)
+
+    def send_frame(self, ftype, value):
+        """Encode une trame selon la version négociée et la met en file"""
+        with self.lock:
+            data = protocol.encode(ftype, value, self.version)
+            if self.compressor:
+                # Sous self.lock : le contexte de compression suit l'ordre de la file
+                data = self.compressor.wrap(ftype, data)
+            self._enqueue(len(data), data)
+
+    def send_shared(self, frame):
+        """Met en file une trame de diffusion (protocol.SharedFrame), sans copie"""
+        with self.lock:
+            data = frame.encode(self.version)
+            if self.compressor:
+                # Contexte propre à la connexion : seul l'encodage est partagé
+                data = self.compressor.wrap(frame.ftype, data)
+            self._enqueue(len(data), data)
+
+    def send_file_chunk(self, header, fileobj, offset, count):
+        """
+        Envoie un en-tête de trame suivi d'un extrait de fichier
+
+        Le contenu part du cache disque vers le socket via socket.sendfile
+        (os.sendfile quand la plateforme le permet), sans copie en Python.
+        L'appelant attend que le thread écrivain l'ait envoyé : un gros
+        fichier n'est jamais entièrement mis en file.
+        """
+        state = [threading.Event(), None]
+        with self.lock:
+            self._enqueue(len(header) + count, (header, fileobj, offset, count, state))
+        state[0].wait()
+        if state[1] is not None:
+            raise state[1]
+
+    def upgrade(self, ack_line=None):
+        """
+        Passe la connexion en protocole v2
+
+        Args:
+            ack_line: ligne v1 à envoyer juste avant la bascule (côté serveur)
+        """
+        with self.lock:
+            if ack_line:
+                data = (ack_line + "\n").encode('utf-8')
+                self._enqueue(len(data), data)
+            self.version = 2
+
+    def enable_compression(self, codec, ack=None):
+        """
+        Compresse les trames suivantes (protocole v2)
+
+        Args:
+            codec: codec négocié ('zlib' ou 'zstd')
+            ack: trame CODECS à envoyer non compressée juste avant (côté serveur)
+        """
+        with self.lock:
+            if ack:
+                data = protocol.encode(protocol.CODECS, ack, self.version)
+                self._enqueue(len(data), data)
+            self.compressor = protocol.FrameCompressor(codec)
+
+    def stats(self):
+        """Profondeur de la file sortante (supervision)"""
+        with self.lock:
+            return {
+                'queued_bytes': self.queued_bytes,
+                'queued_frames': len(self._queue),
+                'sent_bytes': self.sent_bytes,
+                'slow': self.slow,
+                **_compression_stats(self.compressor)
+            }
+
+    def _next_batch(self):
+        """Éléments à envoyer ensemble : octets consécutifs regroupés, ou un extrait de fichier"""
+        with self.lock:
+            while not self._queue and not self.closed:
+                self.lock.wait()
+            if not self._queue:
+                return None
+            size, item = self._queue.popleft()
+            if not isinstance(item, bytes):
+                return size, item
+            parts = [item]
+            while (self._queue and isinstance(self._queue[0][1], bytes)
+                   and size + self._queue[0][0] <= WRITE_COALESCE):
+                extra, data = self._queue.popleft()
+                parts.append(data)
+                size += extra
+            return size, b''.join(parts) if len(parts) > 1 else item
+
+    def _write_loop(self):
+        error = None
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                size, item = batch
+                if self.closed and not self.slow:
+                    # Fermeture demandée : le reste de la file a CLOSE_TIMEOUT pour partir
+                    self.sock.settimeout(CLOSE_TIMEOUT)
+                try:
+                    if isinstance(item, bytes):
+                        self.sock.sendall(item)
+                    else:
+                        header, fileobj, offset, count, state = item
+                        try:
+                            self.sock.sendall(header)
+                            self.sock.sendfile(fileobj, offset, count)
+                        except OSError as e:
+                            state[1] = e
+                            raise
+                        finally:
+                            state[0].set()
+                finally:
+                    with self.lock:
+                        self.queued_bytes -= size
+                        self.sent_bytes += size
+                    metrics.BYTES_SENT.inc(size)
+        except OSError as e:
+            error = e
+        finally:
+            with self.lock:
+                self.closed = True
+                pending = list(self._queue)
+                self._queue.clear()
+                self.queued_bytes = 0
+            # Les envois de fichier en attente ne doivent pas bloquer leur thread
+            for _size, item in pending:
+                if not isinstance(item, bytes):
+                    item[4][1] = error or ConnectionError("Connexion fermée")
+                    item[4][0].set()
+            self._shutdown()
+
+    def _abort(self):
+        """Pair trop lent : ferme sans vider la file (self.lock tenu par l'appelant)"""
+        print(f"[AVERTISSEMENT] Pair trop lent ({self.queued_bytes} octets en attente) : connexion fermée")
+        self.slow = True
+        self.closed = True
+        self.lock.notify()
+        self._shutdown()
+
+    def _shutdown(self):
+        # shutdown réveille aussi un recv() bloqué dans le thread de lecture
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        """Ferme la connexion une fois la file envoyée (CLOSE_TIMEOUT au plus)"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.lock.notify()
+
+
+class StreamConnection:
+    """Connexion asyncio : les envois sont replanifiés sur la boucle d'événements"""
+
+    def __init__(self, loop, writer, budget=OUTBOUND_BUDGET):
+        """
+        Args:
+            loop: boucle asyncio propriétaire du transport
+            writer: asyncio.StreamWriter de la connexion
+            budget: octets en attente dans le transport tolérés avant de
+                déconnecter le pair
+        """
+        self.loop = loop
+        self.writer = writer
+        self.budget = budget
+        self.closed = False
+        self.version = 1
+        self.compressor = None
+        self.slow = False
+        self.sent_bytes = 0
+
+    def send(self, data):
+        """Envoie des octets depuis n'importe quel thread"""
+        if self.closed:
+            raise ConnectionError("Connexion fermée")
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def send_frame(self, ftype, value):
+        """Encode une trame selon la version négociée et l'envoie depuis n'importe quel thread"""
+        if self.closed:
+            raise ConnectionError("Connexion fermée")
+        # L'encodage a lieu sur la boucle : l'ordre avec upgrade() est préservé
+        self.loop.call_soon_threadsafe(self._write_frame, ftype, value)
+
+    def send_shared(self, frame):
+        """Envoie une trame de diffusion (protocol.SharedFrame) depuis n'importe quel thread"""
+        if self.closed:
+            raise ConnectionError("Connexion fermée")
+        self.loop.call_soon_threadsafe(self._write_shared, frame)
+
+    def send_file_chunk(self, header, fileobj, offset, count):
+        """
+        Envoie un en-tête de trame suivi d'un extrait de fichier
+
+        Bloque le thread appelant jusqu'à ce que le transport soit vidé :
+        un gros fichier n'est jamais entièrement mis en tampon.
+        """
+        if self.closed:
+            raise ConnectionError("Connexion fermée")
+        fileobj.seek(offset)
+        data = header + fileobj.read(count)
+        asyncio.run_coroutine_threadsafe(self._write_and_drain(data), self.loop).result()
+
+    def upgrade(self, ack_line=None):
+        """Passe la connexion en protocole v2 (voir SocketConnection.upgrade)"""
+        self.loop.call_soon_threadsafe(self._upgrade, ack_line)
+
+    def enable_compression(self, codec, ack=None):
+        """Compresse les trames suivantes (voir SocketConnection.enable_compression)"""
+        self.loop.call_soon_threadsafe(self._enable_compression, codec, ack)
+
+    def stats(self):
+        """Profondeur du tampon d'écriture du transport (supervision)"""
+        transport = self.writer.transport
+        return {
+            'queued_bytes': 0 if transport.is_closing() else transport.get_write_buffer_size(),
+            'queued_frames': None,
+            'sent_bytes': self.sent_bytes,
+            'slow': self.slow,
+            **_compression_stats(self.compressor)
+        }
+
+    def _write(self, data):
+        """Écrit dans le transport (sur la boucle) ; coupe un pair au-delà du budget"""
+        if self.writer.is_closing():
+            return
+        transport = self.writer.transport
+        buffered = transport.get_write_buffer_size()
+        if buffered and buffered + len(data) > self.budget:
+            print(f"[AVERTISSEMENT] Pair trop lent ({buffered} octets en attente) : connexion fermée")
+            self.slow = True
+            self.closed = True
+            transport.abort()
+            return
+        self.writer.write(data)
+        self.sent_bytes += len(data)
+        metrics.FRAMES_SENT.inc()
+        metrics.BYTES_SENT.inc(len(data))
+
+    def _write_frame(self, ftype, value):
+        if not self.writer.is_closing():
+            data = protocol.encode(ftype, value, self.version)
+            self._write(self.compressor.wrap(ftype, data) if self.compressor else data)
+
+    def _write_shared(self, frame):
+        if not self.writer.is_closing():
+            data = frame.encode(self.version)
+            self._write(self.compressor.wrap(frame.ftype, data) if self.compressor else data)
+
+    async def _write_and_drain(self, data):
+        if self.writer.is_closing():
+            raise ConnectionError("Connexion fermée")
+        self.writer.write(data)
+        self.sent_bytes += len(data)
+        metrics.FRAMES_SENT.inc()
+        metrics.BYTES_SENT.inc(len(data))
+        await self.writer.drain()
+
+    def _upgrade(self, ack_line):
+        if ack_line and not self.writer.is_closing():
+            self._write((ack_line + "\n").encode('utf-8'))
+        self.version = 2
+
+    def _enable_compression(self, codec, ack):
+        if ack and not self.writer.is_closing():
+            self._write(protocol.encode(protocol.CODECS, ack, self.version))
+        self.compressor = protocol.FrameCompressor(codec)
+
+    def close(self):
+        """Ferme le transport depuis n'importe quel thread"""
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.call_soon_threadsafe(self.writer.close)
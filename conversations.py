@@ -0,0 +1,180 @@
+"""
+Conversations en mémoire pour LocalNetMessage
+
+Chaque client connecté garde ses derniers messages dans un tampon circulaire
+de taille fixe (ConversationBuffer) : la mémoire ne grandit plus avec la durée
+de la connexion. Le tampon est une copie de la fin de la table `messages` (mêmes
+ID) ; il répond aux pages d'historique qu'il contient entièrement, SQLite
+reste la référence pour le reste.
+
+À la déconnexion, le tampon passe dans un cache LRU (ConversationCache) borné
+par un budget mémoire : rouvrir la conversation d'un client parti récemment
+ne touche pas la base.
+"""
+
+import sys
+import threading
+from collections import OrderedDict, deque
+
+
+class MessageRecord:
+    """Message d'une conversation, sans le dictionnaire d'attributs d'un objet ordinaire"""
+
+    __slots__ = ('id', 'client_id', 'type', 'sender', 'message', 'timestamp', 'read')
+
+    def __init__(self, id, client_id, type, sender, message, timestamp, read=False):
+        self.id = id
+        self.client_id = client_id
+        self.type = type
+        self.sender = sender
+        self.message = message
+        self.timestamp = timestamp
+        self.read = read
+
+    def nbytes(self):
+        """Taille approximative en mémoire (enregistrement et chaînes)"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.sender)
+                + sys.getsizeof(self.message) + sys.getsizeof(self.timestamp))
+
+    def to_dict(self, read_upto=0):
+        """
+        Même forme qu'une ligne de Database.get_messages
+
+        Args:
+            read_upto: messages reçus d'ID inférieur ou égal marqués lus
+                (ConversationBuffer.mark_read)
+        """
+        read = self.read or (self.type == 'received' and self.id <= read_upto)
+        return {
+            'id': self.id,
+            'client_id': self.client_id,
+            'type': self.type,
+            'sender': self.sender,
+            'message': self.message,
+            'timestamp': self.timestamp,
+            'read': int(read)
+        }
+
+
+class ConversationBuffer:
+    """Derniers messages d'un client, par ID croissant, dans un tampon circulaire"""
+
+    def __init__(self, client_id, capacity, rows=None):
+        """
+        Args:
+            client_id: ID du client
+            capacity: nombre maximal de messages gardés
+            rows: fin de l'historique en base, get_messages(client_id,
+                limit=capacity + 1) ; le tampon sait qu'il contient tout
+                l'historique s'il y a au plus `capacity` lignes. None :
+                historique inconnu, les pages viennent toujours de SQLite
+        """
+        self.client_id = client_id
+        self.records = deque(maxlen=capacity)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # Messages reçus d'ID <= read_upto : lus
+        self.read_upto = 0
+        # Faux dès qu'un message plus ancien que le tampon existe en base
+        self.complete = rows is not None and len(rows) <= capacity
+        for row in (rows or [])[-capacity:]:
+            self._push(MessageRecord(row['id'], client_id, row['type'], row['sender'],
+                                     row['message'], row['timestamp'], bool(row['read'])))
+
+    def _push(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.nbytes -= self.records.popleft().nbytes()
+            self.complete = False
+        self.records.append(record)
+        self.nbytes += record.nbytes()
+
+    def append(self, message_id, msg_type, sender, message, timestamp):
+        """
+        Ajoute un message enregistré en base
+
+        Args:
+            message_id: ID retourné par Database.save_message (réservé
+                d'avance en write-behind) ; None : le tampon ne sert plus de pages
+        """
+        record = MessageRecord(message_id, self.client_id, msg_type, sender, message, timestamp)
+        with self.lock:
+            self._push(record)
+            # Deux threads peuvent enregistrer puis ajouter dans le désordre
+            position = len(self.records) - 1
+            while (position > 0 and message_id is not None
+                   and self.records[position - 1].id is not None
+                   and self.records[position - 1].id > message_id):
+                self.records[position] = self.records[position - 1]
+                position -= 1
+            self.records[position] = record
+
+    def mark_read(self):
+        """Marque les messages reçus comme lus, sans parcourir le tampon"""
+        with self.lock:
+            if self.records and self.records[-1].id is not None:
+                self.read_upto = self.records[-1].id
+
+    def page(self, before_id, limit):
+        """
+        Page d'historique, comme get_messages(client_id, before_id, limit + 1)
+
+        Returns:
+            (messages, has_more), ou None si le tampon ne contient pas toute
+            la page et qu'il faut interroger SQLite
+        """
+        with self.lock:
+            if any(record.id is None for record in self.records):
+                return None
+            # Curseur hors du tampon (message archivé) : la suite est en base
+            if before_id is not None and all(record.id != before_id for record in self.records):
+                return None
+            older = [record for record in self.records if before_id is None or record.id < before_id]
+            if len(older) > limit:
+                return [record.to_dict(self.read_upto) for record in older[-limit:]], True
+            if self.complete:
+                return [record.to_dict(self.read_upto) for record in older], False
+            return None
+
+
+class ConversationCache:
+    """Tampons des clients déconnectés, les moins récemment consultés évincés au-delà du budget"""
+
+    def __init__(self, budget):
+        """
+        Args:
+            budget: taille mémoire maximale des tampons gardés, en octets
+        """
+        self.budget = budget
+        self.nbytes = 0
+        self.buffers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, buffer):
+        """Garde le tampon d'un client qui vient de se déconnecter"""
+        with self.lock:
+            old = self.buffers.pop(buffer.client_id, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            if buffer.nbytes > self.budget:
+                return
+            self.buffers[buffer.client_id] = buffer
+            self.nbytes += buffer.nbytes
+            while self.nbytes > self.budget:
+                _client_id, evicted = self.buffers.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def get(self, client_id):
+        """Tampon d'un client déconnecté (None s'il a été évincé)"""
+        with self.lock:
+            buffer = self.buffers.get(client_id)
+            if buffer is not None:
+                self.buffers.move_to_end(client_id)
+            return buffer
+
+    def pop(self, client_id):
+        """Retire le tampon d'un client (ID réutilisé par une nouvelle connexion)"""
+        with self.lock:
+            buffer = self.buffers.pop(client_id, None)
+            if buffer is not None:
+                self.nbytes -= buffer.nbytes
+            return buffer
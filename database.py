@@ -3,38 +3,360 @@ Database module for LocalNetMessage
 Gère la persistance des messages et fichiers avec SQLite
 """
 
+import atexit
+import os
 import sqlite3
 import json
+import operator
+import queue
+import re
 import threading
+import time
+import unicodedata
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 
+import metrics
+
+# Connexions inactives gardées ouvertes (au-delà, elles sont fermées après usage)
+POOL_SIZE = 8
+
+# En WAL, NORMAL ne synchronise le disque qu'aux checkpoints : une coupure de
+# courant peut perdre les dernières transactions, jamais corrompre la base
+SYNCHRONOUS = 'NORMAL'
+
+# Attente maximale d'un verrou tenu par un autre processus (ms)
+BUSY_TIMEOUT = 5000
+
+# Plus grand ID de ligne possible (borne du curseur de pagination)
+SQLITE_MAX_ROWID = 2 ** 63 - 1
+
+# Recherche plein texte : bornes des termes trouvés dans les extraits (caractères
+# de contrôle, absents des messages : l'UI échappe le HTML puis les remplace)
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+SNIPPET_TOKENS = 12
+
+# Au-delà de ce nombre de correspondances, les résultats sont classés du plus
+# récent au plus ancien : bm25 parcourt toutes les occurrences de chaque mot,
+# des centaines de ms pour un mot courant sur 1M de messages
+SEARCH_WINDOW = 1000
+
+# Rétention : lignes déplacées vers les archives par transaction (le verrou
+# d'écriture n'est tenu que quelques millisecondes à la fois) et pages rendues
+# au système par étape de VACUUM incrémental
+ARCHIVE_BATCH = 500
+VACUUM_PAGES = 1000
+
+# Colonnes copiées dans les archives (ordre indépendant des migrations)
+MESSAGE_COLUMNS = 'id, client_id, type, sender, message, timestamp, read, created_at'
+FILE_COLUMNS = ('id, client_id, filename, mimetype, size, type, sender, file_path, timestamp, '
+                'created_at, sha256, blob')
+CLIENT_COLUMNS = ('client_id, username, address, first_seen, last_seen, message_count, file_count, '
+                  'unread_count')
+BROADCAST_COLUMNS = 'id, target, sender, message, filename, mimetype, size, timestamp, created_at, blob'
+RECIPIENT_COLUMNS = 'client_id, broadcast_id'
+
+# Export : lignes lues par requête ; aucune transaction de lecture ne reste
+# ouverte pendant que le flux est écrit (checkpoints WAL non bloqués)
+EXPORT_BATCH = 1000
+
+# Import en masse : lignes par executemany (et par appel de progression)
+IMPORT_BATCH = 50000
+IMPORT_CACHE_KIB = 256 * 1024
+
+# Mode write-behind : un lot est validé après WRITE_BEHIND_ROWS écritures ou
+# WRITE_BEHIND_MS ms après la première ; au-delà de WRITE_BEHIND_QUEUE
+# écritures en attente, l'appelant attend que le thread écrivain rattrape
+WRITE_BEHIND_ROWS = 500
+WRITE_BEHIND_MS = 20
+WRITE_BEHIND_QUEUE = 10000
+
+# Élément de file demandant la validation immédiate du lot en cours
+_FLUSH = object()
+
+def _fold(word):
+    """Forme de comparaison d'un mot, comme le tokenizer unicode61 : casse et accents ignorés"""
+    decomposed = unicodedata.normalize('NFD', word.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def fts_terms(text):
+    """
+    Mots d'une saisie de recherche, sous leur forme de comparaison
+    
+    Returns:
+        Liste de mots (vide si la saisie n'en contient aucun)
+    """
+    return [_fold(word) for word in re.findall(r'\w+', text or '')]
+
+def fts_query(terms, client_id=None):
+    """
+    Traduit des mots de recherche en requête FTS5 : chaque mot entre
+    guillemets (aucun opérateur interprété), le dernier en préfixe,
+    éventuellement restreinte à la conversation d'un client
+    """
+    query = 'message : (' + ' '.join(f'"{term}"' for term in terms) + '*)'
+    if client_id is not None:
+        query += f' AND client_id : "{int(client_id)}"'
+    return query
+
+def snippet(message, terms):
+    """
+    Extrait d'un message autour du premier terme trouvé, termes encadrés par
+    HIGHLIGHT_START et HIGHLIGHT_END
+    
+    Args:
+        message: texte complet du message
+        terms: mots de recherche (fts_terms), le dernier comparé en préfixe
+    
+    Returns:
+        Au plus SNIPPET_TOKENS mots, '…' marquant les coupures
+    """
+    words = list(re.finditer(r'\w+', message))
+    if not words:
+        return message
+    exact, prefix = set(terms[:-1]), terms[-1]
+    hits = [i for i, word in enumerate(words)
+            if _fold(word.group()) in exact or _fold(word.group()).startswith(prefix)]
+    
+    first = max(min(hits or [0]) - SNIPPET_TOKENS // 4, 0)
+    last = min(first + SNIPPET_TOKENS, len(words)) - 1
+    first = max(last - SNIPPET_TOKENS + 1, 0)
+    start = 0 if first == 0 else words[first].start()
+    end = len(message) if last == len(words) - 1 else words[last].end()
+    
+    parts = ['…' if first > 0 else '']
+    position = start
+    for i in hits:
+        if first <= i <= last:
+            word = words[i]
+            parts += [message[position:word.start()], HIGHLIGHT_START, word.group(), HIGHLIGHT_END]
+            position = word.end()
+    parts += [message[position:end], '…' if end < len(message) else '']
+    return ''.join(parts)
+
 class Database:
     """Classe pour gérer les opérations SQLite"""
     
-    def __init__(self, db_path='messages.db'):
+    def __init__(self, db_path='messages.db', write_behind=False, archive_dir=None, readonly=False):
         """
         Initialise la connexion à la base de données SQLite
         
         Args:
             db_path: chemin du fichier SQLite (défaut: messages.db)
+            write_behind: différer les écritures du chemin chaud (messages,
+                compteurs) vers un thread qui les valide par lots
+            archive_dir: dossier des archives mensuelles (retention.py) ;
+                les lectures d'historique s'y poursuivent
+            readonly: connexions en lecture seule (archives)
         """
         self.db_path = Path(db_path)
+        self.archive_dir = Path(archive_dir) if archive_dir is not None else None
+        self.readonly = readonly
+        # Sérialise les écritures ; les lectures n'attendent pas l'écrivain (WAL)
         self.lock = threading.Lock()
-        self._init_db()
+        self._pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        self._writer = None
+        self._archives = {}
+        # (mtime du dossier d'archives, fichiers) : pas de glob à chaque lecture
+        self._archive_paths = None
+        self._archives_lock = threading.Lock()
+        if readonly:
+            with self._read() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+                self.has_fts = cursor.fetchone() is not None
+        else:
+            self._init_db()
+        
+        if write_behind:
+            self._queue = queue.Queue(maxsize=WRITE_BEHIND_QUEUE)
+            self._enqueue_lock = threading.Lock()
+            self._durable = threading.Condition()
+            self._queued = 0
+            self._committed = 0
+            # ID des messages mis en file, réservés d'avance (save_message les retourne)
+            self._next_message_id = self._last_message_id() + 1
+            self._writer = threading.Thread(target=self._write_behind_loop, name='db-writer', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
     
-    def _get_connection(self):
-        """Retourne une connexion SQLite thread-safe"""
-        conn = sqlite3.connect(str(self.db_path))
+    def _connect(self):
+        """Ouvre une connexion configurée (WAL, synchronous, busy_timeout)"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        if self.readonly:
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+            conn.execute('PRAGMA query_only=ON')
+            return conn
+        # Sans effet sur une base existante ; une nouvelle base doit le recevoir
+        # avant de passer en WAL (enable_incremental_vacuum convertit les autres)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={SYNCHRONOUS}')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
         return conn
     
-    def _init_db(self):
-        """Crée les tables si elles n'existent pas"""
+    def _get_connection(self):
+        """Emprunte une connexion au pool (ou en ouvre une si le pool est vide)"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def _release(self, conn):
+        """Rend une connexion au pool"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    @contextmanager
+    def _read(self):
+        """
+        Curseur de lecture, sans verrou : voit le dernier état validé
+
+        En write-behind, les écritures encore en file n'y sont pas (quelques
+        ms) : les lectures de l'UI n'attendent pas le disque. Une lecture qui
+        doit tout voir (export) appelle _flush_pending avant.
+        """
+        conn = self._get_connection()
+        try:
+            yield conn.cursor()
+        finally:
+            self._release(conn)
+    
+    @contextmanager
+    def _write(self):
+        """Curseur d'écriture sous self.lock ; commit en sortie, rollback sur exception"""
+        self._flush_pending()
         with self.lock:
             conn = self._get_connection()
-            cursor = conn.cursor()
-            
+            try:
+                yield conn.cursor()
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._release(conn)
+    
+    def _execute(self, sql, params):
+        """
+        Exécute une écriture du chemin chaud, différée en mode write-behind
+        
+        Returns:
+            lastrowid, ou None si l'écriture est différée
+        """
+        if self._writer is not None:
+            with self._enqueue_lock:
+                if self._writer is not None:
+                    self._queued += 1
+                    self._queue.put((self._queued, sql, params))
+                    return None
+        with self._write() as cursor:
+            cursor.execute(sql, params)
+            return cursor.lastrowid
+    
+    def _last_message_id(self):
+        """Plus grand ID de message attribué (sqlite_sequence : archives comprises)"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0),
+                           COALESCE((SELECT MAX(id) FROM messages), 0))
+            ''')
+            return cursor.fetchone()[0]
+    
+    def _reserve_message_id(self):
+        """ID d'un message mis en file (write-behind)"""
+        with self._enqueue_lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return message_id
+    
+    def _flush_pending(self):
+        """Avant une écriture directe ou un parcours complet : valide les écritures différées"""
+        if (self._writer is not None and self._queued != self._committed
+                and threading.current_thread() is not self._writer):
+            self.flush()
+    
+    def flush(self, timeout=None):
+        """
+        Attend que les écritures différées jusqu'ici soient validées sur disque
+        
+        Args:
+            timeout: délai maximal en secondes (None: sans limite)
+        
+        Returns:
+            True si tout est validé, False si le délai a expiré
+        """
+        writer = self._writer
+        if writer is None:
+            return True
+        with self._enqueue_lock:
+            target = self._queued
+            if self._committed >= target:
+                return True
+            self._queue.put(_FLUSH)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._durable:
+            while self._committed < target and writer.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._durable.wait(remaining)
+        return self._committed >= target
+    
+    def pending_writes(self):
+        """Nombre d'écritures différées pas encore validées (0 hors write-behind)"""
+        if self._writer is None:
+            return 0
+        return self._queued - self._committed
+    
+    def _write_behind_loop(self):
+        """Thread écrivain : vide la file et valide chaque lot en une transaction"""
+        running = True
+        while running:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + WRITE_BEHIND_MS / 1000
+            while True:
+                if item is None:
+                    running = False
+                    break
+                if item is _FLUSH:
+                    break
+                batch.append(item)
+                if len(batch) >= WRITE_BEHIND_ROWS:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit_batch(batch)
+                with self._durable:
+                    self._committed = batch[-1][0]
+                    self._durable.notify_all()
+    
+    def _commit_batch(self, batch):
+        """Valide un lot ; en cas d'erreur, rejoue ligne par ligne pour isoler la fautive"""
+        try:
+            with self._write() as cursor:
+                for _seq, sql, params in batch:
+                    cursor.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[ERREUR] Écriture différée d'un lot de {len(batch)} ligne(s): {e}")
+            for _seq, sql, params in batch:
+                try:
+                    with self._write() as cursor:
+                        cursor.execute(sql, params)
+                except sqlite3.Error as e:
+                    print(f"[ERREUR] Écriture différée ignorée: {e}")
+    
+    def _init_db(self):
+        """Crée les tables si elles n'existent pas"""
+        with self._write() as cursor:
             # Table des messages
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS messages (
@@ -50,13 +372,21 @@ class Database:
             ''')
             
             # Index pour optimiser les requêtes
+            # (client_id, id) : pagination de l'historique par curseur ; remplace
+            # l'ancien idx_client_id(client_id), dont il couvre les requêtes
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_client_id ON messages(client_id)
+                CREATE INDEX IF NOT EXISTS idx_messages_client_id_id ON messages(client_id, id)
+            ''')
+            cursor.execute('''
+                DROP INDEX IF EXISTS idx_client_id
             ''')
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)
             ''')
             
+            # Recherche plein texte, synchronisée avec `messages` par triggers
+            self.has_fts = self._init_fts(cursor)
+            
             # Table des fichiers
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS files (
@@ -76,6 +406,80 @@ class Database:
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_file_client_id ON files(client_id)
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_file_timestamp ON files(timestamp)
+            ''')
+            
+            # SHA-256 du contenu (ETag des téléchargements), absent des anciennes bases
+            self._ensure_column(cursor, 'files', 'sha256', 'TEXT')
+            # Blob du BlobStore (NULL pour les fichiers stockés avant le store)
+            self._ensure_column(cursor, 'files', 'blob', 'TEXT')
+            
+            # Blobs adressés par contenu et nombre de lignes `files` qui les utilisent
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_file_path ON files(file_path)
+            ''')
+            
+            # Diffusions (tous les clients ou un groupe) : un message ou un fichier
+            # enregistré une fois, plus une ligne par destinataire
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    target TEXT NOT NULL,
+                    sender TEXT NOT NULL,
+                    message TEXT,
+                    filename TEXT,
+                    mimetype TEXT,
+                    size INTEGER,
+                    blob TEXT,
+                    timestamp TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    client_id INTEGER NOT NULL,
+                    broadcast_id INTEGER NOT NULL,
+                    PRIMARY KEY (client_id, broadcast_id)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Transferts de fichiers en flux (reprise après coupure)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS file_transfers (
+                    transfer_id TEXT PRIMARY KEY,
+                    direction TEXT NOT NULL CHECK(direction IN ('received', 'sent')),
+                    peer TEXT,
+                    filename TEXT NOT NULL,
+                    mimetype TEXT,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    file_path TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'partial'
+                        CHECK(status IN ('partial', 'complete', 'failed')),
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Morceaux reçus d'un transfert en cours, avec leur CRC32
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transfer_chunks (
+                    transfer_id TEXT NOT NULL,
+                    chunk_offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    crc32 INTEGER NOT NULL,
+                    PRIMARY KEY (transfer_id, chunk_offset)
+                ) WITHOUT ROWID
+            ''')
             
             # Table d'historique des clients
             cursor.execute('''
@@ -87,12 +491,110 @@ class Database:
                     first_seen TEXT DEFAULT CURRENT_TIMESTAMP,
                     last_seen TEXT,
                     message_count INTEGER DEFAULT 0,
-                    file_count INTEGER DEFAULT 0
+                    file_count INTEGER DEFAULT 0,
+                    unread_count INTEGER DEFAULT 0
                 )
             ''')
             
-            conn.commit()
-            conn.close()
+            # Messages reçus non lus : compteur tenu à jour à chaque insertion et
+            # suppression, remis à zéro par mark_messages_read
+            if self._ensure_column(cursor, 'client_history', 'unread_count', 'INTEGER DEFAULT 0'):
+                cursor.execute('''
+                    UPDATE client_history SET unread_count = (
+                        SELECT COUNT(*) FROM messages
+                        WHERE messages.client_id = client_history.client_id
+                        AND type = 'received' AND read = 0
+                    )
+                ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_unread
+                ON messages(client_id) WHERE type = 'received' AND read = 0
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_unread_insert AFTER INSERT ON messages
+                WHEN new.type = 'received' AND new.read = 0 BEGIN
+                    UPDATE client_history SET unread_count = unread_count + 1
+                    WHERE client_id = new.client_id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_unread_delete AFTER DELETE ON messages
+                WHEN old.type = 'received' AND old.read = 0 BEGIN
+                    UPDATE client_history SET unread_count = MAX(unread_count - 1, 0)
+                    WHERE client_id = old.client_id;
+                END
+            ''')
+    
+    def _init_fts(self, cursor):
+        """
+        Crée l'index FTS5 de `messages` (contenu externe) et ses triggers ;
+        l'index est construit à partir des messages existants à sa création
+        
+        Returns:
+            False si SQLite est compilé sans FTS5
+        """
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'
+        ''')
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    message,
+                    client_id,
+                    content='messages',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"[AVERTISSEMENT] Recherche plein texte indisponible (FTS5): {e}")
+            return False
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, message, client_id)
+                VALUES (new.id, new.message, new.client_id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message, client_id)
+                VALUES ('delete', old.id, old.message, old.client_id);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message, client_id ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message, client_id)
+                VALUES ('delete', old.id, old.message, old.client_id);
+                INSERT INTO messages_fts (rowid, message, client_id)
+                VALUES (new.id, new.message, new.client_id);
+            END
+        ''')
+        if not exists:
+            # client_id n'est indexé que pour filtrer une conversation : sans
+            # poids dans le classement
+            cursor.execute('''
+                INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')
+            ''')
+            cursor.execute('''
+                INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')
+            ''')
+        return True
+    
+    def _ensure_column(self, cursor, table, column, definition):
+        """
+        Ajoute une colonne à une table existante si elle manque (migration)
+        
+        Returns:
+            True si la colonne vient d'être ajoutée
+        """
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column in [row['name'] for row in cursor.fetchall()]:
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
     
     def save_message(self, client_id, message_type, sender, message, timestamp):
         """
@@ -104,70 +606,347 @@ class Database:
             sender: nom de l'expéditeur
             message: contenu du message
             timestamp: timestamp ISO du message
+        
+        Returns:
+            ID du message (réservé d'avance en mode write-behind)
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+        with metrics.DB_SAVE_MESSAGE_SECONDS.time():
+            if self._writer is not None:
+                # ID réservé : le tampon de conversation peut servir des pages
+                # avant que le thread écrivain ait validé la ligne
+                message_id = self._reserve_message_id()
+                self._execute('''
+                    INSERT INTO messages 
+                    (id, client_id, type, sender, message, timestamp, read)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (message_id, client_id, message_type, sender, message, timestamp, 0))
+                return message_id
+            return self._execute('''
                 INSERT INTO messages 
                 (client_id, type, sender, message, timestamp, read)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (client_id, message_type, sender, message, timestamp, 0))
-            
-            conn.commit()
-            msg_id = cursor.lastrowid
-            conn.close()
-            
-            return msg_id
     
-    def get_messages(self, client_id):
+    def get_messages(self, client_id, before_id=None, limit=50):
         """
-        Récupère tous les messages d'un client
+        Récupère une page de l'historique d'un client (pagination par curseur)
         
         Args:
             client_id: ID du client
+            before_id: premier message de la page précédente (page plus
+                ancienne) ; None pour les plus récents. Messages d'ID inférieur
+                dans la base courante, puis antérieurs par (timestamp, id) dans
+                les archives
+            limit: nombre maximal de messages (None: tout l'historique)
         
         Returns:
-            Liste de dictionnaires (messages)
+            Liste de dictionnaires (messages), du plus ancien au plus récent
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        if limit is None:
+            limit = -1  # LIMIT négatif : pas de limite
+        
+        # Curseur déjà dans les archives : la base courante a été parcourue
+        archives = self.archives()
+        archived_key = self._archived_key(client_id, before_id, archives) if before_id is not None else None
+        rows = []
+        if archived_key is None:
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT id, type, sender, message, timestamp, read
+                    FROM messages
+                    WHERE client_id = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (client_id, SQLITE_MAX_ROWID if before_id is None else before_id, limit))
+                rows = [dict(row) for row in reversed(cursor.fetchall())]
+        
+        # Suite de la conversation dans les archives, par (timestamp, id) : les
+        # ID ne suivent pas forcément les horodatages (import --new-ids), mais
+        # chaque archive couvre un mois, plus ancien que la suivante
+        for archive in archives:
+            if limit != -1 and len(rows) >= limit:
+                break
+            older = archive._messages_before(client_id, archived_key,
+                                             -1 if limit == -1 else limit - len(rows))
+            rows = older + rows
+        return rows
+    
+    def _archived_key(self, client_id, message_id, archives):
+        """
+        Clé (timestamp, id) d'un message archivé servant de curseur
+
+        Returns:
+            Tuple, ou None si le message est dans la base courante (ou introuvable)
+        """
+        if not archives:
+            return None
+        with self._read() as cursor:
             cursor.execute('''
+                SELECT 1 FROM messages WHERE id = ? AND client_id = ?
+            ''', (message_id, client_id))
+            if cursor.fetchone():
+                return None
+        for archive in archives:
+            with archive._read() as cursor:
+                cursor.execute('''
+                    SELECT timestamp, id FROM messages WHERE id = ? AND client_id = ?
+                ''', (message_id, client_id))
+                row = cursor.fetchone()
+            if row:
+                return row['timestamp'], row['id']
+        return None
+    
+    def _messages_before(self, client_id, key, limit):
+        """
+        Page d'une archive, du plus ancien au plus récent, par (timestamp, id)
+
+        Args:
+            key: ne retourner que les messages antérieurs à cette clé (None: tous)
+            limit: nombre maximal de messages (-1: pas de limite)
+        """
+        condition = 'AND (timestamp, id) < (?, ?)' if key else ''
+        with self._read() as cursor:
+            cursor.execute(f'''
                 SELECT id, type, sender, message, timestamp, read
                 FROM messages
-                WHERE client_id = ?
-                ORDER BY timestamp ASC
-            ''', (client_id,))
+                WHERE client_id = ? {condition}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (client_id, *(key or ()), limit))
+            return [dict(row) for row in reversed(cursor.fetchall())]
+    
+    def search(self, query, client_id=None, limit=20, cursor=None):
+        """
+        Recherche plein texte dans les messages, archives comprises
+        
+        Les résultats sont classés par pertinence (bm25) tant que la recherche
+        trouve au plus SEARCH_WINDOW messages, du plus récent au plus ancien
+        au-delà (mot trop courant pour que le classement ait un sens). La base
+        courante passe avant les archives, de la plus récente à la plus ancienne.
+        
+        Args:
+            query: texte saisi ; tous les mots doivent apparaître (casse et
+                accents ignorés), le dernier peut n'être qu'un début de mot
+            client_id: limiter à la conversation d'un client (None: toutes)
+            limit: nombre de résultats par page
+            cursor: `next_cursor` de la page précédente (None: première page)
+        
+        Returns:
+            Dictionnaire {'results': [...], 'next_cursor': curseur ou None,
+            'ranking': 'relevance' ou 'recency'} ; chaque résultat contient id,
+            client_id, type, sender, timestamp et snippet (termes trouvés
+            entre HIGHLIGHT_START et HIGHLIGHT_END)
+        
+        Raises:
+            ValueError: curseur invalide
+        """
+        if not self.has_fts:
+            raise RuntimeError("Recherche plein texte indisponible (SQLite sans FTS5)")
+        terms = fts_terms(query)
+        if not terms:
+            return {'results': [], 'next_cursor': None, 'ranking': 'relevance'}
+        
+        # Curseur "<base>:<offset>" : 0 pour la base courante, puis les archives
+        source, offset = (int(part) for part in (cursor or '0:0').split(':'))
+        if source < 0 or offset < 0:
+            raise ValueError(f"Curseur de recherche invalide: {cursor!r}")
+        sources = [self] + [archive for archive in self.archives() if archive.has_fts]
+        results, ranking, next_cursor = [], None, None
+        while source < len(sources) and len(results) < limit:
+            page, has_more, page_ranking = sources[source]._search_page(
+                terms, client_id, limit - len(results), offset)
+            results += page
+            ranking = ranking or page_ranking
+            if has_more:
+                next_cursor = f'{source}:{offset + len(page)}'
+                break
+            source, offset = source + 1, 0
+        else:
+            if source < len(sources):
+                next_cursor = f'{source}:0'
+        return {'results': results, 'next_cursor': next_cursor, 'ranking': ranking or 'relevance'}
+    
+    def _search_page(self, terms, client_id, limit, offset):
+        """
+        Une page de résultats de search dans cette seule base
+        
+        Returns:
+            (résultats, True s'il en reste après, 'relevance' ou 'recency')
+        """
+        match = fts_query(terms, client_id)
+        with self._read() as cursor:
+            # Parcours de l'index par rowid décroissant : s'arrête après
+            # SEARCH_WINDOW + 1 correspondances, quel que soit leur nombre
+            cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT rowid FROM messages_fts
+                    WHERE messages_fts MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                )
+            ''', (match, SEARCH_WINDOW + 1))
+            ranking = 'relevance' if cursor.fetchone()[0] <= SEARCH_WINDOW else 'recency'
+            order = 'messages_fts.rank' if ranking == 'relevance' else 'messages_fts.rowid DESC'
             
-            rows = cursor.fetchall()
-            conn.close()
+            cursor.execute(f'''
+                SELECT m.id, m.client_id, m.type, m.sender, m.message, m.timestamp
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+            ''', (match, limit + 1, offset))
             
-            return [dict(row) for row in rows]
+            rows = [dict(row) for row in cursor.fetchall()]
+        
+        # Extraits calculés pour la seule page renvoyée
+        results = []
+        for row in rows[:limit]:
+            row['snippet'] = snippet(row.pop('message'), terms)
+            results.append(row)
+        
+        # Une ligne de plus que demandé pour savoir s'il reste une page
+        return results, len(rows) > limit, ranking
     
     def mark_messages_read(self, client_id):
         """
         Marque tous les messages reçus d'un client comme lus
         
+        Seuls les messages encore non lus sont parcourus (index partiel
+        idx_messages_unread) : le coût ne dépend pas de la taille de l'historique.
+        Les non-lus archivés sont marqués d'abord : si une archive est
+        verrouillée ou illisible, l'exception remonte et le compteur garde
+        sa valeur (un nouvel appel reprend).
+        
         Args:
             client_id: ID du client
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._write() as cursor:
+            cursor.execute('''
+                SELECT unread_count FROM client_history WHERE client_id = ?
+            ''', (client_id,))
+            row = cursor.fetchone()
+            cursor.execute('''
+                SELECT COUNT(*) FROM messages
+                WHERE client_id = ? AND type = 'received' AND read = 0
+            ''', (client_id,))
+            # Le compteur inclut les non-lus déplacés dans les archives (archive_batch)
+            if (row[0] if row else 0) > cursor.fetchone()[0]:
+                self._mark_archived_read(cursor.connection, client_id)
             cursor.execute('''
                 UPDATE messages
                 SET read = 1
-                WHERE client_id = ? AND type = 'received'
+                WHERE client_id = ? AND type = 'received' AND read = 0
+            ''', (client_id,))
+            cursor.execute('''
+                UPDATE client_history
+                SET unread_count = 0
+                WHERE client_id = ?
             ''', (client_id,))
+    
+    def _mark_archived_read(self, conn, client_id):
+        """
+        Marque comme lus les messages reçus d'un client restés non lus dans
+        les archives, une transaction par archive (seule écriture dans une archive)
+        
+        Args:
+            conn: connexion de l'appelant, sous self.lock et hors transaction
+                (ATTACH y est interdit)
+            client_id: ID du client
+        """
+        for archive in self.archives():
+            conn.execute('ATTACH DATABASE ? AS archive', (str(archive.db_path),))
+            try:
+                conn.execute('''
+                    UPDATE archive.messages
+                    SET read = 1
+                    WHERE client_id = ? AND type = 'received' AND read = 0
+                ''', (client_id,))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute('DETACH DATABASE archive')
+    
+    def get_unread_summary(self):
+        """
+        Conversations ayant des messages reçus non lus
+        
+        Returns:
+            Liste de dictionnaires {client_id, username, unread_count}
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT client_id, username, unread_count
+                FROM client_history
+                WHERE unread_count > 0
+                ORDER BY client_id
+            ''')
             
-            conn.commit()
-            conn.close()
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def save_broadcast(self, target, sender, timestamp, client_ids, message=None, file=None):
+        """
+        Enregistre une diffusion et ses destinataires en une transaction
+        
+        Args:
+            target: 'all' ou 'group:<nom>'
+            sender: nom de l'expéditeur
+            timestamp: timestamp ISO
+            client_ids: clients destinataires (leur compteur de messages ou
+                de fichiers est incrémenté)
+            message: texte diffusé (None pour un fichier)
+            file: tuple (nom, mimetype, taille, hash du blob) d'un fichier
+                diffusé ; le compteur du blob est incrémenté une seule fois
+        
+        Returns:
+            ID de la diffusion
+        """
+        filename, mimetype, size, blob = file or (None, None, None, None)
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT INTO broadcasts (target, sender, message, filename, mimetype, size, blob, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (target, sender, message, filename, mimetype, size, blob, timestamp))
+            broadcast_id = cursor.lastrowid
+            cursor.executemany('''
+                INSERT OR IGNORE INTO broadcast_recipients (client_id, broadcast_id) VALUES (?, ?)
+            ''', [(client_id, broadcast_id) for client_id in client_ids])
+            counter = 'file_count' if file else 'message_count'
+            cursor.executemany(f'''
+                UPDATE client_history SET {counter} = {counter} + 1 WHERE client_id = ?
+            ''', [(client_id,) for client_id in client_ids])
+            if blob:
+                cursor.execute('''
+                    UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?
+                ''', (blob,))
+            return broadcast_id
+    
+    def get_broadcasts(self, client_id, after=None, before=None):
+        """
+        Diffusions reçues par un client, dans un intervalle de temps
+        
+        Args:
+            client_id: ID du client
+            after: timestamp ISO minimal inclus (None: depuis le début)
+            before: timestamp ISO maximal exclu (None: jusqu'à maintenant)
+        
+        Returns:
+            Liste de dictionnaires, du plus ancien au plus récent
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT b.id, b.target, b.sender, b.message, b.filename, b.mimetype, b.size,
+                       b.blob, b.timestamp
+                FROM broadcast_recipients r JOIN broadcasts b ON b.id = r.broadcast_id
+                WHERE r.client_id = ? AND b.timestamp >= ? AND b.timestamp < ?
+                ORDER BY b.timestamp
+            ''', (client_id, after or '', before or '\uffff'))
+            return [dict(row) for row in cursor.fetchall()]
     
-    def save_file(self, client_id, filename, mimetype, size, file_type, sender, file_path, timestamp):
+    def save_file(self, client_id, filename, mimetype, size, file_type, sender, file_path, timestamp,
+                  sha256=None, blob=None):
         """
         Sauvegarde les métadonnées d'un fichier
         
@@ -180,20 +959,21 @@ class Database:
             sender: nom de l'expéditeur
             file_path: chemin du fichier stocké
             timestamp: timestamp ISO
+            sha256: SHA-256 du contenu s'il est déjà connu
+            blob: hash du blob référencé (BlobStore), dont le compteur est incrémenté
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._write() as cursor:
             cursor.execute('''
                 INSERT INTO files
-                (client_id, filename, mimetype, size, type, sender, file_path, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (client_id, filename, mimetype, size, file_type, sender, file_path, timestamp))
+                (client_id, filename, mimetype, size, type, sender, file_path, timestamp, sha256, blob)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (client_id, filename, mimetype, size, file_type, sender, file_path, timestamp, sha256, blob))
+            if blob:
+                cursor.execute('''
+                    UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?
+                ''', (blob,))
             
-            conn.commit()
             file_id = cursor.lastrowid
-            conn.close()
             
             return file_id
     
@@ -207,10 +987,7 @@ class Database:
         Returns:
             Liste de dictionnaires (fichiers)
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._read() as cursor:
             cursor.execute('''
                 SELECT id, filename, mimetype, size, type, sender, file_path, timestamp
                 FROM files
@@ -218,11 +995,255 @@ class Database:
                 ORDER BY timestamp ASC
             ''', (client_id,))
             
+            rows = [dict(row) for row in cursor.fetchall()]
+        
+        # Fichiers archivés d'abord (plus anciens)
+        archived = []
+        for archive in reversed(self.archives()):
+            archived += archive.get_files(client_id)
+        return archived + rows
+    
+    def delete_file(self, file_id):
+        """
+        Supprime une ligne de `files` et décrémente le compteur de son blob
+        
+        Args:
+            file_id: ID de la ligne
+        
+        Returns:
+            Hash du blob s'il n'est plus référencé (à supprimer du disque), sinon None
+        """
+        with self._write() as cursor:
+            cursor.execute('''
+                SELECT blob FROM files WHERE id = ?
+            ''', (file_id,))
+            row = cursor.fetchone()
+            orphan = None
+            if row:
+                cursor.execute('''
+                    DELETE FROM files WHERE id = ?
+                ''', (file_id,))
+                if row['blob']:
+                    cursor.execute('''
+                        UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?
+                    ''', (row['blob'],))
+                    cursor.execute('''
+                        SELECT refcount FROM blobs WHERE sha256 = ?
+                    ''', (row['blob'],))
+                    count = cursor.fetchone()
+                    if count is not None and count['refcount'] <= 0:
+                        orphan = row['blob']
+            
+            
+            return orphan
+    
+    def add_blob(self, sha256, size):
+        """
+        Déclare un blob stocké (sans référence tant qu'aucun fichier ne l'utilise)
+        
+        Args:
+            sha256: hash du contenu
+            size: taille en octets
+        """
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO blobs (sha256, size) VALUES (?, ?)
+            ''', (sha256, size))
+    
+    def delete_blob(self, sha256):
+        """Retire un blob supprimé du disque"""
+        with self._write() as cursor:
+            cursor.execute('''
+                DELETE FROM blobs WHERE sha256 = ?
+            ''', (sha256,))
+    
+    def get_unreferenced_blobs(self):
+        """
+        Blobs sans ligne `files`, hors sources d'envois interrompus (à reprendre)
+        
+        Returns:
+            Liste de hash
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT sha256 FROM blobs
+                WHERE refcount <= 0
+                AND sha256 NOT IN (
+                    SELECT sha256 FROM file_transfers
+                    WHERE status = 'partial' AND direction = 'sent' AND sha256 IS NOT NULL
+                )
+            ''')
+            
+            rows = cursor.fetchall()
+            
+            return [row['sha256'] for row in rows]
+    
+    def get_file_hash(self, file_path, size):
+        """
+        Récupère le SHA-256 enregistré pour un fichier stocké
+        
+        Args:
+            file_path: chemin du fichier stocké
+            size: taille actuelle du fichier (un fichier réécrit depuis est ignoré)
+        
+        Returns:
+            SHA-256 hexadécimal ou None
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT sha256, size FROM files
+                WHERE file_path = ?
+                ORDER BY id DESC
+                LIMIT 1
+            ''', (file_path,))
+            
+            row = cursor.fetchone()
+            
+            if row is None or row['size'] != size:
+                return None
+            return row['sha256']
+    
+    def set_file_hash(self, file_path, sha256):
+        """
+        Enregistre le SHA-256 calculé pour un fichier stocké
+        
+        Args:
+            file_path: chemin du fichier stocké
+            sha256: SHA-256 hexadécimal du contenu
+        """
+        with self._write() as cursor:
+            cursor.execute('''
+                UPDATE files
+                SET sha256 = ?
+                WHERE id = (SELECT MAX(id) FROM files WHERE file_path = ?)
+            ''', (sha256, file_path))
+    
+    def start_transfer(self, transfer_id, direction, peer, filename, mimetype, size, sha256, file_path):
+        """
+        Enregistre un nouveau transfert de fichier en flux
+        
+        Args:
+            transfer_id: identifiant du transfert
+            direction: 'received' ou 'sent'
+            peer: pair distant (nom d'utilisateur ou adresse du serveur)
+            filename: nom du fichier
+            mimetype: type MIME
+            size: taille en octets
+            sha256: SHA-256 du fichier complet
+            file_path: chemin du fichier (source ou destination finale)
+        """
+        with self._write() as cursor:
+            cursor.execute('''
+                DELETE FROM transfer_chunks WHERE transfer_id = ?
+            ''', (transfer_id,))
+            cursor.execute('''
+                INSERT OR REPLACE INTO file_transfers
+                (transfer_id, direction, peer, filename, mimetype, size, sha256, file_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (transfer_id, direction, peer, filename, mimetype, size, sha256, file_path))
+    
+    def get_transfer(self, transfer_id):
+        """
+        Récupère un transfert
+        
+        Args:
+            transfer_id: identifiant du transfert
+        
+        Returns:
+            Dictionnaire du transfert ou None
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT * FROM file_transfers WHERE transfer_id = ?
+            ''', (transfer_id,))
+            
+            row = cursor.fetchone()
+            
+            return dict(row) if row else None
+    
+    def get_pending_transfers(self, direction, peer=None):
+        """
+        Récupère les transferts interrompus (statut 'partial')
+        
+        Args:
+            direction: 'received' ou 'sent'
+            peer: filtre sur le pair distant (None: tous)
+        
+        Returns:
+            Liste de dictionnaires (transferts), du plus ancien au plus récent
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT * FROM file_transfers
+                WHERE status = 'partial' AND direction = ?
+                AND (? IS NULL OR peer = ?)
+                ORDER BY created_at ASC
+            ''', (direction, peer, peer))
+            
             rows = cursor.fetchall()
-            conn.close()
             
             return [dict(row) for row in rows]
     
+    def save_transfer_chunks(self, transfer_id, chunks):
+        """
+        Enregistre des morceaux écrits sur disque
+        
+        Args:
+            transfer_id: identifiant du transfert
+            chunks: liste de tuples (offset, longueur, crc32)
+        """
+        with self._write() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO transfer_chunks
+                (transfer_id, chunk_offset, length, crc32)
+                VALUES (?, ?, ?, ?)
+            ''', [(transfer_id, offset, length, crc) for offset, length, crc in chunks])
+            cursor.execute('''
+                UPDATE file_transfers
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE transfer_id = ?
+            ''', (transfer_id,))
+    
+    def get_transfer_chunks(self, transfer_id):
+        """
+        Récupère les morceaux enregistrés d'un transfert
+        
+        Args:
+            transfer_id: identifiant du transfert
+        
+        Returns:
+            Liste de tuples (offset, longueur, crc32) triés par offset
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT chunk_offset, length, crc32
+                FROM transfer_chunks
+                WHERE transfer_id = ?
+                ORDER BY chunk_offset ASC
+            ''', (transfer_id,))
+            
+            rows = cursor.fetchall()
+            
+            return [tuple(row) for row in rows]
+    
+    def finish_transfer(self, transfer_id, status):
+        """
+        Clôt un transfert ; ses morceaux ne sont plus utiles
+        
+        Args:
+            transfer_id: identifiant du transfert
+            status: 'complete' ou 'failed'
+        """
+        with self._write() as cursor:
+            cursor.execute('''
+                UPDATE file_transfers
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE transfer_id = ?
+            ''', (status, transfer_id))
+            cursor.execute('''
+                DELETE FROM transfer_chunks WHERE transfer_id = ?
+            ''', (transfer_id,))
+    
     def update_client_history(self, client_id, username, address):
         """
         Crée ou met à jour l'historique d'un client
@@ -232,10 +1253,7 @@ class Database:
             username: nom d'utilisateur
             address: adresse IP:port
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._write() as cursor:
             cursor.execute('''
                 SELECT id FROM client_history WHERE client_id = ?
             ''', (client_id,))
@@ -251,9 +1269,6 @@ class Database:
                     INSERT INTO client_history (client_id, username, address)
                     VALUES (?, ?, ?)
                 ''', (client_id, username, address))
-            
-            conn.commit()
-            conn.close()
     
     def get_client_history(self, client_id):
         """
@@ -265,16 +1280,12 @@ class Database:
         Returns:
             Dictionnaire avec infos du client ou None
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._read() as cursor:
             cursor.execute('''
                 SELECT * FROM client_history WHERE client_id = ?
             ''', (client_id,))
             
             row = cursor.fetchone()
-            conn.close()
             
             return dict(row) if row else None
     
@@ -285,48 +1296,30 @@ class Database:
         Returns:
             Liste de dictionnaires (clients)
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._read() as cursor:
             cursor.execute('''
                 SELECT * FROM client_history ORDER BY last_seen DESC
             ''')
             
             rows = cursor.fetchall()
-            conn.close()
             
             return [dict(row) for row in rows]
     
     def increment_message_count(self, client_id):
         """Incrémente le compteur de messages pour un client"""
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE client_history
-                SET message_count = message_count + 1
-                WHERE client_id = ?
-            ''', (client_id,))
-            
-            conn.commit()
-            conn.close()
+        self._execute('''
+            UPDATE client_history
+            SET message_count = message_count + 1
+            WHERE client_id = ?
+        ''', (client_id,))
     
     def increment_file_count(self, client_id):
         """Incrémente le compteur de fichiers pour un client"""
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE client_history
-                SET file_count = file_count + 1
-                WHERE client_id = ?
-            ''', (client_id,))
-            
-            conn.commit()
-            conn.close()
+        self._execute('''
+            UPDATE client_history
+            SET file_count = file_count + 1
+            WHERE client_id = ?
+        ''', (client_id,))
     
     def delete_old_messages(self, days=30):
         """
@@ -335,21 +1328,446 @@ class Database:
         Args:
             days: nombre de jours avant suppression
         """
-        with self.lock:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
+        with self._write() as cursor:
             cursor.execute('''
                 DELETE FROM messages
                 WHERE created_at < datetime('now', '-' || ? || ' days')
             ''', (days,))
             
             deleted = cursor.rowcount
-            conn.commit()
-            conn.close()
             
             return deleted
     
+    def archive_path(self, month):
+        """Fichier d'archive d'un mois ('AAAA-MM') : <archive_dir>/<nom de la base>-AAAA-MM.db"""
+        return self.archive_dir / f'{self.db_path.stem}-{month}.db'
+    
+    def archives(self):
+        """
+        Archives mensuelles de cette base, ouvertes en lecture seule
+        
+        Returns:
+            Liste de Database, de la plus récente à la plus ancienne
+        """
+        if self.archive_dir is None:
+            return []
+        # Le dossier n'est relu que s'il a changé (archive créée, ici ou par retention.py)
+        try:
+            mtime = self.archive_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._archives_lock:
+            if self._archive_paths is None or self._archive_paths[0] != mtime:
+                paths = sorted(self.archive_dir.glob(f'{self.db_path.stem}-????-??.db'), reverse=True)
+                self._archive_paths = (mtime, paths)
+            paths = self._archive_paths[1]
+            for path in paths:
+                if path not in self._archives:
+                    self._archives[path] = Database(path, readonly=True)
+            return [self._archives[path] for path in paths]
+    
+    def archive_batch(self, before, batch_size=ARCHIVE_BATCH):
+        """
+        Déplace vers l'archive de leur mois les plus anciens messages et
+        fichiers antérieurs à `before`, un mois et au plus `batch_size` lignes
+        par table à la fois
+        
+        La copie (INSERT OR IGNORE, ID conservés) et la suppression se font
+        dans une transaction sur la base et son archive attachée : un lot
+        interrompu est simplement recopié au passage suivant. Les blobs des
+        fichiers archivés restent référencés (table `blobs` inchangée).
+        
+        Args:
+            before: horodatage ISO ; les lignes plus anciennes sont archivées
+            batch_size: nombre maximal de lignes par table
+        
+        Returns:
+            Nombre de lignes déplacées (0 : plus rien à archiver)
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT MIN(timestamp) FROM messages WHERE timestamp < ?
+            ''', (before,))
+            oldest = [cursor.fetchone()[0]]
+            cursor.execute('''
+                SELECT MIN(timestamp) FROM files WHERE timestamp < ?
+            ''', (before,))
+            oldest.append(cursor.fetchone()[0])
+        oldest = [timestamp for timestamp in oldest if timestamp]
+        if not oldest:
+            return 0
+        
+        month = min(oldest)[:7]
+        year, number = int(month[:4]), int(month[5:7])
+        next_month = f'{year + number // 12:04d}-{number % 12 + 1:02d}'
+        end = min(before, next_month)
+        path = self.archive_path(month)
+        if not path.exists():
+            os.makedirs(self.archive_dir, exist_ok=True)
+            Database(path).close()  # schéma complet, index plein texte compris
+        
+        moved = 0
+        self._flush_pending()
+        with self.lock:
+            conn = self._get_connection()
+            try:
+                conn.execute('ATTACH DATABASE ? AS archive', (str(path),))
+                try:
+                    # Pagination des archives par (timestamp, id) (get_messages)
+                    conn.execute('''
+                        CREATE INDEX IF NOT EXISTS archive.idx_messages_client_timestamp
+                        ON messages(client_id, timestamp)
+                    ''')
+                    for table, columns in (('messages', MESSAGE_COLUMNS), ('files', FILE_COLUMNS)):
+                        ids = [row[0] for row in conn.execute(f'''
+                            SELECT id FROM main.{table}
+                            WHERE timestamp < ?
+                            ORDER BY timestamp
+                            LIMIT ?
+                        ''', (end, batch_size))]
+                        if not ids:
+                            continue
+                        placeholders = ','.join('?' * len(ids))
+                        conn.execute(f'''
+                            INSERT OR IGNORE INTO archive.{table} ({columns})
+                            SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})
+                        ''', ids)
+                        unread = []
+                        if table == 'messages':
+                            # Un message archivé non lu le reste : le trigger
+                            # messages_unread_delete ne doit pas le décompter
+                            unread = conn.execute(f'''
+                                SELECT COUNT(*), client_id FROM main.messages
+                                WHERE id IN ({placeholders}) AND type = 'received' AND read = 0
+                                GROUP BY client_id
+                            ''', ids).fetchall()
+                        conn.execute(f'''
+                            DELETE FROM main.{table} WHERE id IN ({placeholders})
+                        ''', ids)
+                        conn.executemany('''
+                            UPDATE client_history SET unread_count = unread_count + ? WHERE client_id = ?
+                        ''', unread)
+                        moved += len(ids)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute('DETACH DATABASE archive')
+            finally:
+                self._release(conn)
+        return moved
+    
+    def incremental_vacuum_enabled(self):
+        """True si la base est en auto_vacuum=INCREMENTAL (créée ou convertie)"""
+        with self._read() as cursor:
+            cursor.execute('PRAGMA auto_vacuum')
+            return cursor.fetchone()[0] == 2
+    
+    def enable_incremental_vacuum(self):
+        """
+        Passe une base créée avant la rétention en auto_vacuum=INCREMENTAL
+        (VACUUM complet, une seule fois : les nouvelles bases le sont déjà)
+        
+        Le VACUUM réécrit tout le fichier en tenant le verrou d'écriture :
+        à n'appeler que serveur arrêté (`retention.py ... --convert`).
+        
+        Returns:
+            True si la base vient d'être convertie
+        """
+        with self._write() as cursor:
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] == 2:
+                return False
+            cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            cursor.execute('VACUUM')
+            return True
+    
+    def incremental_vacuum(self, pages=VACUUM_PAGES):
+        """
+        Rend au système jusqu'à `pages` pages libres du fichier
+        
+        Returns:
+            Nombre de pages libres restantes
+        """
+        with self._write() as cursor:
+            # executescript : le pragma ne libère qu'une page par étape
+            cursor.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+            cursor.execute('PRAGMA freelist_count')
+            return cursor.fetchone()[0]
+    
+    def iter_rows(self, table, client_ids=None, batch_size=EXPORT_BATCH):
+        """
+        Parcourt une table par ID croissant, par lots (mémoire constante)
+        
+        Les messages et fichiers archivés viennent d'abord, des archives les
+        plus anciennes à la plus récente : les ID se suivent d'une base à l'autre.
+        Les diffusions ne sont jamais archivées ; `broadcast_recipients`
+        (WITHOUT ROWID) est parcourue dans l'ordre de sa clé primaire.
+        
+        Args:
+            table: 'client_history', 'messages', 'files', 'broadcasts' ou
+                'broadcast_recipients'
+            client_ids: ne parcourir que ces clients, ou les diffusions
+                qu'ils ont reçues (None: tous)
+            batch_size: lignes lues par requête
+        
+        Yields:
+            Dictionnaires (colonnes CLIENT_COLUMNS, MESSAGE_COLUMNS,
+            FILE_COLUMNS, BROADCAST_COLUMNS ou RECIPIENT_COLUMNS)
+        """
+        # L'ID de client_history ne sert que de curseur, il n'est pas exporté
+        columns = {'client_history': 'id, ' + CLIENT_COLUMNS, 'messages': MESSAGE_COLUMNS,
+                   'files': FILE_COLUMNS, 'broadcasts': BROADCAST_COLUMNS,
+                   'broadcast_recipients': RECIPIENT_COLUMNS}[table]
+        archived = table in ('messages', 'files')
+        sources = list(reversed(self.archives())) + [self] if archived else [self]
+        if table == 'broadcast_recipients':
+            key_columns = ('client_id', 'broadcast_id')
+        else:
+            key_columns = ('id',)
+        key = ', '.join(key_columns)
+        where = ''
+        params = []
+        if client_ids is not None:
+            client_ids = list(client_ids)
+            placeholders = ','.join('?' * len(client_ids))
+            if table == 'broadcasts':
+                where = f'''AND id IN (SELECT broadcast_id FROM broadcast_recipients
+                                       WHERE client_id IN ({placeholders}))'''
+            else:
+                where = f"AND client_id IN ({placeholders})"
+            params = client_ids
+        
+        # L'export doit contenir les écritures encore en file
+        self._flush_pending()
+        for source in sources:
+            last_key = [0] * len(key_columns)
+            while True:
+                with source._read() as cursor:
+                    cursor.execute(f'''
+                        SELECT {columns} FROM {table}
+                        WHERE ({key}) > ({','.join('?' * len(key_columns))}) {where}
+                        ORDER BY {key}
+                        LIMIT ?
+                    ''', last_key + params + [batch_size])
+                    rows = cursor.fetchall()
+                for row in rows:
+                    row = dict(row)
+                    last_key = [row[column] for column in key_columns]
+                    if table == 'client_history':
+                        del row['id']
+                    yield row
+                if len(rows) < batch_size:
+                    break
+    
+    def bulk_import(self, records, keep_ids=True, batch_size=IMPORT_BATCH, progress=None):
+        """
+        Charge des enregistrements au format d'export (export.iter_records,
+        NDJSON relu par importer.py) en une seule transaction
+        
+        Les index secondaires de `messages` / `files` et les triggers
+        d'insertion (FTS, non-lus) sont retirés pendant le chargement puis
+        recréés depuis leur définition dans sqlite_master ; l'index plein
+        texte est reconstruit et les compteurs de `client_history`
+        recalculés en une passe, archives comprises. En cas d'erreur, rien
+        n'est importé. Les écritures du chat attendent la fin de l'import.
+        
+        Args:
+            records: itérable de dictionnaires avec un champ `kind`
+                ('export', 'client', 'message', 'file', 'broadcast',
+                'broadcast_recipient')
+            keep_ids: garder les ID d'origine (INSERT OR IGNORE : un
+                enregistrement déjà présent est ignoré, un import rejoué ne
+                duplique rien) ; False pour en attribuer de nouveaux, les
+                destinataires suivant le nouvel ID de leur diffusion
+            batch_size: lignes par executemany
+            progress: appelé avec les compteurs (dict) après chaque lot
+        
+        Returns:
+            Dictionnaire {'clients', 'messages', 'files', 'broadcasts',
+            'recipients'}: lignes insérées
+        """
+        message_columns = MESSAGE_COLUMNS if keep_ids else MESSAGE_COLUMNS.replace('id, ', '', 1)
+        file_columns = FILE_COLUMNS if keep_ids else FILE_COLUMNS.replace('id, ', '', 1)
+        # L'ID d'origine d'une diffusion est toujours lu : il relie les destinataires
+        broadcast_columns = BROADCAST_COLUMNS if keep_ids else BROADCAST_COLUMNS.replace('id, ', '', 1)
+        statements = {
+            'client': (CLIENT_COLUMNS, f'''
+                INSERT INTO client_history ({CLIENT_COLUMNS})
+                VALUES ({','.join('?' * len(CLIENT_COLUMNS.split(',')))})
+                ON CONFLICT(client_id) DO NOTHING
+            '''),
+            'message': (message_columns, f'''
+                INSERT OR IGNORE INTO messages ({message_columns})
+                VALUES ({','.join('?' * len(message_columns.split(',')))})
+            '''),
+            'file': (file_columns, f'''
+                INSERT OR IGNORE INTO files ({file_columns})
+                VALUES ({','.join('?' * len(file_columns.split(',')))})
+            '''),
+            'broadcast': (BROADCAST_COLUMNS, f'''
+                INSERT OR IGNORE INTO broadcasts ({broadcast_columns})
+                VALUES ({','.join('?' * len(broadcast_columns.split(',')))})
+            '''),
+            'broadcast_recipient': (RECIPIENT_COLUMNS, f'''
+                INSERT OR IGNORE INTO broadcast_recipients ({RECIPIENT_COLUMNS})
+                VALUES (?, ?)
+            '''),
+        }
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        defaults = {'read': 0, 'message_count': 0, 'file_count': 0, 'unread_count': 0,
+                    'created_at': now, 'first_seen': now}
+        counts = {'clients': 0, 'messages': 0, 'files': 0, 'broadcasts': 0, 'recipients': 0}
+        tables = {'client': 'clients', 'message': 'messages', 'file': 'files',
+                  'broadcast': 'broadcasts', 'broadcast_recipient': 'recipients'}
+        # keep_ids=False : ID d'origine -> ID attribué de chaque diffusion insérée
+        broadcast_ids = {}
+        
+        self._flush_pending()
+        with self.lock:
+            conn = self._get_connection()
+            # Cache de pages agrandi le temps de l'import : la recréation des
+            # index trie en mémoire plutôt que dans des fichiers temporaires
+            cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+            conn.execute(f'PRAGMA cache_size=-{IMPORT_CACHE_KIB}')
+            try:
+                cursor = conn.cursor()
+                # Transaction explicite : sqlite3 n'en ouvre pas avant un DROP
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    SELECT type, name, sql FROM sqlite_master
+                    WHERE tbl_name IN ('messages', 'files') AND sql IS NOT NULL
+                    AND (type = 'index' OR (type = 'trigger' AND sql LIKE '% AFTER INSERT %'))
+                ''')
+                deferred = cursor.fetchall()
+                for kind, name, _sql in deferred:
+                    cursor.execute(f'DROP {kind.upper()} {name}')
+                cursor.execute('SELECT sha256 FROM blobs')
+                known_blobs = {row[0] for row in cursor.fetchall()}
+                
+                def flush(kind, rows):
+                    if kind in ('file', 'broadcast'):
+                        # Une ligne à la fois : seuls les fichiers réellement insérés
+                        # comptent une référence de plus sur leur blob
+                        for row in rows:
+                            if kind == 'broadcast' and not keep_ids:
+                                cursor.execute(statements[kind][1], row[1:])
+                                if cursor.rowcount == 1:
+                                    broadcast_ids[row[0]] = cursor.lastrowid
+                            else:
+                                cursor.execute(statements[kind][1], row)
+                            blob = row[-1]
+                            if cursor.rowcount == 1 and blob:
+                                cursor.execute('''
+                                    UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?
+                                ''', (blob,))
+                            counts[tables[kind]] += cursor.rowcount
+                    elif kind == 'broadcast_recipient' and not keep_ids:
+                        # Les diffusions en attente d'abord : leurs nouveaux ID doivent être connus
+                        if pending['broadcast']:
+                            flush('broadcast', pending['broadcast'])
+                            pending['broadcast'] = []
+                        rows = [(client_id, broadcast_ids[broadcast_id])
+                                for client_id, broadcast_id in rows if broadcast_id in broadcast_ids]
+                        cursor.executemany(statements[kind][1], rows)
+                        counts[tables[kind]] += cursor.rowcount
+                    else:
+                        cursor.executemany(statements[kind][1], rows)
+                        counts[tables[kind]] += cursor.rowcount
+                    if progress is not None:
+                        progress(dict(counts))
+                
+                pending = {'client': [], 'message': [], 'file': [], 'broadcast': [], 'broadcast_recipient': []}
+                columns = {kind: [column.strip() for column in statement[0].split(',')]
+                           for kind, statement in statements.items()}
+                getters = {kind: operator.itemgetter(*names) for kind, names in columns.items()}
+                for record in records:
+                    kind = record.get('kind')
+                    if kind == 'export':
+                        if record.get('version') != 1:
+                            raise ValueError(f"Version d'export non prise en charge: {record.get('version')}")
+                        continue
+                    if kind not in pending:
+                        raise ValueError(f"Enregistrement inconnu: {kind!r}")
+                    if kind in ('file', 'broadcast') and record.get('blob') not in known_blobs:
+                        # Blob absent de cette base : le fichier n'y est pas stocké
+                        record = dict(record, blob=None)
+                    try:
+                        row = getters[kind](record)
+                    except KeyError:
+                        # Colonne absente (export partiel, données de test) : valeur par défaut
+                        row = tuple(record.get(column, defaults.get(column)) for column in columns[kind])
+                    pending[kind].append(row)
+                    if len(pending[kind]) >= batch_size:
+                        flush(kind, pending[kind])
+                        pending[kind] = []
+                for kind, rows in pending.items():
+                    if rows:
+                        flush(kind, rows)
+                        pending[kind] = []
+                
+                for _kind, _name, sql in deferred:
+                    cursor.execute(sql)
+                if self.has_fts:
+                    cursor.execute('''
+                        INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')
+                    ''')
+                self._recount_clients(cursor)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(f'PRAGMA cache_size={cache_size}')
+                self._release(conn)
+        if self._writer is not None:
+            # Les ID importés ne doivent pas recouvrir ceux réservés ensuite
+            last_id = self._last_message_id()
+            with self._enqueue_lock:
+                self._next_message_id = max(self._next_message_id, last_id + 1)
+        return counts
+    
+    def _recount_clients(self, cursor):
+        """
+        Recalcule message_count, file_count et unread_count de tous les
+        clients, en une passe par table (archives et diffusions comprises)
+        """
+        totals = {}
+        for source in self.archives():
+            with source._read() as archive:
+                for table, column, where in (('messages', 'message_count', ''),
+                                             ('files', 'file_count', ''),
+                                             ('messages', 'unread_count', "WHERE type = 'received' AND read = 0")):
+                    archive.execute(f'SELECT client_id, COUNT(*) FROM {table} {where} GROUP BY client_id')
+                    for client_id, count in archive.fetchall():
+                        totals[(client_id, column)] = totals.get((client_id, column), 0) + count
+        # Diffusions (jamais archivées) : un message ou un fichier par destinataire
+        cursor.execute('''
+            SELECT r.client_id, b.filename IS NOT NULL, COUNT(*)
+            FROM broadcast_recipients r JOIN broadcasts b ON b.id = r.broadcast_id
+            GROUP BY r.client_id, b.filename IS NOT NULL
+        ''')
+        for client_id, is_file, count in cursor.fetchall():
+            column = 'file_count' if is_file else 'message_count'
+            totals[(client_id, column)] = totals.get((client_id, column), 0) + count
+        cursor.execute('''
+            UPDATE client_history SET message_count = 0, file_count = 0, unread_count = 0
+        ''')
+        for table, column, where in (('messages', 'message_count', ''),
+                                     ('files', 'file_count', ''),
+                                     ('messages', 'unread_count', "WHERE type = 'received' AND read = 0")):
+            cursor.execute(f'SELECT client_id, COUNT(*) FROM {table} {where} GROUP BY client_id')
+            live = cursor.fetchall()
+            cursor.executemany(f'''
+                UPDATE client_history SET {column} = ? WHERE client_id = ?
+            ''', [(count + totals.pop((client_id, column), 0), client_id) for client_id, count in live])
+        # Clients dont tout l'historique est archivé
+        for (client_id, column), count in totals.items():
+            cursor.execute(f'''
+                UPDATE client_history SET {column} = ? WHERE client_id = ?
+            ''', (count, client_id))
+    
     def export_to_json(self, client_id, output_path):
         """
         Exporte les messages et fichiers d'un client en JSON
@@ -358,22 +1776,39 @@ class Database:
             client_id: ID du client
             output_path: chemin du fichier JSON de sortie
         """
-        with self.lock:
-            messages = self.get_messages(client_id)
-            files = self.get_files(client_id)
-            client_history = self.get_client_history(client_id)
-            
-            export_data = {
-                'client': client_history,
-                'messages': messages,
-                'files': files
-            }
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
-            
-            return output_path
+        # Écrit au fil de la lecture (iter_rows) : le client n'est jamais
+        # chargé en entier en mémoire ; export.py exporte tous les clients
+        client_history = self.get_client_history(client_id)
+        
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write('{\n  "client": ')
+            f.write(json.dumps(client_history, ensure_ascii=False))
+            for key, table in (('messages', 'messages'), ('files', 'files')):
+                f.write(f',\n  "{key}": [')
+                separator = '\n    '
+                for row in self.iter_rows(table, [client_id]):
+                    f.write(separator + json.dumps(row, ensure_ascii=False))
+                    separator = ',\n    '
+                f.write('\n  ]')
+            f.write('\n}\n')
+        
+        return output_path
     
     def close(self):
-        """Ferme la connexion à la base de données"""
-        pass  # Les connexions sont fermeées après chaque opération
+        """Valide les écritures différées, arrête le thread écrivain et ferme le pool et les archives"""
+        writer = self._writer
+        if writer is not None and threading.current_thread() is not writer:
+            with self._enqueue_lock:
+                self._writer = None
+                self._queue.put(None)
+            writer.join()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._archives_lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives.clear()
+            self._archive_paths = None
@@ -0,0 +1,161 @@
+"""
+Regroupement des événements Socket.IO envoyés à l'UI web
+
+Pendant une rafale (journal collé, bot), chaque ligne reçue en TCP produisait
+son propre événement et le navigateur se figeait. EmitCoalescer garde les
+événements pendant une courte fenêtre, commune à toutes les cibles
+(diffusion, sid, room), puis les envoie tous ensemble, dans l'ordre
+d'émission : chaque suite d'événements consécutifs vers une même cible part
+en un seul événement `messages_batch` :
+
+    {'events': [[nom, données], ...]}   (dans l'ordre d'émission)
+
+Un onglet présent dans plusieurs rooms (`presence` et une conversation)
+reçoit donc les événements d'un même client dans l'ordre où ils ont été
+émis. Sous faible charge, un événement isolé part tout de suite sous son nom
+habituel. Une mise à jour de présence (statut, avatar, nom) remplacée dans
+la fenêtre n'est envoyée qu'une fois, avec sa dernière valeur.
+
+Seul le thread `ui-emit` appelle socketio.emit, hors du verrou : un emit
+lent ne bloque pas les threads de réception TCP, qui n'attendent que si la
+file dépasse EMIT_QUEUE_MAX événements.
+"""
+
+import threading
+import time
+
+import metrics
+
+# Fenêtre de regroupement (secondes) : une image à 60 Hz
+EMIT_WINDOW = 0.016
+
+# Taille maximale d'un lot : plein, il part sans attendre la fin de la fenêtre
+EMIT_BATCH_MAX = 500
+
+# Événements en file au-delà desquels l'émetteur attend le thread `ui-emit`
+EMIT_QUEUE_MAX = 4 * EMIT_BATCH_MAX
+
+BATCH_EVENT = 'messages_batch'
+
+
+class EmitCoalescer:
+    """Regroupe les emits d'une instance SocketIO dans une fenêtre de temps commune à toutes les cibles"""
+
+    def __init__(self, socketio, window=EMIT_WINDOW, batch_max=EMIT_BATCH_MAX, queue_max=EMIT_QUEUE_MAX):
+        """
+        Args:
+            socketio: instance flask_socketio.SocketIO
+            window: fenêtre de regroupement en secondes
+            batch_max: nombre d'événements qui déclenche l'envoi immédiat (et
+                taille maximale d'un lot)
+            queue_max: événements en file au-delà desquels emit() attend
+        """
+        self.socketio = socketio
+        self.window = window
+        self.batch_max = batch_max
+        self.queue_max = queue_max
+        # Protège la file ; jamais tenu pendant socketio.emit
+        self.lock = threading.Condition()
+        # [cible, nom, données, instant de réception TCP] dans l'ordre d'émission,
+        # None pour une mise à jour remplacée
+        self._events = []
+        # (cible, clé) -> index dans self._events
+        self._keys = {}
+        self._count = 0
+        self._deadline = None
+        self._last_sent = float('-inf')
+        self._flusher = None
+
+    def emit(self, event, data, to=None, key=None, received_at=None):
+        """
+        Émet un événement, tout de suite ou à la fin de la fenêtre en cours
+
+        Args:
+            event: nom de l'événement
+            data: données (dictionnaire sérialisable en JSON)
+            to: sid ou room destinataire (None: toutes les UI)
+            key: clé d'une mise à jour qui remplace la précédente de même
+                clé et même cible encore en attente (ex. ('client_status_changed', client_id))
+            received_at: instant (time.monotonic) de la réception TCP à
+                l'origine de l'événement, pour la métrique lnm_recv_to_emit_seconds
+        """
+        with self.lock:
+            while self._count >= self.queue_max:
+                # Le thread `ui-emit` ne suit plus : l'émetteur ralentit d'autant
+                self.lock.wait()
+            now = time.monotonic()
+            if not self._count:
+                # Au calme : envoi immédiat ; sinon à la fin de la fenêtre ouverte par le dernier envoi
+                self._deadline = max(now, self._last_sent + self.window)
+            if key is not None:
+                previous = self._keys.get((to, key))
+                if previous is not None:
+                    self._events[previous] = None
+                    self._count -= 1
+                self._keys[(to, key)] = len(self._events)
+            self._events.append([to, event, data, received_at])
+            self._count += 1
+            if self._count >= self.batch_max:
+                self._deadline = now
+            self._start_flusher()
+            self.lock.notify_all()
+
+    def pending_count(self):
+        """Nombre d'événements en attente de regroupement (supervision)"""
+        with self.lock:
+            return self._count
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='ui-emit', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while True:
+                    if not self._count:
+                        self.lock.wait()
+                        continue
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                events = self._events
+                self._events, self._keys, self._count = [], {}, 0
+                self._last_sent = time.monotonic()
+                self.lock.notify_all()
+            try:
+                self._send(events)
+            except Exception as e:
+                print(f"[ERREUR] Envoi d'un lot d'événements à l'UI: {e}")
+
+    def _send(self, events):
+        """Envoie les événements dans l'ordre : un lot par suite consécutive vers une même cible"""
+        run = []
+        for entry in events:
+            if entry is None:
+                continue
+            if run and (entry[0] != run[0][0] or len(run) >= self.batch_max):
+                self._send_run(run)
+                run = []
+            run.append(entry)
+        if run:
+            self._send_run(run)
+
+    def _send_run(self, run):
+        to = run[0][0]
+        received = [entry[3] for entry in run if entry[3]]
+        if len(run) == 1:
+            self._emit(run[0][1], run[0][2], to, received)
+        else:
+            self._emit(BATCH_EVENT, {'events': [[entry[1], entry[2]] for entry in run]}, to, received)
+
+    def _emit(self, event, data, to, received):
+        """socketio.emit, avec la durée de l'emit et le délai depuis chaque réception TCP"""
+        start = time.monotonic()
+        self.socketio.emit(event, data, to=to)
+        end = time.monotonic()
+        metrics.EMIT_SECONDS.observe(end - start)
+        for received_at in received:
+            metrics.RECV_TO_EMIT_SECONDS.observe(end - received_at)
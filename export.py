@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Export de l'historique pour LocalNetMessage
+
+Format NDJSON : un objet JSON par ligne, le champ `kind` donne sa nature.
+- {"kind": "export", "version": 1, "exported_at": ..., "clients": [...] | null}
+- {"kind": "client", colonnes de client_history}
+- {"kind": "message", colonnes de messages}
+- {"kind": "file", colonnes de files}
+- {"kind": "broadcast", colonnes de broadcasts}
+- {"kind": "broadcast_recipient", "client_id": ..., "broadcast_id": ...}
+Les clients viennent d'abord, puis les messages et les fichiers par ID
+croissant (archives comprises), enfin les diffusions et leurs destinataires.
+
+Le flux est produit ligne à ligne à partir de Database.iter_rows : la mémoire
+utilisée ne dépend pas de la taille de l'historique. Compression gzip
+(bibliothèque standard) ou zstd (paquet `zstandard`, optionnel).
+
+Usage :
+    python export.py <base.db> <sortie> [--client ID ...] [--archives DOSSIER]
+                     [--compression none|gzip|zstd]
+La compression se déduit de l'extension de la sortie (.gz, .zst) ; « - »
+écrit sur la sortie standard.
+"""
+
+import argparse
+import json
+import sys
+import zlib
+from datetime import datetime
+
+from database import Database
+
+EXPORT_VERSION = 1
+
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+# Lignes regroupées avant compression et écriture (taille visée, en octets)
+CHUNK_SIZE = 64 * 1024
+
+# Extension et type MIME de chaque format de sortie
+EXTENSIONS = {'none': '.ndjson', 'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+MIMETYPES = {'none': 'application/x-ndjson', 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+
+def _compressor(compression):
+    """Objet compress()/flush() pour `compression`, None sans compression"""
+    if compression == 'none':
+        return None
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 : en-tête gzip
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Compression zstd indisponible (pip install zstandard)")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Compression inconnue: {compression}")
+
+
+def iter_records(db, client_ids=None):
+    """
+    Enregistrements de l'export, dans l'ordre du fichier
+
+    Args:
+        db: Database (avec archive_dir pour inclure les archives)
+        client_ids: clients à exporter (None: tous)
+
+    Yields:
+        Dictionnaires avec un champ `kind`
+    """
+    yield {'kind': 'export', 'version': EXPORT_VERSION, 'exported_at': datetime.now().isoformat(),
+           'clients': sorted(client_ids) if client_ids is not None else None}
+    for kind, table in (('client', 'client_history'), ('message', 'messages'), ('file', 'files'),
+                        ('broadcast', 'broadcasts'), ('broadcast_recipient', 'broadcast_recipients')):
+        for row in db.iter_rows(table, client_ids):
+            yield {'kind': kind, **row}
+
+
+def iter_export(db, client_ids=None, compression='none'):
+    """
+    Export NDJSON en morceaux d'octets, compressés au fil de l'eau
+
+    La compression est vérifiée avant le premier morceau : une erreur
+    (RuntimeError, ValueError) est levée à l'appel, pas au milieu du flux.
+
+    Args:
+        db: Database
+        client_ids: clients à exporter (None: tous)
+        compression: 'none', 'gzip' ou 'zstd'
+
+    Returns:
+        Générateur de bytes
+    """
+    compressor = _compressor(compression)
+
+    def chunks():
+        lines = []
+        size = 0
+        for record in iter_records(db, client_ids):
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            lines.append(line)
+            size += len(line)
+            if size >= CHUNK_SIZE:
+                data = b''.join(lines)
+                lines, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+        data = b''.join(lines)
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+
+    return chunks()
+
+
+def export_ndjson(db, output, client_ids=None, compression='none'):
+    """
+    Écrit l'export dans un fichier
+
+    Args:
+        db: Database
+        output: chemin du fichier, ou objet fichier binaire
+        client_ids: clients à exporter (None: tous)
+        compression: 'none', 'gzip' ou 'zstd'
+
+    Returns:
+        Nombre d'octets écrits
+    """
+    chunks = iter_export(db, client_ids, compression)
+    written = 0
+    if hasattr(output, 'write'):
+        for data in chunks:
+            written += output.write(data)
+        return written
+    with open(output, 'wb') as f:
+        for data in chunks:
+            written += f.write(data)
+    return written
+
+
+def guess_compression(path):
+    """Compression d'après l'extension ('none' pour un chemin inconnu ou « - »)"""
+    path = str(path)
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return 'none'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export NDJSON de l'historique LocalNetMessage")
+    parser.add_argument('database', help='fichier SQLite (messages.db, client_messages.db)')
+    parser.add_argument('output', help='fichier de sortie, « - » pour la sortie standard')
+    parser.add_argument('--client', type=int, action='append', dest='clients',
+                        help='ID de client à exporter (répétable ; défaut: tous)')
+    parser.add_argument('--archives', help='dossier des archives mensuelles à inclure')
+    parser.add_argument('--compression', choices=COMPRESSIONS,
+                        help="défaut: d'après l'extension de la sortie")
+    args = parser.parse_args(argv)
+
+    compression = args.compression or guess_compression(args.output)
+    db = Database(args.database, archive_dir=args.archives, readonly=True)
+    try:
+        if args.output == '-':
+            written = export_ndjson(db, sys.stdout.buffer, args.clients, compression)
+        else:
+            written = export_ndjson(db, args.output, args.clients, compression)
+            print(f"[INFO] Export: {written} octets écrits dans {args.output} ({compression})")
+    except RuntimeError as e:
+        print(f"[ERREUR] {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Service HTTP des fichiers échangés (routes /blobs, /avatars, /files/server et /files/client)
+
+- ETag fort = SHA-256 du contenu : nom du blob (/blobs), ou hash enregistré
+  dans la table `files` pour les anciens fichiers (/files, calculé puis
+  mémorisé au premier téléchargement s'il manque)
+- If-None-Match -> 304, requêtes Range -> 206 (lecture/déplacement dans
+  les vidéos et l'audio)
+- URL contenant le hash (`/blobs/<sha256>/...`, ou `?v=<début du sha256>`
+  sur /files) : cache navigateur d'un an, sans revalidation ; sans `v` le
+  navigateur revalide à chaque ouverture (304)
+- Envoi sans copie en Python : SendfileMiddleware fournit au serveur de
+  développement Werkzeug (socketio.run) un `wsgi.file_wrapper` qui appelle
+  socket.sendfile ; un serveur qui a son propre wrapper (gunicorn) le garde,
+  et LNM_X_SENDFILE=1 délègue l'envoi à un proxy (X-Sendfile)
+"""
+
+import os
+from urllib.parse import quote
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+import transfer
+
+# Durée de cache d'une URL versionnée (contenu immuable)
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Longueur du préfixe de hash placé dans les URL versionnées
+VERSION_LENGTH = 16
+
+
+class SocketFileWrapper:
+    """
+    wsgi.file_wrapper pour le serveur Werkzeug : le premier élément vide fait
+    envoyer les en-têtes, puis le fichier part du cache disque vers le socket
+    via socket.sendfile (os.sendfile quand la plateforme le permet)
+    """
+
+    def __init__(self, file, sock):
+        self.file = file
+        self.sock = sock
+
+    def __iter__(self):
+        yield b''
+        self.sock.sendfile(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+class SendfileMiddleware:
+    """Installe SocketFileWrapper pour les réponses fichier complètes (hors Range)"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        sock = environ.get('werkzeug.socket')
+        if sock is not None and 'wsgi.file_wrapper' not in environ and 'HTTP_RANGE' not in environ:
+            environ['wsgi.file_wrapper'] = lambda file, block_size=8192: SocketFileWrapper(file, sock)
+        return self.wsgi_app(environ, start_response)
+
+
+def blob_url(sha256, filename):
+    """URL de téléchargement d'un blob, sous le nom de fichier d'origine"""
+    return f"/blobs/{sha256}/{quote(filename)}"
+
+
+def stored_file_hash(db, path):
+    """SHA-256 d'un fichier stocké : lu dans SQLite, sinon calculé et enregistré"""
+    sha256 = db.get_file_hash(path, os.path.getsize(path))
+    if sha256 is None:
+        sha256 = transfer.file_sha256(path)
+        db.set_file_hash(path, sha256)
+    return sha256
+
+
+def send_stored_file(db, root, subpath):
+    """
+    Réponse HTTP pour un fichier échangé, avec ETag, 304 et Range
+
+    Args:
+        db: Database contenant la table `files`
+        root: dossier servi
+        subpath: chemin demandé, relatif à `root`
+
+    Returns:
+        Réponse Flask (200, 206, 304 ou 416) ; 404 si le fichier n'existe pas
+    """
+    path = safe_join(root, subpath)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    sha256 = stored_file_hash(db, path)
+    version = request.args.get('v')
+    immutable = bool(version) and len(version) >= VERSION_LENGTH and sha256.startswith(version)
+    return _send(path, os.path.basename(path), sha256, immutable)
+
+
+def send_blob(store, sha256, filename):
+    """
+    Réponse HTTP pour un blob, nommé `filename` au téléchargement
+
+    Le contenu d'un blob ne change jamais : la réponse est toujours
+    cachable un an sans revalidation.
+
+    Args:
+        store: BlobStore
+        sha256: hash du blob (segment d'URL)
+        filename: nom proposé au navigateur
+
+    Returns:
+        Réponse Flask (200, 206, 304 ou 416) ; 404 si le blob n'existe pas
+    """
+    try:
+        path = store.path(sha256)
+    except ValueError:
+        abort(404)
+    if not path.is_file():
+        abort(404)
+    return _send(path, os.path.basename(filename), sha256, immutable=True)
+
+
+def send_avatar(store, sha256):
+    """
+    Réponse HTTP pour un avatar (avatars.AvatarStore), affiché dans la page
+
+    Returns:
+        Réponse Flask, cachable un an sans revalidation ; 404 si l'avatar
+        n'existe pas
+    """
+    found = store.path(sha256)
+    if found is None:
+        abort(404)
+    path, mimetype = found
+    response = send_file(path, mimetype=mimetype, etag=sha256, conditional=True, max_age=CACHE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _send(path, download_name, sha256, immutable):
+    response = send_file(
+        path,
+        as_attachment=not request.args.get('inline'),
+        download_name=download_name,
+        etag=sha256,
+        conditional=True,
+        max_age=CACHE_MAX_AGE if immutable else 0,
+    )
+    # Fichiers échangés : cache du navigateur uniquement, pas des proxys partagés
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
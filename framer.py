@@ -0,0 +1,85 @@
+"""
+Découpage incrémental du flux TCP en lignes pour LocalNetMessage
+Travaille sur un bytearray : seuls les octets nouvellement reçus sont parcourus
+et seules les lignes complètes sont décodées (pas de perte sur un caractère
+UTF-8 coupé entre deux recv)
+"""
+
+MIN_RECV_SIZE = 4096
+MAX_RECV_SIZE = 256 * 1024
+
+
+def split_handshake(data):
+    """
+    Sépare le nom d'utilisateur initial du reste des octets reçus
+
+    Les anciens pairs (client.py) envoient le nom sans '\\n' : dans ce cas
+    tout le premier bloc est le nom, comme auparavant.
+
+    Args:
+        data: premier bloc d'octets reçu
+
+    Returns:
+        Tuple (nom décodé et nettoyé, octets restants)
+    """
+    pos = data.find(b'\n')
+    if pos == -1:
+        return data.decode('utf-8', 'replace').strip(), b''
+    return data[:pos].decode('utf-8', 'replace').strip(), data[pos + 1:]
+
+
+class LineFramer:
+    """Accumule les octets reçus et restitue les lignes complètes décodées"""
+
+    def __init__(self, min_recv=MIN_RECV_SIZE, max_recv=MAX_RECV_SIZE):
+        """
+        Args:
+            min_recv: taille de recv minimale (octets)
+            max_recv: taille de recv maximale lorsque de grosses lignes arrivent
+        """
+        self.buffer = bytearray()
+        self.min_recv = min_recv
+        self.max_recv = max_recv
+        self.recv_size = min_recv
+        self._scanned = 0
+
+    def feed(self, data):
+        """
+        Ajoute des octets et retourne les lignes complètes
+
+        Args:
+            data: octets reçus (bytes, bytearray ou memoryview)
+
+        Returns:
+            Liste de lignes (str, sans le '\\n')
+        """
+        buffer = self.buffer
+        buffer += data
+
+        # Seuls les octets ajoutés depuis le dernier appel sont parcourus
+        last = buffer.rfind(b'\n', self._scanned)
+        if last == -1:
+            self._scanned = len(buffer)
+            self._adapt(len(data))
+            return []
+
+        # Le bloc se termine sur un délimiteur : il ne contient que des
+        # caractères complets et peut être décodé puis découpé en une fois
+        with memoryview(buffer) as view:
+            lines = str(view[:last], 'utf-8', 'replace').split('\n')
+        # La suppression en tête d'un bytearray est amortie O(1) en CPython
+        del buffer[:last + 1]
+        self._scanned = len(buffer)
+        self._adapt(len(data))
+        return lines
+
+    def pending(self):
+        """Nombre d'octets en attente d'un délimiteur"""
+        return len(self.buffer)
+
+    def _adapt(self, received):
+        """Ajuste la taille de recv : double si le recv est plein, réduit au repos"""
+        if received >= self.recv_size:
+            self.recv_size = min(self.recv_size * 2, self.max_recv)
+        elif received < self.recv_size // 4 and not self.buffer:
+            self.recv_size = max(self.recv_size // 2, self.min_recv)
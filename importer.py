@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Import en masse de l'historique pour LocalNetMessage
+
+Relit un export NDJSON (export.py), compressé ou non, et le charge avec
+Database.bulk_import : executemany par lots, une seule transaction, index et
+triggers recréés à la fin, compteurs des clients recalculés. Sert à migrer
+l'historique d'une machine à l'autre ou à remplir une base de test.
+
+Usage :
+    python importer.py <base.db> <export.ndjson[.gz|.zst]> [--new-ids]
+« - » lit l'entrée standard. Avec --new-ids, les messages et fichiers
+reçoivent de nouveaux ID (fusion dans une base qui a déjà un historique).
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import time
+
+from database import Database
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# json.loads détecte l'encodage et choisit un décodeur à chaque appel
+_decode = json.JSONDecoder().decode
+
+
+def open_export(raw):
+    """
+    Décompresse un export d'après son en-tête (gzip, zstd ou texte brut)
+
+    Args:
+        raw: objet fichier binaire
+
+    Returns:
+        Objet fichier binaire lisible ligne par ligne
+    """
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw)
+    magic = raw.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw)
+    if magic == ZSTD_MAGIC:
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Décompression zstd indisponible (pip install zstandard)")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+    return raw
+
+
+def iter_ndjson(stream):
+    """
+    Enregistrements d'un export NDJSON (lignes vides ignorées)
+
+    Raises:
+        ValueError: ligne qui n'est pas un objet JSON (numéro de ligne inclus)
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = _decode(line.decode('utf-8'))
+        except ValueError as e:
+            raise ValueError(f"Ligne {number}: JSON invalide ({e})")
+        if not isinstance(record, dict):
+            raise ValueError(f"Ligne {number}: objet JSON attendu")
+        yield record
+
+
+def import_ndjson(db, source, keep_ids=True, progress=None):
+    """
+    Charge un export NDJSON dans une base
+
+    Args:
+        db: Database de destination
+        source: chemin du fichier, ou objet fichier binaire
+        keep_ids: garder les ID d'origine (voir Database.bulk_import)
+        progress: appelé avec les compteurs après chaque lot
+
+    Returns:
+        Dictionnaire {'clients', 'messages', 'files', 'broadcasts', 'recipients'}:
+        lignes insérées
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return import_ndjson(db, f, keep_ids, progress)
+    return db.bulk_import(iter_ndjson(open_export(source)), keep_ids=keep_ids, progress=progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import d'un export NDJSON LocalNetMessage")
+    parser.add_argument('database', help='fichier SQLite de destination (créé au besoin)')
+    parser.add_argument('input', help='export NDJSON (gzip/zstd détectés), « - » pour l\'entrée standard')
+    parser.add_argument('--new-ids', action='store_true',
+                        help='attribuer de nouveaux ID aux messages et fichiers')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    def report(counts):
+        rows = sum(counts.values())
+        elapsed = time.perf_counter() - start
+        print(f"[INFO] Import: {rows} lignes ({rows / elapsed:.0f} lignes/s)", flush=True)
+
+    db = Database(args.database)
+    try:
+        source = sys.stdin.buffer if args.input == '-' else args.input
+        counts = import_ndjson(db, source, keep_ids=not args.new_ids, progress=report)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"[ERREUR] Import annulé: {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"[INFO] Import terminé en {time.perf_counter() - start:.1f} s: {counts['clients']} clients, "
+          f"{counts['messages']} messages, {counts['files']} fichiers, {counts['broadcasts']} diffusions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Métriques de LocalNetMessage au format texte Prometheus (route /metrics de server_web)
+
+Registre minimal sans dépendance : compteurs, jauges et histogrammes à
+intervalles fixes. Sur le chemin chaud, un incrément ou une observation ne
+coûte qu'un verrou et une addition ; le texte n'est produit qu'à la lecture
+de /metrics. Les débits (trames/s, octets/s) se calculent côté Prometheus
+avec rate() sur les compteurs `_total`.
+
+Les métriques sont définies ici, au niveau du module : connection.py,
+transfer.py, database.py et emitter.py les alimentent, quel que soit le
+programme (server_web ou client_web) qui les utilise.
+"""
+
+import bisect
+import threading
+import time
+
+# Intervalles des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Valeur qui ne fait que croître (événements, octets)"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+
+class Gauge:
+    """Valeur instantanée : tenue à jour (inc/dec) ou lue à la demande (fonction)"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None):
+        """
+        Args:
+            name: nom Prometheus
+            help_text: description
+            function: appelée à chaque lecture de /metrics pour obtenir la valeur
+        """
+        self.name = name
+        self.help = help_text
+        self.function = function
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def set_function(self, function):
+        self.function = function
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def samples(self):
+        return [(self.name, self.function() if self.function else self.value)]
+
+
+class Histogram:
+    """Répartition de durées dans des intervalles fixes, avec somme et nombre"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # Une case par intervalle, plus une pour les valeurs au-delà du dernier
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Mesure la durée d'un bloc `with`"""
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket{{le="{_format_value(float(bound))}"}}', cumulative))
+        samples.append((f'{self.name}_sum', total))
+        samples.append((f'{self.name}_count', cumulative))
+        return samples
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """Ensemble de métriques exposées ensemble"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        """Texte d'exposition Prometheus (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"[AVERTISSEMENT] Métrique {metric.name} illisible: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in samples:
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Connexions TCP et trafic (connection.py, boucles de lecture de server_web)
+TCP_CONNECTIONS = REGISTRY.gauge('lnm_tcp_connections', "Connexions TCP actives")
+FRAMES_RECEIVED = REGISTRY.counter('lnm_frames_received_total', "Trames reçues des pairs TCP")
+FRAMES_SENT = REGISTRY.counter('lnm_frames_sent_total', "Trames mises en file vers les pairs TCP")
+BYTES_RECEIVED = REGISTRY.counter('lnm_bytes_received_total', "Octets reçus des pairs TCP")
+BYTES_SENT = REGISTRY.counter('lnm_bytes_sent_total', "Octets écrits vers les pairs TCP")
+OUTBOUND_QUEUED_BYTES = REGISTRY.gauge('lnm_outbound_queued_bytes', "Octets en attente d'envoi, toutes connexions")
+
+# Transferts de fichiers en flux (transfer.py)
+FILE_BYTES_SENT = REGISTRY.counter('lnm_file_bytes_sent_total', "Octets de fichiers envoyés en FILE_CHUNK")
+FILE_BYTES_RECEIVED = REGISTRY.counter('lnm_file_bytes_received_total', "Octets de fichiers reçus en FILE_CHUNK")
+FILES_SENT = REGISTRY.counter('lnm_files_sent_total', "Transferts de fichiers envoyés (contenu déjà présent compris)")
+FILES_RECEIVED = REGISTRY.counter('lnm_files_received_total', "Transferts de fichiers reçus et vérifiés")
+
+# Base de données (database.py)
+DB_SAVE_MESSAGE_SECONDS = REGISTRY.histogram('lnm_db_save_message_seconds', "Durée de Database.save_message")
+DB_WRITE_QUEUE = REGISTRY.gauge('lnm_db_write_queue', "Écritures en attente du thread write-behind")
+
+# Interface web (emitter.py, server_web)
+RECV_TO_EMIT_SECONDS = REGISTRY.histogram('lnm_recv_to_emit_seconds',
+                                          "Délai entre la réception TCP d'un message et son emit Socket.IO")
+EMIT_SECONDS = REGISTRY.histogram('lnm_socketio_emit_seconds', "Durée d'un emit Socket.IO vers l'UI")
+UI_PENDING_EVENTS = REGISTRY.gauge('lnm_ui_pending_events', "Événements Socket.IO en attente de regroupement")
+WEB_CLIENTS = REGISTRY.gauge('lnm_web_clients', "Interfaces web connectées (Socket.IO)")
@@ -0,0 +1,536 @@
+"""
+Protocole filaire de LocalNetMessage
+
+v1 (historique) : une trame = une ligne UTF-8 terminée par '\\n', les trames de
+contrôle sont préfixées (`__CLIENT_STATUS__:...`, `__FILE__|...`).
+
+v2 : trames binaires typées et préfixées par leur longueur
+    [type: 1 octet][longueur: varint LEB128][charge utile]
+Négociation juste après le nom d'utilisateur : le client envoie la ligne
+`__PROTO__:2`, le serveur répond `__PROTO_OK__:2` puis les deux côtés passent
+en v2. Un pair qui n'envoie pas la demande (client.py) reste en v1.
+
+Compression (v2) : le client annonce ses codecs par une trame CODECS
+(`zstd,zlib`), le serveur répond par une trame CODECS portant le codec retenu.
+Dès lors, chaque côté enveloppe les trames d'au moins COMPRESS_MIN_SIZE octets
+dans une trame COMPRESSED :
+    [COMPRESSED][longueur][codec: 1 octet][trame v2 compressée]
+Le contexte de compression dure toute la connexion (vidage synchronisé après
+chaque trame) : un texte qui ressemble aux précédents se compresse bien mieux
+qu'isolé. Un pair qui ignore CODECS ne reçoit jamais de trame COMPRESSED.
+"""
+
+import base64
+import zlib
+
+from framer import LineFramer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PROTO_HELLO_LINE = "__PROTO__:2"
+PROTO_ACK_LINE = "__PROTO_OK__:2"
+# Première ligne d'un serveur v2 : séparateurs ASCII que str.strip() efface,
+# les anciens clients la sautent comme une ligne vide. Le client n'envoie
+# PROTO_HELLO_LINE qu'après l'avoir reçue (un ancien serveur en ferait un message)
+PROTO_OFFER_LINE = "\x1f\x1e"
+
+# Types de trames
+HELLO = 0x00
+TEXT = 0x01
+CLIENT_NAME = 0x02
+CLIENT_STATUS = 0x03
+CLIENT_AVATAR = 0x04
+SERVER_NAME = 0x05
+SERVER_STATUS = 0x06
+SERVER_AVATAR = 0x07
+FILE = 0x08
+FILE_BEGIN = 0x09
+FILE_CHUNK = 0x0A
+FILE_END = 0x0B
+FILE_HAVE = 0x0C
+AVATAR_WANT = 0x0D
+AVATAR = 0x0E
+COMPRESSED = 0x0F
+CODECS = 0x10
+PING = 0x11
+PONG = 0x12
+
+# Préfixes v1 -> type de trame
+TEXT_PREFIXES = {
+    "__CLIENT_NAME__:": CLIENT_NAME,
+    "__CLIENT_STATUS__:": CLIENT_STATUS,
+    "__CLIENT_AVATAR__:": CLIENT_AVATAR,
+    "__SERVER_NAME__:": SERVER_NAME,
+    "__SERVER_STATUS__:": SERVER_STATUS,
+    "__SERVER_AVATAR__:": SERVER_AVATAR,
+    "__FILE__|": FILE,
+    "__AVATAR_WANT__:": AVATAR_WANT,
+    "__AVATAR__|": AVATAR,
+    "__PING__:": PING,
+    "__PONG__:": PONG,
+}
+PREFIXES_BY_TYPE = {ftype: prefix for prefix, ftype in TEXT_PREFIXES.items()}
+
+# Types dont la charge utile reste binaire (les autres sont du texte UTF-8)
+BINARY_TYPES = {FILE, FILE_CHUNK, AVATAR}
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Codecs de compression, par ordre de préférence (octet d'identification dans COMPRESSED)
+CODEC_IDS = {'zstd': 1, 'zlib': 2}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+# En dessous, une trame part telle quelle (en-tête et vidage coûtent plus qu'ils ne gagnent)
+COMPRESS_MIN_SIZE = 256
+
+# Charges déjà compressées (images) ou envoyées par sendfile : jamais recompressées
+INCOMPRESSIBLE_TYPES = {FILE_CHUNK, AVATAR, COMPRESSED}
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+DECOMPRESS_ERRORS = (zlib.error, ValueError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class ProtocolError(Exception):
+    """Trame invalide reçue d'un pair"""
+
+
+def encode_varint(value):
+    """Encode un entier positif en varint LEB128"""
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buffer, pos):
+    """
+    Décode un varint LEB128
+
+    Args:
+        buffer: octets source
+        pos: position du premier octet du varint
+
+    Returns:
+        Tuple (valeur, position suivante) ou None si le varint est incomplet
+    """
+    value = 0
+    shift = 0
+    end = len(buffer)
+    while pos < end:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ProtocolError("Varint trop long")
+    return None
+
+
+def encode_frame(ftype, payload):
+    """Construit une trame v2 à partir d'une charge utile binaire"""
+    return bytes((ftype,)) + encode_varint(len(payload)) + payload
+
+
+def encode_file_payload(filename, mimetype, data):
+    """Charge utile v2 d'un fichier : nom, type MIME puis octets bruts (sans base64)"""
+    return filename.encode('utf-8') + b'\0' + mimetype.encode('utf-8') + b'\0' + bytes(data)
+
+
+def encode(ftype, value, version):
+    """
+    Encode une trame pour la version de protocole du pair
+
+    Args:
+        ftype: type de trame
+        value: texte (str), tuple (nom, mimetype, octets) pour FILE ou
+            (mimetype, octets) pour AVATAR
+        version: 1 (lignes texte) ou 2 (trames binaires)
+
+    Returns:
+        Octets à écrire sur le socket
+    """
+    if ftype == FILE:
+        filename, mimetype, data = value
+        if version >= 2:
+            return encode_frame(FILE, encode_file_payload(filename, mimetype, data))
+        b64 = base64.b64encode(data).decode('ascii')
+        return f"__FILE__|{filename}|{mimetype}|{len(data)}|{b64}\n".encode('utf-8')
+    if ftype == AVATAR:
+        mimetype, data = value
+        if version >= 2:
+            return encode_frame(AVATAR, mimetype.encode('utf-8') + b'\0' + bytes(data))
+        return f"__AVATAR__|{mimetype}|{base64.b64encode(data).decode('ascii')}\n".encode('utf-8')
+    if version >= 2:
+        return encode_frame(ftype, value.encode('utf-8'))
+    return (PREFIXES_BY_TYPE.get(ftype, '') + value + "\n").encode('utf-8')
+
+
+def available_codecs():
+    """Codecs utilisables ici, par ordre de préférence (zstd si le paquet est installé)"""
+    return [name for name in CODEC_IDS if name != 'zstd' or zstandard is not None]
+
+
+def choose_codec(offer):
+    """
+    Codec retenu pour une offre CODECS du pair
+
+    Args:
+        offer: valeur de la trame CODECS (`zstd,zlib`)
+
+    Returns:
+        Nom du codec, ou None si aucun n'est commun
+    """
+    offered = {name.strip() for name in offer.split(',')}
+    for name in available_codecs():
+        if name in offered:
+            return name
+    return None
+
+
+class FrameCompressor:
+    """Contexte de compression des trames v2 envoyées sur une connexion"""
+
+    def __init__(self, codec, min_size=COMPRESS_MIN_SIZE):
+        """
+        Args:
+            codec: 'zlib' ou 'zstd'
+            min_size: taille de trame à partir de laquelle on compresse
+        """
+        self.codec = codec
+        self.min_size = min_size
+        self._header = bytes((CODEC_IDS[codec],))
+        if codec == 'zstd':
+            self._context = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._context = zlib.compressobj(ZLIB_LEVEL)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def wrap(self, ftype, frame):
+        """
+        Trame à envoyer à la place de `frame` (appels dans l'ordre d'envoi)
+
+        Args:
+            ftype: type de la trame
+            frame: trame v2 encodée
+
+        Returns:
+            Trame COMPRESSED, ou `frame` inchangée si elle est petite ou incompressible
+        """
+        if ftype in INCOMPRESSIBLE_TYPES or len(frame) < self.min_size:
+            return frame
+        body = self._context.compress(frame) + self._context.flush(self._flush_mode)
+        self.raw_bytes += len(frame)
+        self.compressed_bytes += len(body)
+        return encode_frame(COMPRESSED, self._header + body)
+
+
+class SharedFrame:
+    """
+    Trame destinée à plusieurs pairs (diffusion) : encodée une seule fois par
+    version de protocole, les mêmes octets partent dans toutes les files
+    """
+
+    __slots__ = ('ftype', 'value', 'legacy_value', '_encoded')
+
+    def __init__(self, ftype, value, legacy_value=None):
+        """
+        Args:
+            ftype: type de trame
+            value: comme pour encode()
+            legacy_value: valeur envoyée aux pairs v1 à la place de `value`
+                (fonction appelée au premier pair v1, ex. avatar en data URL)
+        """
+        self.ftype = ftype
+        self.value = value
+        self.legacy_value = legacy_value
+        self._encoded = {}
+
+    def encode(self, version):
+        """Octets de la trame pour `version` (encodés au premier appel)"""
+        version = 2 if version >= 2 else 1
+        data = self._encoded.get(version)
+        if data is None:
+            value = self.value
+            if version == 1 and self.legacy_value is not None:
+                value = self.legacy_value()
+            data = self._encoded[version] = encode(self.ftype, value, version)
+        return data
+
+
+def decode_file(value):
+    """
+    Décode la charge utile d'une trame FILE (v1 ou v2)
+
+    Args:
+        value: reste de la ligne `__FILE__|` (str, v1) ou charge utile binaire (v2)
+
+    Returns:
+        Tuple (nom de fichier, mimetype, octets)
+    """
+    if isinstance(value, str):
+        filename, mimetype, _size, b64 = value.split('|', 3)
+        return filename, mimetype, base64.b64decode(b64.encode('utf-8'))
+    filename, mimetype, data = bytes(value).split(b'\0', 2)
+    return filename.decode('utf-8'), mimetype.decode('utf-8'), data
+
+
+def decode_avatar(value):
+    """
+    Décode la charge utile d'une trame AVATAR (v1 ou v2)
+
+    Returns:
+        Tuple (mimetype, octets)
+    """
+    if isinstance(value, str):
+        mimetype, b64 = value.split('|', 1)
+        return mimetype, base64.b64decode(b64.encode('utf-8'))
+    mimetype, data = bytes(value).split(b'\0', 1)
+    return mimetype.decode('utf-8'), data
+
+
+def parse_line(line):
+    """
+    Convertit une ligne v1 en trame typée
+
+    Args:
+        line: ligne texte sans le '\\n'
+
+    Returns:
+        Tuple (type, valeur) ; None pour une ligne vide
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('__'):
+        end = line.find('__', 2)
+        if end > 2:
+            prefix = line[:end + 3]
+            ftype = TEXT_PREFIXES.get(prefix)
+            if ftype in (FILE, AVATAR):
+                return ftype, line[len(prefix):]
+            if ftype is not None:
+                return ftype, line[len(prefix):].strip()
+    return TEXT, line
+
+
+def _frame_value(ftype, payload):
+    """Valeur d'une trame v2 : bytes pour les types binaires, str sinon"""
+    if ftype in BINARY_TYPES:
+        return payload
+    return payload.decode('utf-8', 'replace')
+
+
+class _BoundedOutput:
+    """Sortie d'un décompresseur zstd en flux, limitée à `limit` octets par trame"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+
+    def write(self, data):
+        if len(self.data) + len(data) > self.limit:
+            self.data = bytearray()
+            raise ProtocolError("Trame décompressée trop grande")
+        self.data += data
+        return len(data)
+
+    def take(self):
+        data = bytes(self.data)
+        self.data = bytearray()
+        return data
+
+
+class FrameDecoder:
+    """Découpe un flux v2 en trames (lecture de longueurs exactes, sans recherche de délimiteur)"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # codec -> contexte de décompression, créé à la première trame COMPRESSED
+        self._contexts = {}
+
+    def feed(self, data):
+        """
+        Ajoute des octets et retourne les trames complètes
+
+        Returns:
+            Liste de tuples (type, valeur) : str pour les types texte, bytes sinon
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        end = len(buffer)
+        while pos < end:
+            header = decode_varint(buffer, pos + 1)
+            if header is None:
+                break
+            length, start = header
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Trame trop grande ({length} octets)")
+            stop = start + length
+            if stop > end:
+                break
+            ftype = buffer[pos]
+            payload = bytes(buffer[start:stop])
+            if ftype == COMPRESSED:
+                ftype, payload = self._decompress(payload)
+            frames.append((ftype, _frame_value(ftype, payload)))
+            pos = stop
+        if pos:
+            del buffer[:pos]
+        return frames
+
+    def _decompress(self, payload):
+        """
+        Trame enveloppée dans une trame COMPRESSED
+
+        Returns:
+            Tuple (type, charge utile binaire)
+        """
+        if not payload:
+            raise ProtocolError("Trame compressée vide")
+        codec = CODEC_NAMES.get(payload[0])
+        context = self._contexts.get(codec)
+        if context is None:
+            if codec == 'zlib':
+                context = zlib.decompressobj()
+            elif codec == 'zstd' and zstandard is not None:
+                # decompressobj() de zstandard n'a pas de taille maximale : la sortie
+                # passe par un tampon borné qui coupe la décompression au-delà
+                sink = _BoundedOutput(MAX_FRAME_SIZE + 16)
+                context = (zstandard.ZstdDecompressor().stream_writer(sink), sink)
+            else:
+                raise ProtocolError(f"Codec de compression inconnu ({payload[0]})")
+            self._contexts[codec] = context
+        try:
+            if codec == 'zlib':
+                frame = context.decompress(payload[1:], MAX_FRAME_SIZE + 16)
+                if context.unconsumed_tail:
+                    raise ProtocolError("Trame décompressée trop grande")
+            else:
+                writer, sink = context
+                writer.write(payload[1:])
+                frame = sink.take()
+        except DECOMPRESS_ERRORS as e:
+            raise ProtocolError(f"Trame compressée invalide: {e}")
+        header = decode_varint(frame, 1) if frame else None
+        if header is None or header[0] + header[1] != len(frame) or frame[0] == COMPRESSED:
+            raise ProtocolError("Trame compressée invalide")
+        return frame[0], frame[header[1]:]
+
+    def wanted(self):
+        """Nombre d'octets minimum pour compléter la trame en cours (0 si inconnu)"""
+        header = decode_varint(self.buffer, 1) if self.buffer else None
+        if header is None:
+            return 0
+        length, start = header
+        return max(start + length - len(self.buffer), 0)
+
+
+class FrameReader:
+    """
+    Lecteur de trames d'une connexion : v1 par lignes, puis v2 après négociation
+
+    Pendant la négociation les lignes sont extraites une à une pour que les
+    octets binaires qui suivent la ligne de bascule ne soient pas décodés
+    comme du texte.
+    """
+
+    def __init__(self, upgrade_line=None, first_line_only=False):
+        """
+        Args:
+            upgrade_line: ligne qui fait basculer la lecture en v2 (None: jamais)
+            first_line_only: n'accepter la ligne de bascule qu'en première ligne
+        """
+        self.framer = LineFramer()
+        self.decoder = None
+        self._pending = bytearray()
+        self.upgrade_line = upgrade_line
+        self.first_line_only = first_line_only
+
+    @property
+    def version(self):
+        return 2 if self.decoder else 1
+
+    @property
+    def recv_size(self):
+        if self.decoder:
+            return max(self.framer.recv_size, min(self.decoder.wanted(), self.framer.max_recv))
+        return self.framer.recv_size
+
+    def stop_negotiation(self):
+        """
+        Abandonne la négociation : le pair reste en v1
+
+        Returns:
+            Trames v1 déjà reçues mais pas encore retournées
+        """
+        self.upgrade_line = None
+        if not self._pending:
+            return []
+        return self.feed(self._take_pending())
+
+    def feed(self, data):
+        """
+        Ajoute des octets et retourne les trames complètes
+
+        Returns:
+            Liste de tuples (type, valeur) ; la ligne de bascule produit une
+            trame HELLO côté serveur (à acquitter par l'appelant)
+        """
+        if self.decoder:
+            return self.decoder.feed(data)
+        if self.upgrade_line is None:
+            frames = []
+            for line in self.framer.feed(data):
+                frame = parse_line(line)
+                if frame:
+                    frames.append(frame)
+            return frames
+        return self._feed_negotiating(data)
+
+    def _feed_negotiating(self, data):
+        pending = self._pending
+        pending += data
+        frames = []
+        while self.upgrade_line is not None:
+            pos = pending.find(b'\n')
+            if pos == -1:
+                return frames
+            line = pending[:pos].decode('utf-8', 'replace').strip()
+            del pending[:pos + 1]
+            if line == self.upgrade_line:
+                self.upgrade_line = None
+                self.decoder = FrameDecoder()
+                if line == PROTO_HELLO_LINE:
+                    frames.append((HELLO, '2'))
+                frames.extend(self.decoder.feed(self._take_pending()))
+                return frames
+            if self.first_line_only and line:
+                self.upgrade_line = None
+            frame = parse_line(line)
+            if frame:
+                frames.append(frame)
+        # Négociation terminée sans bascule : on reprend le découpage normal
+        for line in self.framer.feed(self._take_pending()):
+            frame = parse_line(line)
+            if frame:
+                frames.append(frame)
+        return frames
+
+    def _take_pending(self):
+        rest = bytes(self._pending)
+        self._pending.clear()
+        return rest
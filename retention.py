@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Rétention de l'historique pour LocalNetMessage
+
+Les messages et fichiers plus anciens que la durée de rétention quittent la
+base courante pour une archive mensuelle (`<archive_dir>/<base>-AAAA-MM.db`,
+même schéma, index plein texte compris). Les archives restent lisibles via
+l'API de Database (get_messages, search, get_files, export_to_json), en
+lecture seule.
+
+Le déplacement se fait par petits lots (Database.archive_batch), avec une
+pause entre deux lots : l'écrivain du chat n'attend jamais plus d'un lot.
+L'espace libéré est ensuite rendu au système par VACUUM incrémental. Une
+base créée avant la rétention n'est pas en auto_vacuum incrémental : le
+service ne la convertit pas (VACUUM complet, écritures bloquées), il faut
+lancer une fois la commande avec --convert, serveur arrêté.
+
+Usage ponctuel (cron) :
+    python retention.py <base.db> <dossier des archives> <jours> [--convert]
+"""
+
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from database import ARCHIVE_BATCH, VACUUM_PAGES, Database
+
+# Intervalle entre deux passages du service
+RETENTION_INTERVAL = 3600
+
+# Pause entre deux lots, pour laisser passer les écritures du chat
+BATCH_PAUSE = 0.05
+
+
+class RetentionService:
+    """Archive périodiquement l'historique ancien d'une base, dans un thread dédié"""
+
+    def __init__(self, db, max_age_days, interval=RETENTION_INTERVAL, batch_size=ARCHIVE_BATCH):
+        """
+        Args:
+            db: Database avec un archive_dir
+            max_age_days: âge au-delà duquel messages et fichiers sont archivés
+            interval: secondes entre deux passages
+            batch_size: lignes par table déplacées par transaction
+        """
+        if db.archive_dir is None:
+            raise ValueError("La rétention nécessite une base avec archive_dir")
+        self.db = db
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._vacuum_warned = False
+
+    def start(self):
+        """Lance le service (premier passage immédiat)"""
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le service après le lot en cours"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[ERREUR] Rétention: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def run_once(self):
+        """
+        Archive ce qui a dépassé la durée de rétention puis libère l'espace
+
+        Returns:
+            Nombre de lignes archivées
+        """
+        before = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+        moved = 0
+        while not self._stop.is_set():
+            count = self.db.archive_batch(before, self.batch_size)
+            if count == 0:
+                break
+            moved += count
+            self._stop.wait(BATCH_PAUSE)
+
+        if moved:
+            print(f"[INFO] Rétention: {moved} lignes archivées dans {self.db.archive_dir}")
+            if self.db.incremental_vacuum_enabled():
+                while not self._stop.is_set() and self.db.incremental_vacuum(VACUUM_PAGES) > 0:
+                    self._stop.wait(BATCH_PAUSE)
+            elif not self._vacuum_warned:
+                self._vacuum_warned = True
+                print(f"[AVERTISSEMENT] Rétention: {self.db.db_path} n'est pas en auto_vacuum incrémental, "
+                      f"l'espace libéré reste dans le fichier (serveur arrêté : "
+                      f"python retention.py {self.db.db_path} {self.db.archive_dir} {self.max_age_days} --convert)")
+        return moved
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--convert']
+    if len(args) != 3 or len(sys.argv) > 5:
+        print(__doc__)
+        sys.exit(1)
+    db = Database(args[0], archive_dir=args[1])
+    # Conversion hors service uniquement : le VACUUM complet bloque les écritures
+    if '--convert' in sys.argv and db.enable_incremental_vacuum():
+        print("[INFO] Rétention: base convertie en auto_vacuum incrémental (VACUUM unique)")
+    RetentionService(db, int(args[2])).run_once()
+    db.close()
@@ -1,20 +1,47 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import socket
 import threading
+import asyncio
+import time
 import os
 import base64
 from pathlib import Path
+from urllib.parse import unquote
 from database import Database
+from connection import SocketConnection, StreamConnection
+from framer import split_handshake
+import protocol
+from file_serving import SendfileMiddleware, blob_url, send_avatar, send_blob, send_stored_file
+from blobstore import BlobStore
+from avatars import AvatarStore, avatar_url, parse_ref
+from retention import RetentionService
+import export
+import metrics
+import tracing
+from conversations import ConversationBuffer, ConversationCache
+from transfer import IncomingTransfers, OutgoingTransfers
+from emitter import EmitCoalescer
 from datetime import datetime
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'localnetmessage-secret-key-2025'
+# Derrière un proxy qui gère X-Sendfile (nginx, Apache), lui déléguer l'envoi des fichiers
+app.config['USE_X_SENDFILE'] = os.environ.get('LNM_X_SENDFILE') == '1'
+app.wsgi_app = SendfileMiddleware(app.wsgi_app)
 socketio = SocketIO(app, cors_allowed_origins="*")
+# Événements issus du trafic TCP, regroupés en `messages_batch` pendant les rafales
+ui = EmitCoalescer(socketio)
 
 HOST = '0.0.0.0'
 PORT = 12345
 
+# Moteur TCP : 'thread' (un thread par client) ou 'asyncio' (une seule boucle d'événements)
+TCP_ENGINE = os.environ.get('LNM_TCP_ENGINE', 'thread')
+
+# Compression des trames v2 proposée par les clients (LNM_COMPRESSION=0 : refusée)
+COMPRESSION = os.environ.get('LNM_COMPRESSION', '1') != '0'
+
 server_username = 'Serveur'
 server_status = 'Disponible'
 server_avatar = '🙂'
@@ -28,248 +55,585 @@ EXIT_KEYWORDS = [
 clients = {}
 client_counter = 0
 
+# Rooms Socket.IO : toutes les UI suivent la présence et les compteurs de
+# non-lus ; une UI ne reçoit les messages que de la conversation affichée
+PRESENCE_ROOM = 'presence'
+# sid de l'UI -> client_id de la conversation suivie
+ui_subscriptions = {}
+
+# Groupes de diffusion nommés : nom -> ensemble de client_id (en mémoire,
+# comme les ID des clients qui repartent de zéro au redémarrage)
+groups = {}
+GROUP_NAME_MAX = 50
+
 BASE_DIR = Path(__file__).resolve().parent
-SERVER_FILES_DIR = BASE_DIR / 'uploads' / 'server'
+# Base, pièces jointes et archives (LNM_DATA_DIR : ailleurs que dans le dépôt, ex. bench/loadgen.py)
+DATA_DIR = Path(os.environ.get('LNM_DATA_DIR', BASE_DIR))
+SERVER_FILES_DIR = DATA_DIR / 'uploads' / 'server'
 SERVER_RECEIVED_DIR = SERVER_FILES_DIR / 'received'
 SERVER_SENT_DIR = SERVER_FILES_DIR / 'sent'
+SERVER_BLOBS_DIR = SERVER_FILES_DIR / 'blobs'
+SERVER_AVATARS_DIR = SERVER_FILES_DIR / 'avatars'
 for d in [SERVER_RECEIVED_DIR, SERVER_SENT_DIR]:
     os.makedirs(d, exist_ok=True)
 
+# Les pairs v1 reçoivent les fichiers en une ligne base64 : taille limitée
+LEGACY_FILE_LIMIT = 2 * 1024 * 1024
+
+# Historique envoyé à l'UI par pages (get_client_messages)
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+
+# Résultats de recherche plein texte par page
+SEARCH_PAGE_SIZE = 20
+
+# Derniers messages gardés en mémoire par client connecté
+CONVERSATION_BUFFER_SIZE = 200
+# Mémoire des conversations gardées après déconnexion (cache LRU)
+RECENT_CONVERSATIONS_BUDGET = 16 * 1024 * 1024
+
 # Initialiser la base de données SQLite
-db = Database(str(BASE_DIR / 'messages.db'))
+# LNM_DB_WRITE_BEHIND=1 : messages et compteurs validés par lots dans un thread dédié
+# Historique ancien déplacé dans des archives mensuelles (retention.py), toujours consultables
+db = Database(str(DATA_DIR / 'messages.db'), write_behind=os.environ.get('LNM_DB_WRITE_BEHIND') == '1',
+              archive_dir=DATA_DIR / 'archives')
 
-def handle_client(client_socket, client_address, client_id):
-    """Gère la communication avec un client TCP connecté"""
-    global clients
-    
-    address_str = f"{client_address[0]}:{client_address[1]}"
-    username = "Anonyme"
-    
-    try:
-        username = client_socket.recv(1024).decode('utf-8').strip()
-        if not username:
-            username = f"Client_{client_id}"
-    except:
-        username = f"Client_{client_id}"
-    
+# Pièces jointes envoyées et reçues, stockées une seule fois par contenu
+blob_store = BlobStore(SERVER_BLOBS_DIR, db)
+
+# Avatars image (serveur et clients), désignés par hash dans les trames et les événements
+avatar_store = AvatarStore(SERVER_AVATARS_DIR)
+
+# Conversations des clients récemment déconnectés
+recent_conversations = ConversationCache(RECENT_CONVERSATIONS_BUDGET)
+
+def _register_client(client_id, username, address_str):
+    """Enregistre un client après le handshake et notifie le client TCP et l'UI web"""
+    conn = clients[client_id]['conn']
     clients[client_id]['username'] = username
-    clients[client_id]['messages'] = []
-    
+    # Fin de l'historique en base : l'ID peut déjà servir depuis un redémarrage
+    recent_conversations.pop(client_id)
+    rows = db.get_messages(client_id, limit=CONVERSATION_BUFFER_SIZE + 1)
+    clients[client_id]['messages'] = ConversationBuffer(client_id, CONVERSATION_BUFFER_SIZE, rows)
+    clients[client_id]['transfers'].peer = username
+    history = db.get_client_history(client_id)
+    clients[client_id]['unread'] = history['unread_count'] if history else 0
+
     print(f"[NOUVELLE CONNEXION] {username} ({address_str}) - ID: {client_id}")
-    
+
     # Mettre à jour l'historique du client dans SQLite
     db.update_client_history(client_id, username, address_str)
 
     try:
-        client_socket.send(f"__SERVER_NAME__:{server_username}\n".encode('utf-8'))
-        client_socket.send(f"__SERVER_STATUS__:{server_status}\n".encode('utf-8'))
-        client_socket.send(f"__SERVER_AVATAR__:{server_avatar}\n".encode('utf-8'))
+        # Offre du protocole v2 : le client récent y répond par PROTO_HELLO_LINE
+        conn.send((protocol.PROTO_OFFER_LINE + "\n").encode('ascii'))
+        conn.send_frame(protocol.SERVER_NAME, server_username)
+        conn.send_frame(protocol.SERVER_STATUS, server_status)
+        # Envoyé avant la négociation : data URL pour une image (voir _on_hello)
+        avatar_store.send(conn, protocol.SERVER_AVATAR, server_avatar)
     except Exception as e:
         print(f"[AVERTISSEMENT] Impossible d'envoyer les infos du serveur au client {client_id}: {e}")
-    
-    socketio.emit('client_connected', {
+
+    ui.emit('client_connected', {
         'client_id': client_id,
         'address': address_str,
         'username': username,
         'status': clients[client_id].get('status', 'Disponible'),
-        'avatar': clients[client_id].get('avatar', '🙂')
-    })
-    
+        'avatar': avatar_url(clients[client_id].get('avatar', '🙂'))
+    }, to=PRESENCE_ROOM)
+
+
+def _unregister_client(client_id, username, address_str):
+    """Retire un client déconnecté et notifie l'UI web"""
+    client = clients.pop(client_id, None)
+    if client:
+        client['conn'].close()
+        avatar_store.forget(client['conn'])
+        client['transfers'].suspend_all()
+        client['outgoing'].cancel_all()
+        recent_conversations.put(client['messages'])
+    print(f"[FERMETURE] {username} déconnecté.")
+
+    ui.emit('client_disconnected', {
+        'client_id': client_id,
+        'address': address_str,
+        'username': username
+    }, to=PRESENCE_ROOM)
+
+
+def conversation_room(client_id):
+    """Room des UI qui affichent la conversation d'un client"""
+    return f"conversation:{client_id}"
+
+
+def _notify_activity(client_id, unread=True):
+    """
+    Compteur de non-lus d'une conversation, pour les UI qui ne l'affichent pas
+
+    Même règle que client_history.unread_count : seuls les messages texte
+    reçus le font avancer (unread=False pour un fichier reçu)
+    """
+    client = clients.get(client_id)
+    if client is None:
+        return
+    if unread:
+        client['unread'] = client.get('unread', 0) + 1
+    ui.emit('conversation_activity', {
+        'client_id': client_id,
+        'unread_count': client['unread']
+    }, to=PRESENCE_ROOM, key=('conversation_activity', client_id))
+
+
+def _client_username(client_id):
+    return clients.get(client_id, {}).get('username', f"Client_{client_id}")
+
+
+def _on_hello(client_id, address_str, version):
+    """Le client demande le protocole v2 : acquittement puis bascule des envois"""
+    if client_id in clients:
+        conn = clients[client_id]['conn']
+        conn.upgrade(protocol.PROTO_ACK_LINE)
+        print(f"[INFO] Client {client_id} utilise le protocole v{version}")
+        if parse_ref(server_avatar):
+            # Le client v2 garde la référence (image demandée par AVATAR_WANT si besoin)
+            conn.send_frame(protocol.SERVER_AVATAR, server_avatar)
+        thread = threading.Thread(target=_resume_transfers, args=(client_id,))
+        thread.daemon = True
+        thread.start()
+    return True
+
+
+def _on_ping(client_id, address_str, token):
+    """PING : réponse PONG avec le même jeton, après les trames reçues avant lui (bench/loadgen.py)"""
+    if client_id in clients:
+        clients[client_id]['conn'].send_frame(protocol.PONG, token)
+    return True
+
+
+def _on_codecs(client_id, address_str, offer):
+    """Le client propose ses codecs : le premier commun est retenu et acquitté"""
+    codec = protocol.choose_codec(offer) if COMPRESSION else None
+    if codec and client_id in clients:
+        clients[client_id]['conn'].enable_compression(codec, ack=codec)
+        print(f"[INFO] Client {client_id} : trames compressées ({codec})")
+    return True
+
+
+def _on_client_name(client_id, address_str, new_name):
+    new_name = new_name or f"Client_{client_id}"
+    if client_id in clients:
+        clients[client_id]['username'] = new_name
+    db.update_client_history(client_id, new_name, address_str)
+    ui.emit('client_renamed', {
+        'client_id': client_id,
+        'address': address_str,
+        'username': new_name
+    }, to=PRESENCE_ROOM, key=('client_renamed', client_id))
+    return True
+
+
+def _on_client_status(client_id, address_str, new_status):
+    username = _client_username(client_id)
+    print(f"[INFO] Client {client_id} ({username}) change de statut: {new_status}")
+    if client_id in clients:
+        clients[client_id]['status'] = new_status
+    ui.emit('client_status_changed', {
+        'client_id': client_id,
+        'address': address_str,
+        'username': username,
+        'status': new_status
+    }, to=PRESENCE_ROOM, key=('client_status_changed', client_id))
+    print(f"[INFO] Événement client_status_changed émis pour client {client_id}")
+    return True
+
+
+def _on_client_avatar(client_id, address_str, new_avatar):
+    username = _client_username(client_id)
+    print(f"[INFO] Client {client_id} ({username}) change d'avatar")
+
+    def apply(avatar):
+        if client_id in clients:
+            clients[client_id]['avatar'] = avatar
+        ui.emit('client_avatar_changed', {
+            'client_id': client_id,
+            'address': address_str,
+            'username': _client_username(client_id),
+            'avatar': avatar_url(avatar)
+        }, to=PRESENCE_ROOM, key=('client_avatar_changed', client_id))
+
+    # Image inconnue : demandée au client (AVATAR_WANT), appliquée à son arrivée
+    try:
+        avatar_store.resolve(new_avatar, clients[client_id]['conn'], apply)
+    except (KeyError, ValueError, ConnectionError) as e:
+        print(f"[AVERTISSEMENT] Avatar du client {client_id} ignoré: {e}")
+    return True
+
+
+def _on_avatar_want(client_id, address_str, sha256):
+    """Le client n'a pas l'avatar du serveur : envoi de l'image, une fois"""
+    found = avatar_store.read(sha256)
+    if found is not None and client_id in clients:
+        clients[client_id]['conn'].send_frame(protocol.AVATAR, found)
+    return True
+
+
+def _on_avatar(client_id, address_str, payload):
+    try:
+        avatar_store.receive(payload, clients[client_id]['conn'])
+    except (KeyError, ValueError) as e:
+        print(f"[AVERTISSEMENT] Avatar du client {client_id} refusé: {e}")
+    return True
+
+
+def _record_received_file(client_id, address_str, filename, mimetype, size, save_path, sha256):
+    """Historique, SQLite et notification UI d'un fichier reçu d'un client"""
+    username = _client_username(client_id)
+    timestamp = datetime.now().isoformat()
+
+    # Sauvegarder dans SQLite
+    db.save_file(
+        client_id,
+        filename,
+        mimetype,
+        size,
+        'received',
+        username,
+        str(save_path),
+        timestamp,
+        sha256,
+        blob=sha256
+    )
+    db.increment_file_count(client_id)
+    tracing.mark('db')
+
+    ui.emit('file_received', {
+        'client_id': client_id,
+        'address': address_str,
+        'username': username,
+        'filename': filename,
+        'mimetype': mimetype,
+        'size': size,
+        'avatar': avatar_url(clients.get(client_id, {}).get('avatar', '🙂')),
+        'url': blob_url(sha256, filename)
+    }, to=conversation_room(client_id))
+    # Les fichiers ne comptent pas dans unread_count (triggers sur `messages`)
+    _notify_activity(client_id, unread=False)
+    tracing.mark('emit')
+
+
+def _on_file(client_id, address_str, payload):
     try:
+        filename, mimetype, data = protocol.decode_file(payload)
+        filename = os.path.basename(filename)
+        tracing.mark('file_decode')
+        sha256, size, save_path = blob_store.add_bytes(data)
+        tracing.mark('write')
+        _record_received_file(client_id, address_str, filename, mimetype, size, save_path, sha256)
+    except Exception as e:
+        print(f"[ERREUR] Réception fichier client {client_id}: {e}")
+    return True
+
+
+def _on_file_begin(client_id, address_str, payload):
+    if client_id in clients:
+        item, have = clients[client_id]['transfers'].begin(payload)
+        clients[client_id]['conn'].send(have)
+        if item is not None and item.received:
+            print(f"[INFO] Client {client_id}: reprise de {item.filename} ({item.received}/{item.size} o)")
+        elif item is not None:
+            print(f"[INFO] Client {client_id}: réception de {item.filename} ({item.size} o)")
+    return True
+
+
+def _on_file_chunk(client_id, address_str, payload):
+    if client_id in clients:
+        clients[client_id]['transfers'].chunk(payload)
+        tracing.mark('write')
+    return True
+
+
+def _on_file_end(client_id, address_str, payload):
+    if client_id not in clients:
+        return True
+    item, valid, ack = clients[client_id]['transfers'].end(payload)
+    if item is None:
+        if ack is not None:
+            # Preuve de possession refusée : le client envoie le fichier
+            clients[client_id]['conn'].send(ack)
+        return True
+    if not valid:
+        print(f"[ERREUR] Réception fichier client {client_id}: somme de contrôle invalide pour {item.filename}")
+        return True
+    clients[client_id]['conn'].send(ack)
+    _record_received_file(client_id, address_str, item.filename, item.mimetype, item.size, item.path,
+                          item.sha256)
+    return True
+
+
+def _on_file_have(client_id, address_str, payload):
+    if client_id in clients:
+        clients[client_id]['outgoing'].on_have(payload)
+    return True
+
+
+def _on_text(client_id, address_str, line):
+    username = _client_username(client_id)
+    if line.lower() in EXIT_KEYWORDS:
+        print(f"[DÉCONNEXION] {username} se déconnecte (mot-clé: '{line}').")
+        try:
+            clients[client_id]['conn'].send_frame(protocol.TEXT, "Au revoir !")
+        except Exception:
+            pass
+        return False
+
+    if client_id in clients:
+        timestamp = datetime.now().isoformat()
+        # Sauvegarder dans SQLite
+        message_id = db.save_message(client_id, 'received', username, line, timestamp)
+        db.increment_message_count(client_id)
+        tracing.mark('db')
+        clients[client_id]['messages'].append(message_id, 'received', username, line, timestamp)
+        tracing.mark('buffer')
+
+    ui.emit('message_received', {
+        'client_id': client_id,
+        'address': address_str,
+        'username': username,
+        'message': line,
+        'avatar': avatar_url(clients.get(client_id, {}).get('avatar', '🙂'))
+    }, to=conversation_room(client_id), received_at=clients.get(client_id, {}).get('received_at'))
+    _notify_activity(client_id)
+    tracing.mark('emit')
+    return True
+
+
+# Table de dispatch des trames reçues d'un client : type -> gestionnaire
+FRAME_HANDLERS = {
+    protocol.HELLO: _on_hello,
+    protocol.CODECS: _on_codecs,
+    protocol.PING: _on_ping,
+    protocol.CLIENT_NAME: _on_client_name,
+    protocol.CLIENT_STATUS: _on_client_status,
+    protocol.CLIENT_AVATAR: _on_client_avatar,
+    protocol.AVATAR_WANT: _on_avatar_want,
+    protocol.AVATAR: _on_avatar,
+    protocol.FILE: _on_file,
+    protocol.FILE_BEGIN: _on_file_begin,
+    protocol.FILE_CHUNK: _on_file_chunk,
+    protocol.FILE_END: _on_file_end,
+    protocol.FILE_HAVE: _on_file_have,
+    protocol.TEXT: _on_text,
+}
+
+# Trames traitées hors de la boucle asyncio (décodage, hash, écriture disque, SQLite) ;
+# la boucle attend chaque trame avant la suivante : l'ordre par connexion est gardé
+BLOCKING_FRAME_TYPES = {
+    protocol.FILE, protocol.FILE_BEGIN, protocol.FILE_CHUNK, protocol.FILE_END, protocol.FILE_HAVE,
+    protocol.TEXT, protocol.CLIENT_NAME, protocol.CLIENT_AVATAR, protocol.AVATAR,
+}
+
+
+def _handle_frame(client_id, address_str, ftype, value, trace=None):
+    """
+    Traite une trame reçue d'un client TCP
+
+    Args:
+        client_id: ID du client
+        address_str: adresse IP:port du client
+        ftype: type de trame (voir protocol.py)
+        value: contenu décodé de la trame
+        trace: tracing.Trace de la trame (None: traçage désactivé)
+
+    Returns:
+        False si le client doit être déconnecté, True sinon
+    """
+    metrics.FRAMES_RECEIVED.inc()
+    handler = FRAME_HANDLERS.get(ftype)
+    if handler is None:
+        return True
+    if trace is None:
+        return handler(client_id, address_str, value)
+    with tracing.TRACER.active(trace):
+        return handler(client_id, address_str, value)
+
+
+def _new_client_entry(conn, address_str, client_id):
+    """Crée l'entrée du dictionnaire `clients` pour une nouvelle connexion"""
+    return {
+        'conn': conn,
+        'address': address_str,
+        'username': f"Client_{client_id}",
+        'status': 'Disponible',
+        'avatar': '🙂',
+        'messages': ConversationBuffer(client_id, CONVERSATION_BUFFER_SIZE),
+        'transfers': IncomingTransfers(blob_store, db),
+        'outgoing': OutgoingTransfers(db)
+    }
+
+
+def handle_client(client_socket, client_address, client_id):
+    """Gère la communication avec un client TCP connecté (moteur threadé)"""
+    address_str = f"{client_address[0]}:{client_address[1]}"
+    username = f"Client_{client_id}"
+
+    reader = protocol.FrameReader(protocol.PROTO_HELLO_LINE, first_line_only=True)
+    try:
+        rest = b''
+        try:
+            username, rest = split_handshake(client_socket.recv(1024))
+        except Exception:
+            username = ''
+        if not username:
+            username = f"Client_{client_id}"
+
+        _register_client(client_id, username, address_str)
+
+        entry = clients[client_id]
         connected = True
-        buffer = ""
+        chunk = rest
         while connected:
-            chunk = client_socket.recv(1024)
+            # Instant de réception des trames de ce bloc (lnm_recv_to_emit_seconds, traces)
+            received_at = entry['received_at'] = time.monotonic()
+            metrics.BYTES_RECEIVED.inc(len(chunk))
+            frames = reader.feed(chunk)
+            decoded_at = time.monotonic()
+            for ftype, value in frames:
+                trace = tracing.TRACER.begin('handle_client', received_at, decoded_at,
+                                             client_id=client_id, frame=ftype)
+                connected = _handle_frame(client_id, address_str, ftype, value, trace)
+                if not connected:
+                    break
+            if not connected:
+                break
+            chunk = client_socket.recv(reader.recv_size)
             if not chunk:
                 break
-            try:
-                text = chunk.decode('utf-8')
-            except UnicodeDecodeError:
-                continue
-            buffer += text
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith("__CLIENT_NAME__:"):
-                    new_name = line.split(":",1)[1].strip() or f"Client_{client_id}"
-                    username = new_name
-                    if client_id in clients:
-                        clients[client_id]['username'] = new_name
-                    db.update_client_history(client_id, new_name, address_str)
-                    socketio.emit('client_renamed', {
-                        'client_id': client_id,
-                        'address': address_str,
-                        'username': new_name
-                    })
-                    continue
-
-                if line.startswith("__CLIENT_STATUS__:"):
-                    new_status = line.split(":",1)[1].strip()
-                    print(f"[INFO] Client {client_id} ({username}) change de statut: {new_status}")
-                    if client_id in clients:
-                        clients[client_id]['status'] = new_status
-                    socketio.emit('client_status_changed', {
-                        'client_id': client_id,
-                        'address': address_str,
-                        'username': username,
-                        'status': new_status
-                    })
-                    print(f"[INFO] Événement client_status_changed émis pour client {client_id}")
-                    continue
-
-                if line.startswith("__CLIENT_AVATAR__:"):
-                    new_avatar = line.split(":",1)[1].strip()
-                    print(f"[INFO] Client {client_id} ({username}) change d'avatar")
-                    if client_id in clients:
-                        clients[client_id]['avatar'] = new_avatar
-                    socketio.emit('client_avatar_changed', {
-                        'client_id': client_id,
-                        'address': address_str,
-                        'username': username,
-                        'avatar': new_avatar
-                    })
-                    print(f"[INFO] Événement client_avatar_changed émis pour client {client_id}")
-                    continue
-
-                if line.startswith("__FILE__|"):
-                    try:
-                        _, filename, mimetype, size_str, b64 = line.split('|', 4)
-                        data = base64.b64decode(b64.encode('utf-8'))
-                        filename = os.path.basename(filename)
-                        client_dir = SERVER_RECEIVED_DIR / str(client_id)
-                        os.makedirs(client_dir, exist_ok=True)
-                        save_path = client_dir / filename
-                        with open(save_path, 'wb') as f:
-                            f.write(data)
-                        
-                        timestamp = datetime.now().isoformat()
-                        
-                        if client_id in clients:
-                            clients[client_id]['messages'].append({
-                                'type': 'received',
-                                'sender': username,
-                                'message': f"[FICHIER] {filename} ({len(data)} o)",
-                                'timestamp': timestamp,
-                                'read': False
-                            })
-                        
-                        # Sauvegarder dans SQLite
-                        db.save_file(
-                            client_id,
-                            filename,
-                            mimetype,
-                            len(data),
-                            'received',
-                            username,
-                            str(save_path),
-                            timestamp
-                        )
-                        db.increment_file_count(client_id)
-                        
-                        socketio.emit('file_received', {
-                            'client_id': client_id,
-                            'address': address_str,
-                            'username': username,
-                            'filename': filename,
-                            'mimetype': mimetype,
-                            'size': len(data),
-                            'avatar': clients.get(client_id, {}).get('avatar', '🙂'),
-                            'url': f"/files/server/received/{client_id}/{filename}"
-                        })
-                    except Exception as e:
-                        print(f"[ERREUR] Réception fichier client {client_id}: {e}")
-                    continue
-
-                if line.lower() in EXIT_KEYWORDS:
-                    print(f"[DÉCONNEXION] {username} se déconnecte (mot-clé: '{line}').")
-                    try:
-                        client_socket.send("Au revoir !\n".encode('utf-8'))
-                    except:
-                        pass
-                    connected = False
-                    continue
-
-                if client_id in clients:
-                    timestamp = datetime.now().isoformat()
-                    clients[client_id]['messages'].append({
-                        'type': 'received',
-                        'sender': username,
-                        'message': line,
-                        'timestamp': timestamp,
-                        'read': False
-                    })
-                    # Sauvegarder dans SQLite
-                    db.save_message(client_id, 'received', username, line, timestamp)
-                    db.increment_message_count(client_id)
-                
-                socketio.emit('message_received', {
-                    'client_id': client_id,
-                    'address': address_str,
-                    'username': username,
-                    'message': line,
-                    'avatar': clients.get(client_id, {}).get('avatar', '🙂')
-                })
-    
+
     except Exception as e:
         print(f"[ERREUR] {username}: {e}")
-    
+
     finally:
-        if client_id in clients:
-            del clients[client_id]
-        
-        client_socket.close()
-        print(f"[FERMETURE] {username} déconnecté.")
-        
-        socketio.emit('client_disconnected', {
-            'client_id': client_id,
-            'address': address_str,
-            'username': username
-        })
+        username = clients.get(client_id, {}).get('username', username)
+        _unregister_client(client_id, username, address_str)
+
+
+async def handle_client_async(reader, writer):
+    """Gère la communication avec un client TCP connecté (moteur asyncio)"""
+    global client_counter
+
+    loop = asyncio.get_running_loop()
+    client_address = writer.get_extra_info('peername')
+    address_str = f"{client_address[0]}:{client_address[1]}"
+
+    client_counter += 1
+    client_id = client_counter
+    username = f"Client_{client_id}"
+    clients[client_id] = _new_client_entry(StreamConnection(loop, writer), address_str, client_id)
+    print(f"[CONNEXIONS ACTIVES] {len(clients)}")
+
+    frames = protocol.FrameReader(protocol.PROTO_HELLO_LINE, first_line_only=True)
+    try:
+        rest = b''
+        try:
+            username, rest = split_handshake(await reader.read(1024))
+        except Exception:
+            username = ''
+        if not username:
+            username = f"Client_{client_id}"
+
+        # Lectures et écritures SQLite : hors de la boucle d'événements
+        await loop.run_in_executor(None, _register_client, client_id, username, address_str)
+
+        entry = clients[client_id]
+        connected = True
+        chunk = rest
+        while connected:
+            # Instant de réception des trames de ce bloc (lnm_recv_to_emit_seconds, traces)
+            received_at = entry['received_at'] = time.monotonic()
+            metrics.BYTES_RECEIVED.inc(len(chunk))
+            decoded = frames.feed(chunk)
+            decoded_at = time.monotonic()
+            for ftype, value in decoded:
+                trace = tracing.TRACER.begin('handle_client', received_at, decoded_at,
+                                             client_id=client_id, frame=ftype)
+                if ftype in BLOCKING_FRAME_TYPES:
+                    # Décodage, écriture disque et SQLite hors de la boucle d'événements
+                    connected = await loop.run_in_executor(
+                        None, _handle_frame, client_id, address_str, ftype, value, trace
+                    )
+                else:
+                    connected = _handle_frame(client_id, address_str, ftype, value, trace)
+                if not connected:
+                    break
+            if not connected:
+                break
+            chunk = await reader.read(frames.recv_size)
+            if not chunk:
+                break
+
+    except Exception as e:
+        print(f"[ERREUR] {username}: {e}")
+
+    finally:
+        username = clients.get(client_id, {}).get('username', username)
+        # Sauvegarde des transferts interrompus (SQLite) hors de la boucle d'événements
+        await loop.run_in_executor(None, _unregister_client, client_id, username, address_str)
+
 
 def start_tcp_server():
-    """Démarre le serveur TCP dans un thread séparé"""
+    """Démarre le serveur TCP dans un thread séparé (un thread par client)"""
     global client_counter
-    
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind((HOST, PORT))
     server.listen()
-    
+
     print(f"[DÉMARRAGE] Serveur TCP en écoute sur {HOST}:{PORT}")
-    
+
     try:
         while True:
             client_socket, client_address = server.accept()
-            
+
             client_counter += 1
             client_id = client_counter
-            
-            clients[client_id] = {
-                'socket': client_socket,
-                'address': f"{client_address[0]}:{client_address[1]}",
-                'username': f"Client_{client_id}",
-                'status': 'Disponible',
-                'avatar': '🙂',
-                'messages': []
-            }
-            
+
+            clients[client_id] = _new_client_entry(
+                SocketConnection(client_socket),
+                f"{client_address[0]}:{client_address[1]}",
+                client_id
+            )
+
             thread = threading.Thread(
-                target=handle_client, 
+                target=handle_client,
                 args=(client_socket, client_address, client_id)
             )
             thread.daemon = True
             thread.start()
-            
+
             print(f"[CONNEXIONS ACTIVES] {len(clients)}")
-    
+
     except Exception as e:
         print(f"[ERREUR SERVEUR] {e}")
-    
+
     finally:
         server.close()
 
+
+def start_tcp_server_async():
+    """Démarre le serveur TCP sur une boucle asyncio unique (toutes les connexions)"""
+
+    async def serve():
+        server = await asyncio.start_server(handle_client_async, HOST, PORT, reuse_address=True)
+        print(f"[DÉMARRAGE] Serveur TCP (asyncio) en écoute sur {HOST}:{PORT}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except Exception as e:
+        print(f"[ERREUR SERVEUR] {e}")
+
 @app.route('/')
 def index():
     """Page d'accueil - Interface du serveur"""
@@ -298,10 +662,10 @@ def set_server_username():
         print(f'[SERVEUR] Nom d\'utilisateur défini: {server_username}')
         # Notifier tous les clients TCP
         for cid, cdata in list(clients.items()):
-            sock = cdata.get('socket')
+            conn = cdata.get('conn')
             try:
-                if sock:
-                    sock.send(f"__SERVER_NAME__:{server_username}\n".encode('utf-8'))
+                if conn:
+                    conn.send_frame(protocol.SERVER_NAME, server_username)
             except Exception as e:
                 print(f"[AVERTISSEMENT] Impossible d'envoyer le nouveau nom au client {cid}: {e}")
         # Notifier l'UI web
@@ -323,10 +687,10 @@ def set_server_status():
         print(f'[SERVEUR] Statut défini: {server_status}')
         # Notifier tous les clients TCP
         for cid, cdata in list(clients.items()):
-            sock = cdata.get('socket')
+            conn = cdata.get('conn')
             try:
-                if sock:
-                    sock.send(f"__SERVER_STATUS__:{server_status}\n".encode('utf-8'))
+                if conn:
+                    conn.send_frame(protocol.SERVER_STATUS, server_status)
             except Exception as e:
                 print(f"[AVERTISSEMENT] Impossible d'envoyer le nouveau statut au client {cid}: {e}")
         # Notifier l'UI web
@@ -344,19 +708,26 @@ def set_server_avatar():
     avatar = data.get('avatar', '').strip()
     
     if avatar:
+        # Image (data URL) : stockée une fois, les clients v2 ne reçoivent que son hash
+        try:
+            avatar = avatar_store.to_ref(avatar)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         server_avatar = avatar
         print(f'[SERVEUR] Avatar défini')
         # Notifier tous les clients TCP
+        frame = protocol.SharedFrame(protocol.SERVER_AVATAR, avatar,
+                                     legacy_value=lambda: avatar_store.to_legacy(avatar))
         for cid, cdata in list(clients.items()):
-            sock = cdata.get('socket')
+            conn = cdata.get('conn')
             try:
-                if sock:
-                    sock.send(f"__SERVER_AVATAR__:{avatar}\n".encode('utf-8'))
+                if conn:
+                    conn.send_shared(frame)
             except Exception as e:
                 print(f"[AVERTISSEMENT] Impossible d'envoyer le nouvel avatar au client {cid}: {e}")
         # Notifier l'UI web
-        socketio.emit('server_avatar_updated', {'avatar': avatar})
-        return jsonify({'success': True})
+        socketio.emit('server_avatar_updated', {'avatar': avatar_url(avatar)})
+        return jsonify({'success': True, 'avatar': avatar_url(avatar)})
     else:
         return jsonify({'success': False, 'error': 'Avatar invalide'}), 400
 
@@ -364,6 +735,8 @@ def set_server_avatar():
 def handle_connect():
     """Client web connecté"""
     print('[WEB] Client web connecté')
+    metrics.WEB_CLIENTS.inc()
+    join_room(PRESENCE_ROOM)
     emit('clients_update', {
         'clients': [
             {
@@ -371,45 +744,157 @@ def handle_connect():
                 'address': cdata['address'],
                 'username': cdata.get('username', 'Anonyme'),
                 'status': cdata.get('status', 'Disponible'),
-                'avatar': cdata.get('avatar', '🙂')
+                'avatar': avatar_url(cdata.get('avatar', '🙂'))
             }
             for cid, cdata in clients.items()
         ]
     })
+    # Compteurs de non-lus persistés : badges sans relire l'historique
+    emit('unread_summary', {'conversations': db.get_unread_summary()})
+    emit('groups_update', {'groups': _groups_payload()})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Client web déconnecté"""
     print('[WEB] Client web déconnecté')
+    metrics.WEB_CLIENTS.dec()
+    ui_subscriptions.pop(request.sid, None)
+
+@socketio.on('subscribe_conversation')
+def handle_subscribe_conversation(data):
+    """
+    Suivre la conversation affichée par l'UI (quitte la précédente)
+
+    data: {client_id} ; None pour ne plus suivre aucune conversation.
+    """
+    client_id = data.get('client_id')
+    previous = ui_subscriptions.pop(request.sid, None)
+    if previous is not None:
+        leave_room(conversation_room(previous))
+    if client_id is not None:
+        join_room(conversation_room(client_id))
+        ui_subscriptions[request.sid] = client_id
 
 @socketio.on('get_client_messages')
 def handle_get_client_messages(data):
-    """Récupérer l'historique des messages d'un client"""
+    """
+    Récupérer une page de l'historique d'un client depuis SQLite
+
+    data: {client_id, before_id (optionnel, ID du plus ancien message déjà
+    affiché), before_timestamp (son timestamp ISO), limit (optionnel)} ; la
+    réponse `client_messages` indique `has_more` s'il reste des messages plus
+    anciens. Les diffusions reçues par le client dans l'intervalle de la page
+    y sont intercalées (sans ID).
+    """
     client_id = data.get('client_id')
+    before_id = data.get('before_id')
+    before_timestamp = data.get('before_timestamp')
+    try:
+        limit = min(max(int(data.get('limit') or HISTORY_PAGE_SIZE), 1), HISTORY_PAGE_MAX)
+        before_id = int(before_id) if before_id is not None else None
+        before_timestamp = str(before_timestamp) if before_timestamp is not None else None
+    except (TypeError, ValueError):
+        emit('error', {'message': 'Pagination invalide'})
+        return
     
-    # Chercher d'abord en mémoire (client actif)
-    if client_id in clients:
-        messages = clients[client_id]['messages']
+    # Conversation encore en mémoire (client connecté ou parti récemment)
+    client = clients.get(client_id)
+    buffer = client['messages'] if client else recent_conversations.get(client_id)
+    page = buffer.page(before_id, limit) if buffer is not None else None
+    if page is not None:
+        messages, has_more = page
     else:
-        # Chercher dans SQLite (client déconnecté)
-        messages = db.get_messages(client_id)
+        # Une ligne de plus que demandé pour savoir s'il reste une page
+        messages = db.get_messages(client_id, before_id=before_id, limit=limit + 1)
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[1:]
+    if isinstance(client_id, int):
+        messages = _with_broadcasts(client_id, messages, has_more, before_timestamp)
     
     emit('client_messages', {
         'client_id': client_id,
-        'messages': messages
+        'before_id': before_id,
+        'messages': messages,
+        'has_more': has_more
+    })
+
+def _with_broadcasts(client_id, messages, has_more, before_timestamp):
+    """
+    Intercale dans une page d'historique les diffusions reçues par le client
+
+    La page couvre [timestamp de son premier message, before_timestamp) ;
+    la dernière page (has_more faux) remonte jusqu'au début.
+    """
+    after = messages[0]['timestamp'] if has_more and messages else None
+    rows = db.get_broadcasts(client_id, after=after, before=before_timestamp)
+    if not rows:
+        return messages
+    for row in rows:
+        if row['filename']:
+            text = f"[Fichier] {row['filename']} ({round(row['size'] / 1024)} Ko)"
+        else:
+            text = row['message']
+        messages.append({
+            'id': None,
+            'type': 'sent',
+            'sender': row['sender'],
+            'message': f"📢 {text}",
+            'timestamp': row['timestamp'],
+            'read': 1,
+            'broadcast_id': row['id']
+        })
+    messages.sort(key=lambda message: message['timestamp'])
+    return messages
+
+@socketio.on('search_messages')
+def handle_search_messages(data):
+    """
+    Recherche plein texte dans l'historique
+
+    data: {query, client_id (optionnel, limite à une conversation), cursor
+    (optionnel, `next_cursor` de la page précédente), limit (optionnel)} ;
+    la réponse `search_results` reprend query et client_id pour que l'UI
+    ignore les réponses à une saisie déjà remplacée.
+    """
+    query = (data.get('query') or '').strip()
+    client_id = data.get('client_id')
+    try:
+        limit = min(max(int(data.get('limit') or SEARCH_PAGE_SIZE), 1), HISTORY_PAGE_MAX)
+        cursor = str(data['cursor']) if data.get('cursor') is not None else None
+        client_id = int(client_id) if client_id is not None else None
+        page = db.search(query, client_id=client_id, limit=limit, cursor=cursor)
+    except (TypeError, ValueError):
+        emit('error', {'message': 'Recherche invalide'})
+        return
+    except RuntimeError as e:
+        print(f"[ERREUR] Recherche '{query}': {e}")
+        emit('error', {'message': 'Recherche indisponible'})
+        return
+    
+    emit('search_results', {
+        'query': query,
+        'client_id': client_id,
+        'cursor': cursor,
+        **page
     })
 
 @socketio.on('mark_messages_read')
 def handle_mark_messages_read(data):
-    """Marquer les messages d'un client comme lus"""
+    """Marquer les messages d'un client comme lus (en mémoire et dans SQLite)"""
     client_id = data.get('client_id')
+    if client_id is None:
+        return
     
-    if client_id in clients:
-        for msg in clients[client_id]['messages']:
-            if msg['type'] == 'received' and not msg.get('read', False):
-                msg['read'] = True
-        
-        emit('messages_marked_read', {'client_id': client_id}, broadcast=True)
+    client = clients.get(client_id)
+    buffer = client['messages'] if client else recent_conversations.get(client_id)
+    if buffer is not None:
+        buffer.mark_read()
+    if client:
+        client['unread'] = 0
+    db.mark_messages_read(client_id)
+    
+    emit('messages_marked_read', {'client_id': client_id}, to=PRESENCE_ROOM)
 
 @socketio.on('connect_to_server')
 def handle_client_connect_to_server(data):
@@ -463,28 +948,23 @@ def handle_send_message(data):
         emit('error', {'message': 'Client non trouvé'})
         return
     
-    client_socket = clients[client_id]['socket']
+    conn = clients[client_id]['conn']
     
     try:
-        client_socket.send((message + "\n").encode('utf-8'))
+        conn.send_frame(protocol.TEXT, message)
         
         timestamp = datetime.now().isoformat()
-        clients[client_id]['messages'].append({
-            'type': 'sent',
-            'sender': 'Serveur',
-            'message': message,
-            'timestamp': timestamp,
-            'read': False
-        })
         
         # Sauvegarder dans SQLite
-        db.save_message(client_id, 'sent', 'Serveur', message, timestamp)
+        message_id = db.save_message(client_id, 'sent', 'Serveur', message, timestamp)
         db.increment_message_count(client_id)
+        clients[client_id]['messages'].append(message_id, 'sent', 'Serveur', message, timestamp)
         
+        # Toutes les UI qui affichent cette conversation, dont l'expéditrice
         emit('message_sent', {
             'client_id': client_id,
             'message': message
-        })
+        }, to=conversation_room(client_id))
         
         if message.lower().strip() in EXIT_KEYWORDS:
             print(f"[DÉCONNEXION] Terminaison de la conversation avec client {client_id}")
@@ -494,77 +974,432 @@ def handle_send_message(data):
         emit('error', {'message': 'Erreur lors de l\'envoi du message'})
 
 
-@app.route('/files/server/<path:subpath>')
-def serve_server_files(subpath):
-    root = str(SERVER_FILES_DIR)
-    return send_from_directory(root, subpath, as_attachment=True)
+def _groups_payload():
+    return [{'name': name, 'client_ids': sorted(members)} for name, members in sorted(groups.items())]
 
+def _broadcast_recipients(target):
+    """
+    Clients connectés visés par une diffusion
 
-@socketio.on('send_file')
-def handle_send_file(data):
-    """Envoi d'un fichier à un client spécifique depuis l'UI serveur."""
-    client_id = data.get('client_id')
-    filename = os.path.basename(data.get('filename', ''))
-    mimetype = data.get('mimetype', 'application/octet-stream')
-    b64 = data.get('data_base64', '')
+    Args:
+        target: 'all' ou 'group:<nom>'
 
-    if client_id not in clients:
-        emit('error', {'message': 'Client non trouvé'})
+    Returns:
+        Liste de client_id, ou None si la cible est inconnue
+    """
+    if target == 'all':
+        return list(clients)
+    if isinstance(target, str) and target.startswith('group:'):
+        members = groups.get(target[len('group:'):])
+        if members is not None:
+            return [client_id for client_id in list(clients) if client_id in members]
+    return None
+
+@socketio.on('set_group')
+def handle_set_group(data):
+    """
+    Créer, modifier ou supprimer un groupe de diffusion
+
+    data: {name, client_ids} ; une liste vide supprime le groupe.
+    """
+    name = (data.get('name') or '').strip()
+    if not name or len(name) > GROUP_NAME_MAX:
+        emit('error', {'message': f'Nom de groupe invalide (1 à {GROUP_NAME_MAX} caractères)'})
         return
-    if not filename or not b64:
-        emit('error', {'message': 'Fichier invalide.'})
+    try:
+        members = {int(client_id) for client_id in data.get('client_ids') or []}
+    except (TypeError, ValueError):
+        emit('error', {'message': 'Membres du groupe invalides'})
         return
+    
+    if members:
+        groups[name] = members
+    else:
+        groups.pop(name, None)
+    emit('groups_update', {'groups': _groups_payload()}, broadcast=True)
 
+@socketio.on('broadcast_message')
+def handle_broadcast_message(data):
+    """
+    Envoyer un message à tous les clients ou à un groupe
+
+    La trame est encodée une fois par version de protocole et les mêmes
+    octets partent dans la file de chaque destinataire ; la diffusion est
+    enregistrée en une transaction (une ligne plus ses destinataires).
+
+    data: {target ('all' ou 'group:<nom>'), message}
+    """
+    target = data.get('target', 'all')
+    message = (data.get('message') or '').strip()
+    
+    if not message:
+        emit('error', {'message': 'Le message ne peut pas être vide'})
+        return
+    
+    if len(message) > 5000:
+        emit('error', {'message': 'Message trop long (maximum 5000 caractères)'})
+        return
+    
+    recipients = _broadcast_recipients(target)
+    if recipients is None:
+        emit('error', {'message': 'Groupe de diffusion inconnu'})
+        return
+    if not recipients:
+        emit('error', {'message': 'Aucun destinataire connecté'})
+        return
+    
+    frame = protocol.SharedFrame(protocol.TEXT, message)
+    delivered = []
+    for client_id in recipients:
+        client = clients.get(client_id)
+        if client is None:
+            continue
+        try:
+            client['conn'].send_shared(frame)
+            delivered.append(client_id)
+        except ConnectionError as e:
+            print(f"[AVERTISSEMENT] Diffusion vers client {client_id} impossible: {e}")
+    
+    timestamp = datetime.now().isoformat()
+    broadcast_id = db.save_broadcast(target, 'Serveur', timestamp, delivered, message=message)
+    print(f"[SERVEUR] Diffusion {broadcast_id} ({target}) vers {len(delivered)} client(s)")
+    
+    emit('broadcast_sent', {
+        'broadcast_id': broadcast_id,
+        'target': target,
+        'message': message,
+        'recipients': delivered,
+        'timestamp': timestamp
+    })
+
+
+@app.route('/files/server/<path:subpath>')
+def serve_server_files(subpath):
+    """Fichiers stockés avant le BlobStore (uploads/server/received|sent)"""
+    return send_stored_file(db, str(SERVER_FILES_DIR), subpath)
+
+
+@app.route('/blobs/<sha256>/<path:filename>')
+def serve_blob(sha256, filename):
+    return send_blob(blob_store, sha256, filename)
+
+
+@app.route('/avatars/<sha256>')
+def serve_avatar(sha256):
+    return send_avatar(avatar_store, sha256)
+
+
+@app.route('/connections')
+def connections_status():
+    """Files sortantes des clients connectés (octets en attente, pairs lents)"""
+    return jsonify([
+        {'client_id': client_id, 'username': client['username'], 'address': client['address'],
+         **client['conn'].stats()}
+        for client_id, client in list(clients.items())
+    ])
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métriques au format texte Prometheus (voir metrics.py)"""
+    return Response(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _outbound_queued_bytes():
+    return sum(client['conn'].stats()['queued_bytes'] or 0 for client in list(clients.values()))
+
+
+# Jauges lues à chaque requête /metrics
+metrics.TCP_CONNECTIONS.set_function(lambda: len(clients))
+metrics.OUTBOUND_QUEUED_BYTES.set_function(_outbound_queued_bytes)
+metrics.DB_WRITE_QUEUE.set_function(db.pending_writes)
+metrics.UI_PENDING_EVENTS.set_function(ui.pending_count)
+
+
+@app.route('/debug/trace', methods=['GET', 'POST'])
+def debug_trace():
+    """
+    Traces des trames les plus lentes (GET) ; POST {"enabled": true|false}
+    active ou coupe le traçage sans redémarrer (voir tracing.py)
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        tracing.TRACER.set_enabled(bool(data.get('enabled')))
+        print(f"[INFO] Traçage {'activé' if tracing.TRACER.enabled else 'désactivé'}")
+    return jsonify({'success': True, 'enabled': tracing.TRACER.enabled, 'traces': tracing.TRACER.slowest()})
+
+
+@app.route('/debug/profile')
+def debug_profile():
+    """
+    Profil par échantillonnage de tous les threads, en piles repliées (flamegraph)
+
+    Paramètres: `seconds` (durée, défaut 10), `interval` (ms entre deux échantillons, défaut 5)
+    """
     try:
-        print(f"[SERVEUR] Envoi de fichier vers client {client_id}: {filename} ({mimetype})")
-        raw = base64.b64decode(b64.encode('utf-8'))
-        if len(raw) > 2 * 1024 * 1024:
-            emit('error', {'message': 'Fichier trop volumineux (max 2 Mo).'})
-            return
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', tracing.PROFILE_INTERVAL * 1000)) / 1000
+        if seconds <= 0 or interval <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètres de profil invalides'}), 400
+    try:
+        stacks = tracing.profile(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return Response(stacks, mimetype='text/plain')
+
+
+@app.route('/export')
+def export_history():
+    """
+    Téléchargement de l'historique en NDJSON, produit en flux
+
+    Paramètres: `clients` (IDs séparés par des virgules, défaut: tous),
+    `compression` ('none', 'gzip' ou 'zstd', défaut: gzip)
+    """
+    compression = request.args.get('compression', 'gzip')
+    try:
+        client_ids = request.args.get('clients')
+        if client_ids:
+            client_ids = [int(client_id) for client_id in client_ids.split(',')]
+        else:
+            client_ids = None
+        chunks = export.iter_export(db, client_ids, compression)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètres d\'export invalides'}), 400
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    filename = f"localnetmessage-{datetime.now().strftime('%Y%m%d-%H%M%S')}{export.EXTENSIONS[compression]}"
+    return Response(chunks, mimetype=export.MIMETYPES[compression],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+def _deliver_file(client_id, save_path, filename, mimetype, sha256, sid=None, transfer_id=None):
+    """
+    Transmet au client TCP un blob du store (thread d'arrière-plan)
 
-        client_dir = SERVER_SENT_DIR / str(client_id)
-        os.makedirs(client_dir, exist_ok=True)
-        save_path = client_dir / filename
-        with open(save_path, 'wb') as f:
-            f.write(raw)
+    Les pairs v2 reçoivent le fichier en flux (FILE_BEGIN/CHUNK/END), sauf
+    s'ils ont déjà ce contenu ; les pairs v1 en une ligne base64 limitée à
+    LEGACY_FILE_LIMIT.
 
-        line = f"__FILE__|{filename}|{mimetype}|{len(raw)}|{b64}\n"
-        clients[client_id]['socket'].send(line.encode('utf-8'))
+    Args:
+        sha256: hash du blob
+        transfer_id: transfert interrompu à reprendre (voir _resume_transfers)
+    """
+    try:
+        conn = clients[client_id]['conn']
+        if conn.version >= 2:
+            size, sha256 = clients[client_id]['outgoing'].send(
+                conn, save_path, filename, mimetype,
+                peer=_client_username(client_id), transfer_id=transfer_id, sha256=sha256
+            )
+        else:
+            size = os.path.getsize(save_path)
+            if size > LEGACY_FILE_LIMIT:
+                socketio.emit('error', {'message': 'Fichier trop volumineux pour ce client (max 2 Mo).'}, to=sid)
+                return
+            with open(save_path, 'rb') as f:
+                conn.send_frame(protocol.FILE, (filename, mimetype, f.read()))
 
         timestamp = datetime.now().isoformat()
-        clients[client_id]['messages'].append({
-            'type': 'sent',
-            'sender': 'Serveur',
-            'message': f"[FICHIER] {filename} ({len(raw)} o)",
-            'timestamp': timestamp,
-            'read': False
-        })
         
         # Sauvegarder dans SQLite
         db.save_file(
             client_id,
             filename,
             mimetype,
-            len(raw),
+            size,
             'sent',
             'Serveur',
             str(save_path),
-            timestamp
+            timestamp,
+            sha256,
+            blob=sha256
         )
         db.increment_file_count(client_id)
 
-        emit('file_sent', {
+        socketio.emit('file_sent', {
             'client_id': client_id,
             'filename': filename,
             'mimetype': mimetype,
-            'size': len(raw)
-        })
+            'size': size,
+            'url': blob_url(sha256, filename)
+        }, to=sid)
+    except Exception as e:
+        print(f"[ERREUR] Envoi fichier au client {client_id}: {e}")
+        socketio.emit('error', {'message': 'Erreur lors de l\'envoi du fichier'}, to=sid)
+
+
+def _resume_transfers(client_id):
+    """Reprend les envois de fichiers interrompus vers un client reconnecté (même nom)"""
+    for row in db.get_pending_transfers('sent', peer=_client_username(client_id)):
+        if client_id not in clients:
+            return
+        if not os.path.exists(row['file_path']):
+            db.finish_transfer(row['transfer_id'], 'failed')
+            continue
+        print(f"[INFO] Reprise de l'envoi de {row['filename']} vers client {client_id}")
+        _deliver_file(client_id, row['file_path'], row['filename'], row['mimetype'], row['sha256'],
+                      transfer_id=row['transfer_id'])
+
+
+def _deliver_broadcast_file(target, recipients, save_path, filename, mimetype, sha256, size, sid=None):
+    """
+    Diffuse un blob du store à plusieurs clients TCP (thread d'arrière-plan)
+
+    Les pairs v1 partagent une seule trame FILE encodée (LEGACY_FILE_LIMIT) ;
+    les pairs v2 reçoivent chacun un transfert en flux, envoyé par sendfile
+    depuis le même blob. Une seule ligne `broadcasts` est enregistrée.
+    """
+    delivered = []
+    skipped = []
+    legacy_frame = None
+    senders = []
+
+    def stream_to(client_id, client):
+        try:
+            client['outgoing'].send(client['conn'], save_path, filename, mimetype,
+                                    peer=_client_username(client_id), sha256=sha256)
+            delivered.append(client_id)
+        except Exception as e:
+            print(f"[ERREUR] Diffusion fichier au client {client_id}: {e}")
+
+    for client_id in recipients:
+        client = clients.get(client_id)
+        if client is None:
+            continue
+        conn = client['conn']
+        try:
+            if conn.version >= 2:
+                thread = threading.Thread(target=stream_to, args=(client_id, client))
+                thread.daemon = True
+                thread.start()
+                senders.append(thread)
+            elif size > LEGACY_FILE_LIMIT:
+                skipped.append(client_id)
+            else:
+                if legacy_frame is None:
+                    with open(save_path, 'rb') as f:
+                        legacy_frame = protocol.SharedFrame(protocol.FILE, (filename, mimetype, f.read()))
+                conn.send_shared(legacy_frame)
+                delivered.append(client_id)
+        except Exception as e:
+            print(f"[ERREUR] Diffusion fichier au client {client_id}: {e}")
+    for thread in senders:
+        thread.join()
+
+    timestamp = datetime.now().isoformat()
+    broadcast_id = db.save_broadcast(target, 'Serveur', timestamp, delivered,
+                                     file=(filename, mimetype, size, sha256))
+    print(f"[SERVEUR] Diffusion {broadcast_id} ({target}) de {filename} vers {len(delivered)} client(s)")
+    if skipped:
+        socketio.emit('error', {
+            'message': f'{len(skipped)} client(s) ignoré(s) : fichier trop volumineux (max 2 Mo).'
+        }, to=sid)
+
+    socketio.emit('broadcast_sent', {
+        'broadcast_id': broadcast_id,
+        'target': target,
+        'filename': filename,
+        'mimetype': mimetype,
+        'size': size,
+        'url': blob_url(sha256, filename),
+        'recipients': delivered,
+        'timestamp': timestamp
+    }, to=sid)
+
+
+@app.route('/upload/broadcast', methods=['POST'])
+def upload_broadcast_file():
+    """Reçoit un fichier de l'UI serveur en flux et le diffuse (paramètre `target`)"""
+    filename = os.path.basename(unquote(request.headers.get('X-Filename', '')))
+    mimetype = request.mimetype or 'application/octet-stream'
+    target = request.args.get('target', 'all')
+    sid = request.args.get('sid')
+
+    recipients = _broadcast_recipients(target)
+    if recipients is None:
+        return jsonify({'success': False, 'error': 'Groupe de diffusion inconnu'}), 404
+    if not recipients:
+        return jsonify({'success': False, 'error': 'Aucun destinataire connecté'}), 400
+    if not filename:
+        return jsonify({'success': False, 'error': 'Fichier invalide.'}), 400
+
+    print(f"[SERVEUR] Diffusion de fichier ({target}): {filename} ({mimetype})")
+    sha256, size, save_path = blob_store.add_stream(request.stream.read)
+
+    thread = threading.Thread(
+        target=_deliver_broadcast_file,
+        args=(target, recipients, save_path, filename, mimetype, sha256, size, sid)
+    )
+    thread.daemon = True
+    thread.start()
+    return jsonify({'success': True, 'size': size, 'recipients': len(recipients)})
+
+
+@app.route('/upload/<int:client_id>', methods=['POST'])
+def upload_file_to_client(client_id):
+    """Reçoit un fichier de l'UI serveur en flux (corps brut) et le transmet au client"""
+    filename = os.path.basename(unquote(request.headers.get('X-Filename', '')))
+    mimetype = request.mimetype or 'application/octet-stream'
+    sid = request.args.get('sid')
+
+    if client_id not in clients:
+        return jsonify({'success': False, 'error': 'Client non trouvé'}), 404
+    if not filename:
+        return jsonify({'success': False, 'error': 'Fichier invalide.'}), 400
+
+    print(f"[SERVEUR] Envoi de fichier vers client {client_id}: {filename} ({mimetype})")
+    sha256, size, save_path = blob_store.add_stream(request.stream.read)
+
+    thread = threading.Thread(
+        target=_deliver_file,
+        args=(client_id, save_path, filename, mimetype, sha256, sid)
+    )
+    thread.daemon = True
+    thread.start()
+    return jsonify({'success': True, 'size': size})
+
+
+@socketio.on('send_file')
+def handle_send_file(data):
+    """Envoi d'un fichier encodé en base64 à un client spécifique depuis l'UI serveur."""
+    client_id = data.get('client_id')
+    filename = os.path.basename(data.get('filename', ''))
+    mimetype = data.get('mimetype', 'application/octet-stream')
+    b64 = data.get('data_base64', '')
+
+    if client_id not in clients:
+        emit('error', {'message': 'Client non trouvé'})
+        return
+    if not filename or not b64:
+        emit('error', {'message': 'Fichier invalide.'})
+        return
+
+    try:
+        print(f"[SERVEUR] Envoi de fichier vers client {client_id}: {filename} ({mimetype})")
+        raw = base64.b64decode(b64.encode('utf-8'))
+        if len(raw) > 2 * 1024 * 1024:
+            emit('error', {'message': 'Fichier trop volumineux (max 2 Mo).'})
+            return
+
+        sha256, _size, save_path = blob_store.add_bytes(raw)
+        _deliver_file(client_id, save_path, filename, mimetype, sha256, request.sid)
     except Exception as e:
         print(f"[ERREUR] Envoi fichier au client {client_id}: {e}")
         emit('error', {'message': 'Erreur lors de l\'envoi du fichier'})
 
 if __name__ == '__main__':
-    tcp_thread = threading.Thread(target=start_tcp_server)
+    removed = blob_store.collect_garbage()
+    if removed:
+        print(f"[INFO] {removed} pièce(s) jointe(s) orpheline(s) supprimée(s)")
+    # LNM_RETENTION_DAYS=N : archive toutes les heures l'historique de plus de N jours
+    if os.environ.get('LNM_RETENTION_DAYS'):
+        RetentionService(db, int(os.environ['LNM_RETENTION_DAYS'])).start()
+    tcp_target = start_tcp_server_async if TCP_ENGINE == 'asyncio' else start_tcp_server
+    tcp_thread = threading.Thread(target=tcp_target)
     tcp_thread.daemon = True
     tcp_thread.start()
     
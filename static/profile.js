@@ -60,7 +60,7 @@
   function updateProfileButtonDisplay(avatar) {
     const btn = document.getElementById('profile-btn');
     if (!btn) return;
-    if (avatar && (avatar.startsWith('http://') || avatar.startsWith('https://') || avatar.startsWith('data:image/'))) {
+    if (avatar && (avatar.startsWith('http://') || avatar.startsWith('https://') || avatar.startsWith('data:image/') || avatar.startsWith('/avatars/'))) {
       btn.innerHTML = `<img src="${avatar}" alt="profile" style="width:100%;height:100%;object-fit:cover;border-radius:50%;"/>`;
     } else if (avatar && avatar.length <= 4 && /\p{Emoji}/u.test(avatar)) {
       btn.textContent = avatar;
@@ -153,7 +153,7 @@
       content.querySelector('#profile-theme').value = p.theme || THEMES[0];
       content.querySelector('#profile-encryption').checked = !!p.encryptionDefault;
       const prev = content.querySelector('#profile-avatar-preview');
-      if (p.avatar && (/^https?:\/\//.test(p.avatar) || p.avatar.startsWith('data:image/'))) {
+      if (p.avatar && (/^https?:\/\//.test(p.avatar) || p.avatar.startsWith('data:image/') || p.avatar.startsWith('/avatars/'))) {
         prev.innerHTML = `<img src="${p.avatar}" alt="avatar"/>`;
       } else {
         prev.textContent = p.avatar || '🙂';
@@ -163,7 +163,7 @@
     content.querySelector('#profile-avatar').addEventListener('input', (e)=>{
       const v = e.target.value.trim();
       const prev = content.querySelector('#profile-avatar-preview');
-      if ((/^https?:\/\//.test(v)) || v.startsWith('data:image/')) { prev.innerHTML = `<img src="${v}" alt="avatar"/>`; }
+      if ((/^https?:\/\//.test(v)) || v.startsWith('data:image/') || v.startsWith('/avatars/')) { prev.innerHTML = `<img src="${v}" alt="avatar"/>`; }
       else { prev.textContent = v || '🙂'; }
     });
 
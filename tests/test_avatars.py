@@ -0,0 +1,70 @@
+"""Avatars demandés aux pairs (AVATAR_WANT) : une demande en attente par connexion"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+from avatars import REF_PREFIX, AvatarStore
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'avatar' * 10
+IMAGE_REF = REF_PREFIX + hashlib.sha256(IMAGE).hexdigest()
+
+
+class FakeConnection:
+
+    version = 2
+
+    def __init__(self):
+        self.frames = []
+
+    def send_frame(self, ftype, value):
+        self.frames.append((ftype, value))
+
+
+def avatar_payload(data):
+    return b'image/png\0' + data
+
+
+class PendingAvatarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = AvatarStore(self.dir)
+        self.applied = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pending_requests_are_bounded(self):
+        conn = FakeConnection()
+        for index in range(100):
+            self.store.resolve(REF_PREFIX + f"{index:064x}", conn, self.applied.append)
+        self.store.resolve(IMAGE_REF, conn, self.applied.append)
+        self.assertEqual(len(self.store._wanted), 1)
+        self.store.receive(avatar_payload(IMAGE), conn)
+        self.assertEqual(self.applied, [IMAGE_REF])
+
+    def test_avatar_from_another_peer_is_ignored(self):
+        asking, other = FakeConnection(), FakeConnection()
+        self.store.resolve(IMAGE_REF, asking, self.applied.append)
+        self.assertEqual(asking.frames, [(protocol.AVATAR_WANT, IMAGE_REF[len(REF_PREFIX):])])
+        self.assertIsNone(self.store.receive(avatar_payload(IMAGE), other))
+        self.assertEqual(self.applied, [])
+
+    def test_forget_on_disconnect(self):
+        conn = FakeConnection()
+        self.store.resolve(IMAGE_REF, conn, self.applied.append)
+        self.store.forget(conn)
+        self.assertIsNone(self.store.receive(avatar_payload(IMAGE), conn))
+        self.assertEqual(self.store._wanted, {})
+        self.assertEqual(self.applied, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Historique réparti entre la base courante et les archives mensuelles (retention.py)"""
+
+import os
+import random
+import shutil
+import sys
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import export
+from database import Database
+
+
+class ArchivedHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.dir, 'messages.db'), archive_dir=os.path.join(self.dir, 'archives'))
+        self.db.update_client_history(1, 'bob', '127.0.0.1:5000')
+        # ID croissants, horodatages mélangés sur trois mois (import --new-ids)
+        stamps = [f"2026-0{month}-{day:02d}T10:00:{second:02d}"
+                  for month in (6, 7, 8) for day in range(1, 21) for second in (0, 1)]
+        random.Random(1).shuffle(stamps)
+        for index, timestamp in enumerate(stamps):
+            self.db.save_message(1, 'received', 'bob', f"message {index}", timestamp)
+        while self.db.archive_batch('2026-08-11', batch_size=7):
+            pass
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_pages_cover_archives(self):
+        self.assertEqual(len(self.db.archives()), 3)
+        self.assertEqual(len(self.db.get_messages(1, limit=None)), 120)
+        seen = []
+        before_id = None
+        while True:
+            page = self.db.get_messages(1, before_id=before_id, limit=10)
+            if not page:
+                break
+            seen += [row['id'] for row in page]
+            before_id = page[0]['id']
+        self.assertEqual(sorted(seen), sorted(set(seen)))
+        self.assertEqual(len(seen), 120)
+
+    def test_unread_count_survives_archiving(self):
+        self.assertEqual(self.db.get_client_history(1)['unread_count'], 120)
+        self.db.mark_messages_read(1)
+        self.assertEqual(self.db.get_client_history(1)['unread_count'], 0)
+        self.assertFalse([row for row in self.db.get_messages(1, limit=None) if not row['read']])
+        self.assertEqual(self.db.get_unread_summary(), [])
+
+    def test_unread_count_kept_when_archive_fails(self):
+        missing = SimpleNamespace(db_path=os.path.join(self.dir, 'absent', 'archive.db'))
+        with mock.patch.object(self.db, 'archives', return_value=[missing]):
+            with self.assertRaises(sqlite3.Error):
+                self.db.mark_messages_read(1)
+        self.assertEqual(self.db.get_client_history(1)['unread_count'], 120)
+        self.db.mark_messages_read(1)
+        self.assertEqual(self.db.get_client_history(1)['unread_count'], 0)
+
+
+class BroadcastImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.dir, 'messages.db'))
+        for client_id, username in ((1, 'bob'), (2, 'alice')):
+            self.db.update_client_history(client_id, username, '127.0.0.1:5000')
+        self.db.save_message(1, 'received', 'bob', "bonjour", '2026-08-01T10:00:00')
+        self.db.save_broadcast('all', 'Serveur', '2026-08-01T10:00:01', [1, 2], message="à tous")
+        self.db.save_broadcast('group:dev', 'Serveur', '2026-08-01T10:00:02', [2],
+                               file=('notes.txt', 'text/plain', 12, None))
+        self.db.increment_message_count(1)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def counters(self, db):
+        return [(row['message_count'], row['file_count'])
+                for row in (db.get_client_history(1), db.get_client_history(2))]
+
+    def test_recount_keeps_broadcasts(self):
+        self.db.bulk_import([])
+        self.assertEqual(self.counters(self.db), [(2, 0), (1, 1)])
+
+    def test_export_round_trip(self):
+        for keep_ids in (True, False):
+            copy = Database(os.path.join(self.dir, f'copy-{keep_ids}.db'))
+            try:
+                counts = copy.bulk_import(export.iter_records(self.db), keep_ids=keep_ids)
+                self.assertEqual((counts['broadcasts'], counts['recipients']), (2, 3))
+                self.assertEqual(self.counters(copy), [(2, 0), (1, 1)])
+                self.assertEqual([row['message'] for row in copy.get_broadcasts(1)], ["à tous"])
+                self.assertEqual([row['filename'] for row in copy.get_broadcasts(2)], [None, 'notes.txt'])
+            finally:
+                copy.close()
+
+    def test_export_client_broadcasts(self):
+        kinds = [record['kind'] for record in export.iter_records(self.db, client_ids=[1])]
+        self.assertEqual(kinds.count('broadcast'), 1)
+        self.assertEqual(kinds.count('broadcast_recipient'), 1)
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'messages.db')
+        Database(self.path).save_message(1, 'received', 'bob', "avant", '2026-08-01T10:00:00')
+        self.db = Database(self.path, write_behind=True)
+        self.db.update_client_history(1, 'bob', '127.0.0.1:5000')
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_queued_messages_get_ids(self):
+        ids = [self.db.save_message(1, 'received', 'bob', f"message {index}", '2026-08-01T10:00:01')
+               for index in range(5)]
+        self.assertEqual(ids, list(range(2, 7)))
+        self.db.flush()
+        self.assertEqual([row['id'] for row in self.db.get_messages(1)], [1] + ids)
+
+    def test_reads_do_not_wait_for_writer(self):
+        self.db.save_message(1, 'received', 'bob', "en file", '2026-08-01T10:00:01')
+        with mock.patch.object(self.db, 'flush', side_effect=AssertionError("lecture bloquée")):
+            self.db.get_messages(1)
+            self.db.get_unread_summary()
+
+    def test_mark_read_sees_queued_messages(self):
+        self.db.save_message(1, 'received', 'bob', "en file", '2026-08-01T10:00:01')
+        self.db.mark_messages_read(1)
+        self.assertEqual([row['read'] for row in self.db.get_messages(1)], [1, 1])
+        self.assertEqual(self.db.get_client_history(1)['unread_count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
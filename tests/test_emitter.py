@@ -0,0 +1,88 @@
+"""Regroupement des événements vers l'UI : ordre d'émission, emit hors du verrou"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from emitter import BATCH_EVENT, EmitCoalescer
+
+
+class FakeSocketIO:
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.sent = []
+        self.done = threading.Event()
+
+    def emit(self, event, data, to=None):
+        time.sleep(self.delay)
+        self.sent.append((event, data, to))
+        self.done.set()
+
+
+def wait_idle(ui, socketio):
+    deadline = time.monotonic() + 5
+    while (ui.pending_count() or not socketio.done.is_set()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+
+def received_order(sent):
+    """Événements (nom, données, cible) dans l'ordre vu par le navigateur, lots dépliés"""
+    order = []
+    for event, data, to in sent:
+        if event == BATCH_EVENT:
+            order.extend((name, value, to) for name, value in data['events'])
+        else:
+            order.append((event, data, to))
+    return order
+
+
+class EmitCoalescerTest(unittest.TestCase):
+
+    def test_rooms_keep_emission_order(self):
+        socketio = FakeSocketIO()
+        ui = EmitCoalescer(socketio, window=0.2)
+        ui.emit('client_status_changed', {'n': 0}, to='presence')
+        expected = [('client_status_changed', {'n': 0}, 'presence')]
+        for n in range(1, 7):
+            to = 'presence' if n % 3 == 0 else 'conversation:1'
+            ui.emit('new_message', {'n': n}, to=to)
+            expected.append(('new_message', {'n': n}, to))
+        wait_idle(ui, socketio)
+        self.assertEqual(received_order(socketio.sent), expected)
+        # Les événements consécutifs vers une même room partent en un lot
+        self.assertIn(BATCH_EVENT, [event for event, _data, _to in socketio.sent])
+
+    def test_replaced_update_sent_once(self):
+        socketio = FakeSocketIO()
+        ui = EmitCoalescer(socketio, window=0.2)
+        ui.emit('new_message', {'n': 0}, to='presence')
+        for status in ('away', 'busy', 'online'):
+            ui.emit('client_status_changed', {'status': status}, to='presence',
+                    key=('client_status_changed', 1))
+        wait_idle(ui, socketio)
+        statuses = [data for event, data, _to in received_order(socketio.sent)
+                    if event == 'client_status_changed']
+        self.assertEqual(statuses, [{'status': 'online'}])
+
+    def test_slow_emit_does_not_block_callers(self):
+        socketio = FakeSocketIO(delay=0.3)
+        ui = EmitCoalescer(socketio, window=0)
+        ui.emit('new_message', {'n': 0})
+        while ui.pending_count():
+            time.sleep(0.001)
+        # Le thread `ui-emit` est dans socketio.emit : l'appelant n'attend pas
+        start = time.monotonic()
+        ui.emit('new_message', {'n': 1})
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(socketio.sent, [])
+        wait_idle(ui, socketio)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Trames COMPRESSED : décompression bornée (protection contre les bombes de décompression)"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+
+
+def compressed_text(codec, text):
+    """Trame TEXT enveloppée dans une trame COMPRESSED par un FrameCompressor neuf"""
+    return protocol.FrameCompressor(codec, min_size=0).wrap(protocol.TEXT, protocol.encode(protocol.TEXT, text, 2))
+
+
+class CompressedFrameTest(unittest.TestCase):
+
+    def check_codec(self, codec):
+        compressor = protocol.FrameCompressor(codec, min_size=0)
+        decoder = protocol.FrameDecoder()
+        for text in ("première trame " * 40, "deuxième trame " * 40):
+            frame = compressor.wrap(protocol.TEXT, protocol.encode(protocol.TEXT, text, 2))
+            self.assertEqual(decoder.feed(frame), [(protocol.TEXT, text)])
+
+    def check_oversized(self, codec):
+        with mock.patch.object(protocol, 'MAX_FRAME_SIZE', 4096):
+            frame = compressed_text(codec, 'x' * 100000)
+            self.assertLess(len(frame), 4096)
+            with self.assertRaisesRegex(protocol.ProtocolError, "trop grande"):
+                protocol.FrameDecoder().feed(frame)
+
+    def test_zlib(self):
+        self.check_codec('zlib')
+
+    def test_zlib_oversized(self):
+        self.check_oversized('zlib')
+
+    @unittest.skipUnless(protocol.zstandard, "paquet zstandard absent")
+    def test_zstd(self):
+        self.check_codec('zstd')
+
+    @unittest.skipUnless(protocol.zstandard, "paquet zstandard absent")
+    def test_zstd_oversized(self):
+        self.check_oversized('zstd')
+
+
+if __name__ == '__main__':
+    unittest.main()
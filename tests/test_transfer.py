@@ -0,0 +1,184 @@
+"""Transferts en flux : reprise après coupure, preuve de possession d'un contenu déjà stocké"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import protocol
+import transfer
+from blobstore import BlobStore
+from database import Database
+
+
+def frame_value(frame):
+    """Charge utile JSON d'une trame v2 encodée"""
+    return json.loads(protocol.FrameDecoder().feed(frame)[0][1])
+
+
+class Pipe:
+    """
+    Connexion en mémoire : chaque trame de l'émetteur est traitée tout de
+    suite par le récepteur, et ses réponses par l'émetteur
+    """
+
+    version = 2
+
+    def __init__(self, incoming, outgoing, cut_after=None):
+        """
+        Args:
+            incoming: IncomingTransfers du récepteur
+            outgoing: OutgoingTransfers de l'émetteur
+            cut_after: coupure (ConnectionError) une fois ce nombre d'octets reçus
+        """
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.cut_after = cut_after
+        self.received = 0
+        self.finished = []
+
+    def send(self, data):
+        for ftype, value in protocol.FrameDecoder().feed(data):
+            if ftype == protocol.FILE_BEGIN:
+                _transfer, have = self.incoming.begin(value)
+                self.reply(have)
+            elif ftype == protocol.FILE_CHUNK:
+                self.incoming.chunk(value)
+                self.received += len(value) - transfer.CHUNK_HEADER.size
+            elif ftype == protocol.FILE_END:
+                item, valid, ack = self.incoming.end(value)
+                if item is not None:
+                    self.finished.append(valid)
+                if ack is not None:
+                    self.reply(ack)
+
+    def send_file_chunk(self, header, fileobj, offset, count):
+        if self.cut_after is not None and self.received >= self.cut_after:
+            # Déconnexion : le récepteur note les morceaux reçus pour la reprise
+            self.incoming.suspend_all()
+            raise ConnectionError("Connexion coupée")
+        fileobj.seek(offset)
+        self.send(header + fileobj.read(count))
+
+    def reply(self, frame):
+        for _ftype, value in protocol.FrameDecoder().feed(frame):
+            self.outgoing.on_have(value)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.recv_db = Database(os.path.join(self.dir, 'recv.db'))
+        self.send_db = Database(os.path.join(self.dir, 'send.db'))
+        self.store = BlobStore(os.path.join(self.dir, 'blobs'), self.recv_db)
+        self.size = 4 * 1024 * 1024
+        self.source = os.path.join(self.dir, 'source.bin')
+        with open(self.source, 'wb') as f:
+            f.write(os.urandom(self.size))
+
+    def tearDown(self):
+        self.recv_db.close()
+        self.send_db.close()
+        shutil.rmtree(self.dir)
+
+    def send(self, pipe, transfer_id=None):
+        pipe.outgoing.send(pipe, self.source, 'source.bin', 'application/octet-stream',
+                           peer='test', transfer_id=transfer_id)
+
+    def test_resume_after_cut(self):
+        first = Pipe(transfer.IncomingTransfers(self.store, self.recv_db, peer='test'),
+                     transfer.OutgoingTransfers(self.send_db), cut_after=self.size // 2)
+        with self.assertRaises(ConnectionError):
+            self.send(first)
+        missing = self.size - first.received
+        self.assertGreater(missing, 0)
+
+        pending = self.send_db.get_pending_transfers('sent', peer='test')
+        self.assertEqual(len(pending), 1)
+        transfer_id = pending[0]['transfer_id']
+        second = Pipe(transfer.IncomingTransfers(self.store, self.recv_db, peer='test'),
+                      transfer.OutgoingTransfers(self.send_db))
+        self.send(second, transfer_id)
+
+        self.assertEqual(second.finished, [True])
+        self.assertLess(second.received / missing, 1.10)
+        sha256 = transfer.file_sha256(self.source)
+        self.assertTrue(self.store.has(sha256))
+        self.assertEqual(transfer.file_sha256(self.store.path(sha256)), sha256)
+        self.assertEqual(self.send_db.get_transfer(transfer_id)['status'], 'complete')
+        self.assertEqual(self.recv_db.get_transfer(transfer_id)['status'], 'complete')
+
+
+class PossessionProofTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.dir, 'messages.db'))
+        self.store = BlobStore(os.path.join(self.dir, 'blobs'), self.db)
+        self.data = os.urandom(300 * 1024)
+        self.sha256, _size, self.path = self.store.add_bytes(self.data)
+        self.transfers = transfer.IncomingTransfers(self.store, self.db, peer='mallory')
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def begin(self, size=None, sha256=None):
+        transfer_id = transfer.new_transfer_id()
+        meta = {'id': transfer_id, 'name': 'a.bin', 'mime': 'application/octet-stream',
+                'size': len(self.data) if size is None else size, 'sha256': sha256 or self.sha256}
+        item, have = self.transfers.begin(json.dumps(meta).encode('utf-8'))
+        return transfer_id, item, frame_value(have)
+
+    def end(self, transfer_id, proof):
+        meta = {'id': transfer_id, 'sha256': self.sha256, 'proof': proof}
+        return self.transfers.end(json.dumps(meta).encode('utf-8'))
+
+    def test_hash_alone_is_not_enough(self):
+        transfer_id, item, have = self.begin()
+        self.assertFalse(have.get('complete'))
+        self.assertFalse(item.complete)
+        item, valid, ack = self.end(transfer_id, '0' * 64)
+        self.assertEqual((item, valid), (None, False))
+        # Le fichier est redemandé, comme pour un contenu absent
+        self.assertEqual(frame_value(ack)['ranges'], [])
+        self.assertIn(transfer_id, self.transfers.active)
+        self.assertEqual(self.db.get_transfer(transfer_id)['status'], 'partial')
+
+    def test_challenge_does_not_reveal_store(self):
+        _transfer_id, _item, held = self.begin()
+        _transfer_id, _item, absent = self.begin(sha256='ab' * 32)
+        self.assertEqual(sorted(held), sorted(absent))
+        self.assertEqual(sorted(held['proof']), sorted(absent['proof']))
+
+    def test_valid_proof_records_stored_size(self):
+        transfer_id, _item, have = self.begin()
+        challenge = have['proof']
+        proof = transfer.possession_proof(self.path, challenge['nonce'], challenge['offset'],
+                                          challenge['length'])
+        offset = challenge['offset']
+        expected = hashlib.sha256(bytes.fromhex(challenge['nonce'])
+                                  + self.data[offset:offset + challenge['length']]).hexdigest()
+        self.assertEqual(proof, expected)
+        item, valid, ack = self.end(transfer_id, proof)
+        self.assertTrue(valid)
+        self.assertTrue(frame_value(ack)['complete'])
+        self.assertEqual((item.size, item.sha256), (len(self.data), self.sha256))
+
+    def test_size_mismatch_is_refused(self):
+        transfer_id, _item, have = self.begin(size=len(self.data) - 1)
+        challenge = have['proof']
+        proof = transfer.possession_proof(self.path, challenge['nonce'], challenge['offset'],
+                                          challenge['length'])
+        item, valid, _ack = self.end(transfer_id, proof)
+        self.assertEqual((item, valid), (None, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""
+Traçage du chemin chaud et profileur par échantillonnage (diagnostic de lenteur)
+
+Traces : pour chaque trame reçue (handle_client côté serveur,
+receive_messages côté client_web), les instants de fin de chaque étape
+- `decode`  : découpage du bloc reçu en trames (lignes v1 ou trames v2)
+- `wait`    : attente derrière les trames précédentes du même bloc (ou de l'exécuteur asyncio)
+- étapes des gestionnaires : `file_decode` (base64 en v1), `write`, `db`, `buffer`, `emit`
+- `handler` : reste du gestionnaire
+Le départ est l'arrivée du bloc (après recv) : l'attente du pair n'est pas
+comptée. Seules les TRACE_KEEP traces les plus lentes sont gardées.
+
+Désactivé par défaut (LNM_TRACE=1 ou POST /debug/trace) : un gestionnaire
+ne paie alors qu'un appel de fonction par étape.
+
+Profileur : profile() échantillonne les piles de tous les threads
+(sys._current_frames) pendant quelques secondes et retourne le format
+« piles repliées » de flamegraph.pl / speedscope :
+    thread;module:fonction;module:fonction <nombre d'échantillons>
+"""
+
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Traces les plus lentes gardées en mémoire
+TRACE_KEEP = 50
+
+# Intervalle entre deux échantillons du profileur (secondes)
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+
+
+class Trace:
+    """Étapes horodatées (time.monotonic) du traitement d'une trame"""
+
+    __slots__ = ('name', 'info', 'start', 'stages')
+
+    def __init__(self, name, start, info):
+        self.name = name
+        self.info = info
+        self.start = start
+        self.stages = []
+
+    def mark(self, stage, at=None):
+        """Fin de l'étape `stage` (maintenant, ou à l'instant `at`)"""
+        self.stages.append((stage, time.monotonic() if at is None else at))
+
+    @property
+    def total(self):
+        return self.stages[-1][1] - self.start if self.stages else 0.0
+
+    def to_dict(self):
+        """Durée de chaque étape en millisecondes, dans l'ordre"""
+        stages = []
+        previous = self.start
+        for stage, at in self.stages:
+            stages.append({'stage': stage, 'ms': round((at - previous) * 1000, 3)})
+            previous = at
+        return {'name': self.name, **self.info, 'total_ms': round(self.total * 1000, 3), 'stages': stages}
+
+
+class Tracer:
+    """Traces des trames reçues : actives par thread, les plus lentes conservées"""
+
+    def __init__(self, keep=TRACE_KEEP, enabled=False):
+        """
+        Args:
+            keep: nombre de traces les plus lentes à garder
+            enabled: tracer dès le démarrage
+        """
+        self.keep = keep
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        # Tas (durée, numéro, trace) : la plus rapide des traces gardées en tête
+        self._slowest = []
+        self._sequence = itertools.count()
+
+    def begin(self, name, start, decoded_at=None, **info):
+        """
+        Commence la trace d'une trame
+
+        Args:
+            name: pipeline ('handle_client', 'receive_messages')
+            start: arrivée du bloc qui contient la trame (time.monotonic)
+            decoded_at: fin du découpage du bloc en trames
+            info: champs ajoutés à la trace (client, type de trame...)
+
+        Returns:
+            Trace, ou None si le traçage est désactivé
+        """
+        if not self.enabled:
+            return None
+        trace = Trace(name, start, info)
+        if decoded_at is not None:
+            trace.mark('decode', decoded_at)
+        return trace
+
+    @contextmanager
+    def active(self, trace):
+        """Rend `trace` courante pour le thread pendant le gestionnaire, puis la termine"""
+        trace.mark('wait')
+        previous = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = previous
+            trace.mark('handler')
+            self.end(trace)
+
+    def mark(self, stage):
+        """Fin d'une étape de la trace courante du thread (sans effet hors trace)"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.mark(stage)
+
+    def end(self, trace):
+        entry = (trace.total, next(self._sequence), trace)
+        with self.lock:
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """Traces gardées, de la plus lente à la plus rapide"""
+        with self.lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [trace.to_dict() for _total, _sequence, trace in entries]
+
+    def set_enabled(self, enabled):
+        """Active ou coupe le traçage ; les traces gardées sont effacées"""
+        with self.lock:
+            self.enabled = enabled
+            self._slowest = []
+
+
+TRACER = Tracer(enabled=os.environ.get('LNM_TRACE') == '1')
+mark = TRACER.mark
+
+_profile_lock = threading.Lock()
+
+
+def _collapse(frame):
+    """Pile d'un thread, de la racine à la fonction en cours"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Échantillonne les piles de tous les threads
+
+    Args:
+        seconds: durée d'échantillonnage (PROFILE_MAX_SECONDS au plus)
+        interval: secondes entre deux échantillons
+
+    Returns:
+        Texte au format « piles repliées », une pile par ligne, les plus
+        fréquentes d'abord
+
+    Raises:
+        RuntimeError: un profil est déjà en cours
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Un profil est déjà en cours")
+    try:
+        own = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,561 @@
+"""
+Transfert de fichiers en flux pour LocalNetMessage (protocole v2)
+
+Un transfert est une suite de trames :
+    FILE_BEGIN  {"id", "name", "mime", "size", "sha256"}  (JSON, émetteur)
+    FILE_HAVE   {"id", "ranges": [[offset, longueur]], "proof"?} (JSON, récepteur)
+    FILE_CHUNK  [id: 16 octets][offset: u64][octets bruts] (répété)
+    FILE_END    {"id", "sha256", "proof"?}                 (JSON, émetteur)
+    FILE_HAVE   {"id", "ranges", "complete": true}         (JSON, acquittement)
+L'émetteur lit le fichier sur disque morceau par morceau (socket.sendfile
+quand c'est possible) et le récepteur écrit chaque morceau à son offset :
+la mémoire utilisée ne dépend pas de la taille du fichier.
+
+Reprise : le récepteur note dans SQLite les morceaux écrits (offset, longueur,
+CRC32). Après une coupure, l'émetteur renvoie FILE_BEGIN avec le même
+identifiant ; le récepteur vérifie le CRC des morceaux présents dans le
+fichier `.part` et répond par FILE_HAVE avec les plages valides. Seules les
+plages manquantes sont renvoyées.
+
+Déduplication : les fichiers reçus sont rangés dans un BlobStore. Le
+récepteur ne croit pas l'émetteur sur parole quand le SHA-256 annoncé y est
+déjà (il pourrait sinon sonder le store ou se faire attribuer le fichier
+d'un autre) : le FILE_HAVE d'un nouveau transfert porte toujours un défi
+{"nonce", "offset", "length"}, et l'émetteur répond d'abord par FILE_END
+avec "proof", le SHA-256 du nonce suivi de cette plage du fichier. Preuve
+acceptée : FILE_HAVE complet, aucun morceau envoyé. Contenu absent ou preuve
+fausse : FILE_HAVE vide, et l'émetteur envoie le fichier. Un émetteur qui
+ignore le défi envoie le fichier en entier tout de suite.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import struct
+import threading
+import uuid
+import zlib
+
+import metrics
+import protocol
+
+CHUNK_SIZE = 256 * 1024
+CHUNK_HEADER = struct.Struct('!16sQ')
+
+# Délai d'attente de FILE_HAVE : au-delà, le fichier est envoyé en entier
+HAVE_TIMEOUT = 5.0
+
+# Volume écrit entre deux sauvegardes des morceaux reçus dans SQLite
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# Plage hachée pour prouver la possession d'un contenu déjà stocké chez le récepteur
+PROOF_SIZE = 64 * 1024
+
+# Format produit par new_transfer_id (nom du fichier `.part` côté récepteur)
+_TRANSFER_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_transfer_id():
+    """Identifiant unique d'un transfert (32 caractères hexadécimaux)"""
+    return uuid.uuid4().hex
+
+
+def check_transfer_id(transfer_id):
+    """
+    Vérifie un identifiant de transfert reçu d'un pair
+
+    Returns:
+        L'identifiant
+
+    Raises:
+        ProtocolError: pas exactement 32 caractères hexadécimaux minuscules
+    """
+    if not isinstance(transfer_id, str) or not _TRANSFER_ID_RE.match(transfer_id):
+        raise protocol.ProtocolError(f"Identifiant de transfert invalide: {transfer_id!r}")
+    return transfer_id
+
+
+def file_sha256(path):
+    """Calcule le SHA-256 d'un fichier sans le charger en mémoire"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_begin(transfer_id, filename, mimetype, size, sha256):
+    meta = {'id': transfer_id, 'name': filename, 'mime': mimetype, 'size': size, 'sha256': sha256}
+    return protocol.encode_frame(protocol.FILE_BEGIN, json.dumps(meta).encode('utf-8'))
+
+
+def encode_end(transfer_id, sha256, proof=None):
+    meta = {'id': transfer_id, 'sha256': sha256}
+    if proof is not None:
+        meta['proof'] = proof
+    return protocol.encode_frame(protocol.FILE_END, json.dumps(meta).encode('utf-8'))
+
+
+def encode_have(transfer_id, ranges, complete=False, challenge=None):
+    """
+    Trame FILE_HAVE : plages [offset, longueur] déjà présentes chez le récepteur,
+    et éventuellement le défi de possession d'un contenu déjà stocké
+    """
+    meta = {'id': transfer_id, 'ranges': [list(r) for r in ranges]}
+    if complete:
+        meta['complete'] = True
+    if challenge is not None:
+        meta['proof'] = challenge
+    return protocol.encode_frame(protocol.FILE_HAVE, json.dumps(meta).encode('utf-8'))
+
+
+def possession_proof(path, nonce, offset, length):
+    """SHA-256 (hexadécimal) du nonce suivi de la plage [offset, offset + length) du fichier"""
+    digest = hashlib.sha256(bytes.fromhex(nonce))
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        digest.update(f.read(min(length, PROOF_SIZE)))
+    return digest.hexdigest()
+
+
+def new_challenge(path, size):
+    """
+    Défi de possession sur une plage tirée au hasard
+
+    Args:
+        path: fichier stocké de même hash, None si le contenu est absent (le
+            défi est envoyé quand même : sa présence ne révèle rien)
+        size: taille annoncée
+
+    Returns:
+        Tuple (défi à envoyer {"nonce", "offset", "length"}, preuve attendue ou None)
+    """
+    length = min(size, PROOF_SIZE)
+    challenge = {'nonce': secrets.token_hex(16), 'offset': secrets.randbelow(size - length + 1),
+                 'length': length}
+    if path is None:
+        return challenge, None
+    return challenge, possession_proof(path, challenge['nonce'], challenge['offset'], length)
+
+
+def chunk_header(transfer_id, offset, length):
+    """En-tête d'une trame FILE_CHUNK, à faire suivre de `length` octets bruts"""
+    header = CHUNK_HEADER.pack(bytes.fromhex(transfer_id), offset)
+    return (bytes((protocol.FILE_CHUNK,))
+            + protocol.encode_varint(CHUNK_HEADER.size + length)
+            + header)
+
+
+def merge_ranges(ranges):
+    """Fusionne des plages (offset, longueur) contiguës ou qui se chevauchent"""
+    merged = []
+    for offset, length in sorted(ranges):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_length = merged[-1]
+            merged[-1] = (last_offset, max(last_length, offset + length - last_offset))
+        else:
+            merged.append((offset, length))
+    return merged
+
+
+def missing_ranges(have, size):
+    """
+    Plages d'un fichier absentes chez le récepteur
+
+    Args:
+        have: plages (offset, longueur) déjà reçues
+        size: taille du fichier
+
+    Returns:
+        Liste de plages (offset, longueur) à envoyer
+    """
+    missing = []
+    position = 0
+    for offset, length in merge_ranges(have):
+        if offset > position:
+            missing.append((position, offset - position))
+        position = max(position, offset + length)
+    if position < size:
+        missing.append((position, size - position))
+    return missing
+
+
+def send_ranges(conn, path, transfer_id, ranges):
+    """
+    Envoie des plages d'un fichier en trames FILE_CHUNK
+
+    Returns:
+        Nombre d'octets de contenu envoyés
+    """
+    sent = 0
+    with open(path, 'rb') as f:
+        for offset, length in ranges:
+            end = offset + length
+            while offset < end:
+                count = min(CHUNK_SIZE, end - offset)
+                conn.send_file_chunk(chunk_header(transfer_id, offset, count), f, offset, count)
+                metrics.FILE_BYTES_SENT.inc(count)
+                offset += count
+                sent += count
+    return sent
+
+
+class OutgoingTransfers:
+    """Transferts envoyés sur une connexion : attente des FILE_HAVE et suivi SQLite"""
+
+    def __init__(self, db=None):
+        """
+        Args:
+            db: Database où noter les transferts (None: pas de reprise)
+        """
+        self.db = db
+        self.lock = threading.Lock()
+        self._waiters = {}
+
+    def send(self, conn, path, filename, mimetype, peer=None, transfer_id=None, sha256=None):
+        """
+        Envoie un fichier présent sur disque en flux
+
+        Args:
+            conn: connexion v2 (SocketConnection ou StreamConnection)
+            path: chemin du fichier source
+            filename: nom annoncé au destinataire
+            mimetype: type MIME
+            peer: pair distant, pour retrouver le transfert après reconnexion
+            transfer_id: transfert interrompu à reprendre (None: nouveau)
+            sha256: hash du fichier s'il est déjà connu (blob)
+
+        Returns:
+            Tuple (taille, sha256)
+        """
+        size = os.path.getsize(path)
+        sha256 = sha256 or file_sha256(path)
+
+        previous = self.db.get_transfer(transfer_id) if self.db and transfer_id else None
+        if previous is None or previous['sha256'] != sha256 or previous['size'] != size:
+            # Nouveau transfert, ou fichier source modifié depuis la coupure
+            transfer_id = new_transfer_id()
+            if self.db:
+                self.db.start_transfer(transfer_id, 'sent', peer, filename, mimetype,
+                                       size, sha256, str(path))
+
+        waiter = self._exchange(conn, transfer_id, encode_begin(transfer_id, filename, mimetype, size, sha256))
+        if waiter[3] is not None and not waiter[2]:
+            # Défi de possession : une preuve au lieu des morceaux ; si le destinataire
+            # n'a pas ce contenu, il la refuse et redemande le fichier (FILE_HAVE vide)
+            challenge = waiter[3]
+            proof = possession_proof(path, challenge['nonce'], int(challenge['offset']),
+                                     int(challenge['length']))
+            waiter = self._exchange(conn, transfer_id, encode_end(transfer_id, sha256, proof))
+
+        if waiter[2]:
+            # Le destinataire a déjà ce contenu : rien à envoyer
+            if self.db:
+                self.db.finish_transfer(transfer_id, 'complete')
+            metrics.FILES_SENT.inc()
+            return size, sha256
+        send_ranges(conn, path, transfer_id, missing_ranges(waiter[1], size))
+        conn.send(encode_end(transfer_id, sha256))
+        metrics.FILES_SENT.inc()
+        return size, sha256
+
+    def _exchange(self, conn, transfer_id, frame):
+        """
+        Envoie une trame et attend le FILE_HAVE qui y répond (HAVE_TIMEOUT au plus)
+
+        Returns:
+            [réponse reçue, plages présentes, complet, défi de possession]
+
+        Raises:
+            ConnectionError: connexion fermée pendant l'attente
+        """
+        waiter = [threading.Event(), [], False, None]
+        with self.lock:
+            self._waiters[transfer_id] = waiter
+        try:
+            conn.send(frame)
+            waiter[0].wait(HAVE_TIMEOUT)
+        finally:
+            with self.lock:
+                self._waiters.pop(transfer_id, None)
+        if waiter[1] is None:
+            raise ConnectionError("Connexion fermée pendant le transfert")
+        return waiter
+
+    def on_have(self, payload):
+        """Traite une trame FILE_HAVE : réponse à FILE_BEGIN, à une preuve, ou acquittement final"""
+        meta = json.loads(payload)
+        ranges = [(int(offset), int(length)) for offset, length in meta.get('ranges', [])]
+        with self.lock:
+            waiter = self._waiters.get(meta['id'])
+        if waiter is not None:
+            waiter[1] = ranges
+            waiter[2] = bool(meta.get('complete'))
+            waiter[3] = meta.get('proof')
+            waiter[0].set()
+        elif meta.get('complete') and self.db:
+            self.db.finish_transfer(meta['id'], 'complete')
+
+    def cancel_all(self):
+        """Débloque les envois en attente de FILE_HAVE (déconnexion)"""
+        with self.lock:
+            for waiter in self._waiters.values():
+                waiter[1] = None
+                waiter[0].set()
+            self._waiters.clear()
+
+
+class IncomingTransfer:
+    """Fichier en cours de réception, écrit dans un `.part` puis rangé dans le BlobStore"""
+
+    def __init__(self, store, transfer_id, filename, mimetype, size, resume=False):
+        self.store = store
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self.size = size
+        self.path = None
+        self.part_path = store.part_path(transfer_id)
+        self.file = open(self.part_path, 'r+b' if resume else 'wb')
+        self.chunks = {}
+        self.unsaved = []
+        self.unsaved_bytes = 0
+        self.received = 0
+        self.sha256 = None
+        self.complete = False
+        # (sha256 annoncé, preuve attendue) quand ce contenu est déjà stocké (new_challenge)
+        self.expected_proof = None
+        self._digest = None if resume else hashlib.sha256()
+        self._next_offset = 0
+
+    def verify(self, chunks):
+        """
+        Reprend les morceaux notés en base dont le CRC32 correspond au contenu
+        du fichier `.part` (un morceau coupé en cours d'écriture est ignoré)
+
+        Args:
+            chunks: tuples (offset, longueur, crc32) lus dans SQLite
+        """
+        for offset, length, crc in chunks:
+            self.file.seek(offset)
+            data = self.file.read(length)
+            if len(data) == length and zlib.crc32(data) == crc:
+                self.chunks[offset] = (length, crc)
+                self.received += length
+
+    def ranges(self):
+        """Plages (offset, longueur) reçues"""
+        return merge_ranges((offset, length) for offset, (length, _crc) in self.chunks.items())
+
+    def write(self, offset, data):
+        """
+        Écrit un morceau à son offset
+
+        Raises:
+            ProtocolError: morceau hors de la taille annoncée par FILE_BEGIN
+        """
+        if offset < 0 or offset + len(data) > self.size:
+            raise protocol.ProtocolError(f"Morceau hors du fichier ({offset}+{len(data)} > {self.size} octets)")
+        self.file.seek(offset)
+        self.file.write(data)
+        crc = zlib.crc32(data)
+        self.chunks[offset] = (len(data), crc)
+        self.unsaved.append((offset, len(data), crc))
+        self.unsaved_bytes += len(data)
+        self.received += len(data)
+        if self._digest is not None and offset == self._next_offset:
+            self._digest.update(data)
+            self._next_offset += len(data)
+        else:
+            # Morceaux hors ordre ou reprise : le hash sera recalculé sur le fichier complet
+            self._digest = None
+
+    def take_unsaved(self):
+        """Vide le fichier sur disque et retourne les morceaux à noter en base"""
+        self.file.flush()
+        unsaved = self.unsaved
+        self.unsaved = []
+        self.unsaved_bytes = 0
+        return unsaved
+
+    def finish(self, sha256):
+        """Vérifie le fichier complet et le range dans le store ; retourne True si le hash correspond"""
+        self.file.close()
+        digest = self._digest.hexdigest() if self._digest else file_sha256(self.part_path)
+        if digest != sha256:
+            os.remove(self.part_path)
+            return False
+        self.path = self.store.commit(self.part_path, digest)
+        self.sha256 = digest
+        self.complete = True
+        return True
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+class StoredFile:
+    """Fichier dont l'émetteur a prouvé avoir le contenu déjà stocké : aucun morceau reçu"""
+
+    complete = True
+
+    def __init__(self, filename, mimetype, size, sha256, path):
+        self.filename = filename
+        self.mimetype = mimetype
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.received = size
+
+
+class IncomingTransfers:
+    """Transferts en cours de réception sur une connexion"""
+
+    def __init__(self, store, db=None, peer=None):
+        """
+        Args:
+            store: BlobStore où ranger les fichiers reçus
+            db: Database où noter les morceaux reçus (None: pas de reprise)
+            peer: pair distant, enregistré avec chaque transfert
+        """
+        self.store = store
+        self.db = db
+        self.peer = peer
+        self.active = {}
+
+    def begin(self, payload):
+        """
+        Démarre (ou reprend) la réception d'un fichier
+
+        Args:
+            payload: charge utile d'une trame FILE_BEGIN
+
+        Returns:
+            Tuple (fichier, trame FILE_HAVE à renvoyer à l'émetteur). Le fichier
+            est un IncomingTransfer ou None (transfert déjà reçu) ; si le
+            contenu est déjà stocké, FILE_HAVE porte un défi de possession
+        """
+        meta = json.loads(payload)
+        transfer_id = check_transfer_id(meta['id'])
+        size = int(meta['size'])
+        if size < 0:
+            raise protocol.ProtocolError(f"Taille de fichier invalide ({size})")
+        sha256 = meta.get('sha256')
+        filename = os.path.basename(meta['name'])
+        mimetype = meta.get('mime') or 'application/octet-stream'
+        previous = self.active.pop(transfer_id, None)
+        if previous:
+            self._suspend(previous)
+
+        row = self.db.get_transfer(transfer_id) if self.db else None
+        if row and row['direction'] == 'received' and row['size'] == size and row['sha256'] == sha256:
+            if row['status'] == 'complete' and self.store.has(sha256):
+                return None, encode_have(transfer_id, [(0, size)], complete=True)
+            if row['status'] == 'partial' and self.store.part_path(transfer_id).exists():
+                transfer = IncomingTransfer(self.store, transfer_id, row['filename'], row['mimetype'],
+                                            size, resume=True)
+                transfer.verify(self.db.get_transfer_chunks(transfer_id))
+                self.active[transfer_id] = transfer
+                return transfer, encode_have(transfer_id, transfer.ranges())
+
+        transfer = IncomingTransfer(self.store, transfer_id, filename, mimetype, size)
+        # Contenu peut-être déjà reçu (d'un autre pair ou sous un autre nom) : l'émetteur
+        # doit prouver qu'il l'a. Le défi part dans tous les cas, pour ne pas révéler
+        # le contenu du store ; sans réponse au défi, l'émetteur envoie les morceaux
+        stored = self.store.has(sha256) and self.store.path(sha256).stat().st_size == size
+        challenge, proof = new_challenge(self.store.path(sha256) if stored else None, size)
+        transfer.expected_proof = (sha256, proof)
+        if self.db:
+            self.db.start_transfer(transfer_id, 'received', self.peer, filename, mimetype,
+                                   size, sha256, str(transfer.part_path))
+        self.active[transfer_id] = transfer
+        return transfer, encode_have(transfer_id, [], challenge=challenge)
+
+    def chunk(self, payload):
+        """
+        Écrit une trame FILE_CHUNK ; retourne le transfert concerné (ou None)
+
+        Raises:
+            ProtocolError: trame plus courte que l'en-tête de morceau
+        """
+        if len(payload) < CHUNK_HEADER.size:
+            raise protocol.ProtocolError(f"Morceau tronqué ({len(payload)} < {CHUNK_HEADER.size} octets)")
+        raw_id, offset = CHUNK_HEADER.unpack_from(payload)
+        transfer = self.active.get(check_transfer_id(raw_id.hex()))
+        if transfer is None:
+            return None
+        with memoryview(payload) as view:
+            transfer.write(offset, view[CHUNK_HEADER.size:])
+        metrics.FILE_BYTES_RECEIVED.inc(len(payload) - CHUNK_HEADER.size)
+        if self.db and transfer.unsaved_bytes >= CHECKPOINT_BYTES:
+            self.db.save_transfer_chunks(transfer.transfer_id, transfer.take_unsaved())
+        return transfer
+
+    def end(self, payload):
+        """
+        Termine un transfert (trame FILE_END)
+
+        Returns:
+            Tuple (IncomingTransfer ou StoredFile, hash ou preuve valide, trame
+            d'acquittement ou None) ; (None, False, None) si le transfert est
+            inconnu ; (None, False, FILE_HAVE vide) si la preuve de possession
+            est refusée : le transfert continue, la trame redemande le fichier
+        """
+        meta = json.loads(payload)
+        transfer = self.active.pop(check_transfer_id(meta['id']), None)
+        if transfer is None:
+            return None, False, None
+        if 'proof' in meta:
+            return self._prove(transfer, meta)
+        valid = transfer.finish(meta['sha256'])
+        if self.db:
+            self.db.finish_transfer(transfer.transfer_id, 'complete' if valid else 'failed')
+        if not valid:
+            return transfer, False, None
+        metrics.FILES_RECEIVED.inc()
+        return transfer, True, encode_have(transfer.transfer_id, [(0, transfer.size)], complete=True)
+
+    def _prove(self, transfer, meta):
+        """FILE_END avec preuve de possession : le fichier est celui déjà stocké"""
+        sha256, expected = transfer.expected_proof or (None, None)
+        transfer.expected_proof = None
+        valid = (expected is not None and isinstance(meta['proof'], str)
+                 and hmac.compare_digest(meta['proof'], expected)
+                 and self.store.has(sha256))
+        if not valid:
+            # Même réponse que le contenu soit absent ou la preuve fausse : envoyer le fichier
+            self.active[transfer.transfer_id] = transfer
+            return None, False, encode_have(transfer.transfer_id, [])
+        transfer.discard()
+        if self.db:
+            self.db.finish_transfer(transfer.transfer_id, 'complete')
+        path = self.store.path(sha256)
+        # Taille du blob stocké, pas celle annoncée par l'émetteur
+        item = StoredFile(transfer.filename, transfer.mimetype, path.stat().st_size, sha256, path)
+        metrics.FILES_RECEIVED.inc()
+        return item, True, encode_have(transfer.transfer_id, [(0, item.size)], complete=True)
+
+    def _suspend(self, transfer):
+        if self.db is None:
+            transfer.discard()
+            return
+        unsaved = transfer.take_unsaved()
+        transfer.file.close()
+        if unsaved:
+            self.db.save_transfer_chunks(transfer.transfer_id, unsaved)
+
+    def suspend_all(self):
+        """
+        Interrompt les transferts incomplets (déconnexion) : les fichiers
+        `.part` et les morceaux notés en base sont gardés pour une reprise
+        """
+        for transfer in self.active.values():
+            self._suspend(transfer)
+        self.active.clear()
@@ -82,8 +82,8 @@ def index():
                 conn.row_factory = sqlite3.Row
                 c = conn.cursor()
                 
-                # Récupérer toutes les tables
-                c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                # Récupérer toutes les tables (sauf l'index plein texte et ses tables internes)
+                c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'messages_fts%'")
                 tables = c.fetchall()
                 
                 db_data = {}